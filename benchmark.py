@@ -0,0 +1,301 @@
+import argparse
+import contextlib
+import fnmatch
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from links import LinkLayer
+from simulation import Medium, Packet, rng_init, noise_cache_init
+from topology import load_topology
+from workload import read_chunks
+
+# Benchmarks of the simulator itself, to tell whether a change made it faster or slower.
+# Microbenchmarks time the hot paths on their own (Medium.tick with a number of transfers in flight, ticking every link of a topology one by one or together in a LinkLayer, aodv.Router.process for each kind of control message, baseline_fast.Router.process on topologies of each size, loading topologies and workloads), and end-to-end benchmarks time whole simulations of the procedural topologies with a fixed seed, both event-driven and stepping every unit of time (which one is faster depends on how busy the network is).
+# Every benchmark runs in a freshly spawned worker process of its own (one at a time, so they don't compete for the CPU), which keeps its peak RSS its own whatever else has run, and the fastest of its repeats is kept.
+# Results are written out as JSON, appended to a local history file, and compared against a baseline stored on the same machine, flagging anything that got slower or bigger than it by more than a tolerance.
+# Timings are only comparable on one machine, so the baseline and history are kept out of the repository (benchmarks/ is ignored), and the tolerance on speed widens with how much a benchmark's own repeated runs varied.
+
+SEED = 0
+REPEATS = {'micro': 5, 'end_to_end': 3} # times each kind of benchmark is run at least, keeping the fastest (and measuring how much they vary)
+MIN_TIME = 2                            # seconds each benchmark keeps being repeated for at least (setting up included), so that quick ones get enough runs to be steady
+TICKS = 5000                            # ticks timed by the Medium.tick benchmarks
+CALLS = 20000                           # calls timed by the aodv process() benchmarks
+ROUTES = 2000                           # packets routed by the baseline_fast process() benchmarks
+LOADS = 20                              # times topologies and workloads get loaded by the loading benchmarks
+MICRO_TOPOLOGY = '100_hosts_procedural_1'
+TOPOLOGIES = ('20_hosts_procedural_1', '100_hosts_procedural_1', '500_hosts_procedural_1')
+END_TO_END = [ # (algorithm, topology, scenario, time limit), AODV gets a shorter run on 500 hosts since it floods the network with control messages
+    ('baseline_fast', '20_hosts_procedural_1', 'normal', 3000),
+    ('aodv', '20_hosts_procedural_1', 'normal', 3000),
+    ('baseline_fast', '100_hosts_procedural_1', 'normal', 3000),
+    ('aodv', '100_hosts_procedural_1', 'normal', 3000),
+    ('baseline_slow', '100_hosts_procedural_2', 'topology_shift', 3000), # Busy, routers have packets queued on nearly every unit of time
+    ('aodv', '100_hosts_procedural_2', 'disruption', 1000),
+    ('baseline_fast', '500_hosts_procedural_1', 'normal', 3000),
+    ('aodv', '500_hosts_procedural_1', 'normal', 300),
+]
+MODES = {'event': True, 'tick': False} # name : main.EVENT_DRIVEN, every end-to-end benchmark is run both ways
+
+BASELINE = 'benchmarks/baseline.json'
+HISTORY = 'benchmarks/history.jsonl'
+TOLERANCE = 0.1         # relative drop in speed before a benchmark is flagged as a regression, at least (see regressions())
+MEMORY_TOLERANCE = 0.2  # relative rise in peak RSS before a benchmark is flagged as a regression
+
+# Instantiate the media of a topology for microbenchmarks, without a noise cache (noise is generated lazily, and only Medium.tick needs any).
+def build(algorithm, topology, limit=TICKS):
+    import main # Deferred, since importing it sets up the simulation
+    rng_init(SEED)
+    compiled = load_topology(topology)
+    noise_cache_init(main.HURST, main.RATE_DEVIATION, limit+1, int(compiled.ids.max()) + 1, SEED, None)
+    return main.build_media(algorithm, compiled, limit)
+
+# Total seconds spent in call() over count calls, with setup() run (untimed) before each one.
+def timed(call, count, setup=None):
+    total = 0
+    for i in range(count):
+        if setup: setup(i)
+        start = time.perf_counter()
+        call()
+        total += time.perf_counter() - start
+    return total
+
+# Medium.tick on a medium with the given number of transfers in flight, which never finish.
+def medium_tick(transfers, ticks=TICKS):
+    import main
+    rng_init(SEED)
+    noise_cache_init(main.HURST, main.RATE_DEVIATION, ticks, 1, SEED, None)
+    medium = Medium(0, transfers, 1, 10000, 0, main.RATE_DEVIATION, ticks)
+    for t in range(ticks): medium.throughput[t] # Generate the noise up front, so only ticking gets timed
+    medium.in_transit = [[Packet(0, 1, size=1000), None, math.inf] for _ in range(transfers)]
+    start = time.perf_counter()
+    for t in range(ticks):
+        medium.tick(t)
+    return ticks, time.perf_counter() - start
+
+# Every passive link of a topology ticked for a number of ticks, each with the given number of transfers in flight (at most its pathways), which never finish.
+# Either each link ticks on its own, as in the event engine, or they are all counted down together by a LinkLayer, as in the fixed-step loop with VECTORIZED_LINKS.
+def links_tick(vectorized, transfers, ticks=TICKS):
+    media = build('baseline_fast', MICRO_TOPOLOGY, ticks)
+    links = [medium for medium in media.values() if not medium.logic and all(connection.logic for connection in medium.connections)]
+    for link in links:
+        for index in range(len(link.throughput.blocks)): link.throughput.generate(index) # Generate the noise up front, so only ticking gets timed
+    layer = LinkLayer(links) if vectorized else None
+    for link in links:
+        for _ in range(min(transfers, link.pathways)):
+            packet = Packet(0, 1, size=1000)
+            link.in_transit.append(layer.add(link, packet, None, math.inf) if layer else [packet, None, math.inf])
+    start = time.perf_counter()
+    for t in range(ticks):
+        if layer:
+            layer.tick(t)
+        else:
+            for link in links: link.tick(t)
+    return ticks, time.perf_counter() - start
+
+# aodv.Router.process handling one kind of message from a neighbor, with the router's tables put back the way they were before every call.
+# Whatever the router sends on goes no further than the media it is connected to, which are emptied between calls so that they always have room.
+def aodv_process(kind, calls=CALLS):
+    from routing_algorithms import aodv
+    media = build('aodv', MICRO_TOPOLOGY)
+    routers = [medium for medium in media.values() if medium.logic]
+    router = routers[0]
+    neighbor, link = next(iter(router.network.neighbors[router.id].items()))
+    dest = next(medium.id for medium in reversed(routers) if medium.id != neighbor and medium.id not in router.network.neighbors[router.id])
+    router.neighbors_table[neighbor] = (0, link.id)
+    messages = {
+        'hello': lambda i: aodv.Hello(),
+        'rreq': lambda i: aodv.RREQ(dest, 1, i+1),              # for a destination it has no route to, so it floods it on
+        'rrep': lambda i: aodv.RREP(dest, 1, neighbor, 2, i+1), # with a new route, which it takes and floods on
+        'rerr': lambda i: aodv.RERR([dest], i+1),               # for a route it has, which it deletes and floods on
+    }
+    packet = None
+    def setup(i):
+        nonlocal packet
+        for connection in router.connections: connection.in_transit.clear()
+        if kind in ('rerr', 'data'):
+            router.set_route(dest, (0, 1, neighbor, 2))
+        elif dest in router.routes_table:
+            router.delete_route(dest)
+        packet = Packet(neighbor, dest, size=1000) if kind == 'data' else Packet(neighbor, -1, content=messages[kind](i))
+        packet.time_sent = 0
+    return calls, timed(lambda: router.process(packet, link), calls, setup)
+
+# baseline_fast.Router.process routing packets between random pairs of routers of a topology.
+def baseline_fast_process(topology, calls=ROUTES):
+    media = build('baseline_fast', topology)
+    routers = [medium for medium in media.values() if medium.logic]
+    rng = random.Random(SEED)
+    pairs = [(rng.choice(routers), rng.choice(routers).id) for _ in range(calls)]
+    router = packet = None
+    def setup(i):
+        nonlocal router, packet
+        router, dest = pairs[i]
+        for connection in router.connections: connection.in_transit.clear()
+        packet = Packet(router.id, dest, size=1000)
+    return calls, timed(lambda: router.process(packet, None), calls, setup)
+
+# Compiling a topology CSV into arrays (without the cache) a number of times, counting media.
+def compile_topology(topology, loads=LOADS):
+    start = time.perf_counter()
+    media = sum(len(load_topology(topology, cache=None)) for _ in range(loads))
+    return media, time.perf_counter() - start
+
+# Reading every row of a workload a number of times, counting rows.
+def read_workload(workload, loads=LOADS):
+    filename = f'workloads/{workload}.bin'
+    if not os.path.exists(filename): filename = f'workloads/{workload}.csv'
+    start = time.perf_counter()
+    rows = sum(len(chunk) for _ in range(loads) for chunk in read_chunks(filename))
+    return rows, time.perf_counter() - start
+
+# A whole simulation, counting units of simulated time (lower bounds are left out, they are analysis rather than simulation).
+def end_to_end(algorithm, topology, scenario, limit, event_driven):
+    import main
+    main.LOWER_BOUNDS = False
+    main.EVENT_DRIVEN = event_driven
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        report = main.main(algorithm, topology, topology, scenario, SEED, limit)
+    return report['time'], time.perf_counter() - start
+
+# Noise caches of the end-to-end runs, if main.NOISE_CACHE turns the cache on, filled up front so that no timed run pays for generating its noise.
+def prepare(limit, topology):
+    import main
+    compiled = load_topology(topology)
+    rng_init(SEED)
+    noise_cache_init(main.HURST, main.RATE_DEVIATION, limit+1, int(compiled.ids.max()) + 1, SEED, main.NOISE_CACHE, main.NOISE_CACHE_SIZE)
+
+# name : (kind, function, arguments, unit counted)
+BENCHMARKS = {}
+for transfers in (1, 16, 256):
+    BENCHMARKS[f'medium.tick/{transfers}'] = ('micro', medium_tick, (transfers,), 'ticks')
+for transfers in (1, 16):
+    BENCHMARKS[f'links.tick/per_link/{transfers}'] = ('micro', links_tick, (False, transfers), 'ticks')
+    BENCHMARKS[f'links.tick/link_layer/{transfers}'] = ('micro', links_tick, (True, transfers), 'ticks')
+for kind in ('hello', 'rreq', 'rrep', 'rerr', 'data'):
+    BENCHMARKS[f'aodv.process/{kind}'] = ('micro', aodv_process, (kind,), 'calls')
+for topology in TOPOLOGIES:
+    BENCHMARKS[f'baseline_fast.process/{topology}'] = ('micro', baseline_fast_process, (topology,), 'calls')
+for topology in TOPOLOGIES:
+    BENCHMARKS[f'load_topology/{topology}'] = ('micro', compile_topology, (topology,), 'media')
+    BENCHMARKS[f'read_workload/{topology}'] = ('micro', read_workload, (topology,), 'rows')
+for algorithm, topology, scenario, limit in END_TO_END:
+    for mode, event_driven in MODES.items():
+        BENCHMARKS[f'end_to_end/{mode}/{algorithm}/{topology}/{scenario}'] = ('end_to_end', end_to_end, (algorithm, topology, scenario, limit, event_driven), 'ticks')
+
+# Run one benchmark (in a worker process) the given number of times, and then again until min_time seconds have gone by, returning the result of the fastest run.
+def run(name, repeat, min_time=MIN_TIME):
+    kind, function, arguments, unit = BENCHMARKS[name]
+    runs = []
+    start = time.perf_counter()
+    while len(runs) < repeat or time.perf_counter() - start < min_time:
+        runs.append(function(*arguments))
+    count, seconds = min(runs, key=lambda result: result[1])
+    return {
+        'unit': unit,
+        'count': count,
+        'wall_time': seconds,
+        'per_second': count / seconds if seconds else None,
+        'runs': len(runs),
+        'spread': 1 - seconds / statistics.median(seconds for _, seconds in runs) if seconds else 0, # how much slower than the fastest run the median one was, relatively
+        'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024, # bytes, ru_maxrss is in KiB on Linux
+    }
+
+# What the results were measured on, since they are only comparable with results from the same machine.
+def environment():
+    try:
+        commit = subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+# Run the named benchmarks one after another, each in a freshly spawned worker process.
+def benchmark(names, repeat=None):
+    for algorithm, topology, scenario, limit in END_TO_END:
+        if any(f'end_to_end/{mode}/{algorithm}/{topology}/{scenario}' in names for mode in MODES): prepare(limit, topology)
+    results = dict(environment(), benchmarks={})
+    for name in names:
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            result = pool.submit(run, name, repeat or REPEATS[BENCHMARKS[name][0]]).result()
+        results['benchmarks'][name] = result
+        print(f'{name}: {result["per_second"]:.1f} {result["unit"]}/s, {result["wall_time"]:.3f}s (median run {result["spread"]:.0%} slower), peak RSS {result["peak_rss"] / 2**20:.1f}MiB')
+    return results
+
+# Benchmarks that got slower or bigger than in the baseline by more than the tolerances, as (name, what, baseline value, value).
+# A drop in speed within twice the spread of the benchmark's runs, in the baseline or now, is put down to noise.
+def regressions(results, baseline, tolerance=TOLERANCE, memory_tolerance=MEMORY_TOLERANCE):
+    flagged = []
+    for name, result in results['benchmarks'].items():
+        base = baseline['benchmarks'].get(name)
+        if base is None: continue
+        if result['per_second'] < base['per_second'] * (1 - max(tolerance, 2 * base.get('spread', 0), 2 * result['spread'])): flagged.append((name, 'per_second', base['per_second'], result['per_second']))
+        if result['peak_rss'] > base['peak_rss'] * (1 + memory_tolerance): flagged.append((name, 'peak_rss', base['peak_rss'], result['peak_rss']))
+    return flagged
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the simulator, and compare the results against a stored baseline.')
+    parser.add_argument('patterns', nargs='*', help='names of the benchmarks to run, shell-style wildcards allowed (default: all of them)')
+    parser.add_argument('--list', action='store_true', help='list the benchmarks and exit')
+    parser.add_argument('--micro', action='store_true', help='only run the microbenchmarks')
+    parser.add_argument('--repeat', type=int, help=f'times to run each benchmark, keeping the fastest (default: {REPEATS})')
+    parser.add_argument('--output', default='benchmark.json', help='file to write the results to')
+    parser.add_argument('--baseline', default=BASELINE, help='results to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the baseline (merged into it, if only some benchmarks were run)')
+    parser.add_argument('--history', default=HISTORY, help='file to append the results to as a line of JSON (empty to not keep any history)')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='relative drop in speed that counts as a regression')
+    parser.add_argument('--memory-tolerance', type=float, default=MEMORY_TOLERANCE, help='relative rise in peak RSS that counts as a regression')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    names = [name for name in BENCHMARKS if not args.patterns or any(fnmatch.fnmatchcase(name, pattern) for pattern in args.patterns)]
+    if args.micro: names = [name for name in names if BENCHMARKS[name][0] == 'micro']
+    if args.list:
+        print('\n'.join(names))
+        sys.exit()
+    if not names: raise RuntimeError(f'Benchmark: nothing matches {args.patterns}, see --list')
+    results = benchmark(names, args.repeat)
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=2)
+    if args.history:
+        os.makedirs(os.path.dirname(args.history) or '.', exist_ok=True)
+        with open(args.history, 'a') as history:
+            history.write(json.dumps(results) + '\n')
+    flagged = []
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+        if (baseline['platform'], baseline['processor'], baseline['cpus']) != (results['platform'], results['processor'], results['cpus']):
+            print(f'WARNING: the baseline was measured on {baseline["platform"]} ({baseline["processor"]}, {baseline["cpus"]} CPUs), so the comparison says as much about the machine as about the code')
+        flagged = regressions(results, baseline, args.tolerance, args.memory_tolerance)
+        for name, what, base, value in flagged:
+            print(f'REGRESSION: {name} {what} went from {base:.1f} to {value:.1f} ({value / base - 1:+.1%})')
+        print(f'{len(flagged)} REGRESSIONS AGAINST THE BASELINE FROM {baseline["commit"]} ({len(set(results["benchmarks"]) & set(baseline["benchmarks"]))} BENCHMARKS COMPARED)')
+    else:
+        baseline = None
+        if not args.save_baseline: print(f'NO BASELINE AT {args.baseline}, RUN WITH --save-baseline TO STORE ONE')
+    if args.save_baseline:
+        if baseline is not None: results = dict(results, benchmarks=dict(baseline['benchmarks'], **results['benchmarks']))
+        os.makedirs(os.path.dirname(args.baseline) or '.', exist_ok=True)
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+        print(f'SAVED BASELINE TO {args.baseline}')
+    print(f'RESULTS IN {args.output}')
+    if flagged: sys.exit(1)
@@ -0,0 +1,104 @@
+import heapq
+
+import tracing
+
+# Discrete-event alternative to stepping every medium on every unit of time.
+# Each medium tells the engine the next timestamp at which ticking it would actually do anything (a packet finishing its transfer, a protocol timer expiring, a queue that needs attending to), and the engine keeps those in a priority queue.
+# Time then jumps straight from one event to the next, and only the media that are due get ticked, in the same order the fixed-step loop would tick them.
+# Whatever a medium does on the ticks it skips (counting down transfer timers, updating clocks) is caught up by Medium.advance() right before it is next touched, so the results match the fixed-step loop exactly.
+# A router whose queued packets are all waiting for room in full links would get nowhere by attending to them on every tick, so it sleeps until one of those links finishes a transfer (see Queue).
+
+class EventEngine:
+    def __init__(self, media, scenario, limit):
+        self.media = list(media.values()) # Tick order, same as the fixed-step loop
+        self.media_table = media
+        self.scenario = scenario
+        self.limit = limit
+        self.positions = {medium.id: i for i, medium in enumerate(self.media)}
+        self.wakes = [None] * len(self.media) # position : timestamp the medium is currently scheduled for
+        self.queue = []                       # heap of (timestamp, position), entries that no longer match self.wakes are stale and skipped
+        self.now = 0
+        self.cursor = -1                      # position of the medium being ticked, -1 before any have been ticked at self.now and len(media) after all of them have
+        self.steps = 0                        # number of timestamps that actually had something to do
+        self.waiting = {}                     # medium : media with queues stalled waiting for room in it (possibly no longer)
+        for medium in self.media:
+            medium.scheduler = self
+            self.reschedule(medium)
+    # Bring a medium up to date with the current moment before something outside changes it.
+    # Media earlier in the tick order than the cursor have already (possibly idly) been ticked at the current timestamp, the rest have not.
+    def sync(self, medium):
+        if self.positions[medium.id] < self.cursor:
+            medium.advance(self.now)
+        else:
+            medium.advance(self.now - 1)
+    # Work out when a medium next needs ticking, and queue it up for then.
+    # A medium that is already due at the earliest moment it could be is left alone, it will be rescheduled once it is ticked anyway.
+    def reschedule(self, medium):
+        position = self.positions[medium.id]
+        after = medium.clock + 1
+        if self.wakes[position] is not None and self.wakes[position] <= after: return
+        time = medium.next_event(after)
+        if time is not None and time < after: time = after
+        if time == self.wakes[position]: return
+        self.wakes[position] = time
+        if time is not None: heapq.heappush(self.queue, (time, position))
+    # Wake a medium whose queues are stalled, so that it attends to them at its next tick.
+    def wake(self, medium):
+        self.sync(medium)
+        medium.unstall()
+        self.reschedule(medium)
+    # A medium has finished transfers and so has room again, wake whatever is waiting for that.
+    def freed(self, medium):
+        for waiting in self.waiting.pop(medium, ()):
+            if medium in waiting.stalled(): self.wake(waiting)
+    # Timestamp of the next thing that needs to happen, given the time the next workload packet gets injected (or None if there are no more).
+    def next_time(self, injection_time=None):
+        while self.queue and self.wakes[self.queue[0][1]] != self.queue[0][0]:
+            heapq.heappop(self.queue)
+        times = [injection_time, self.scenario.next_event(self.now)]
+        if self.queue: times.append(self.queue[0][0])
+        times = [time for time in times if time is not None]
+        return min(times) if times else None
+    # Simulate a single timestamp, injecting the given workload packets, ticking the media that are due and then the scenario.
+    def step(self, timestamp, packets):
+        self.now = timestamp
+        self.steps += 1
+        if tracing.tracer: tracing.tracer.now = timestamp
+        self.cursor = -1
+        for packet in packets:
+            packet.time_sent = timestamp
+            self.media_table[packet.source].receive(packet, None)
+        while self.queue and self.queue[0][0] == timestamp:
+            _, position = heapq.heappop(self.queue)
+            if self.wakes[position] != timestamp: continue
+            self.wakes[position] = None
+            medium = self.media[position]
+            self.cursor = position
+            medium.advance(timestamp - 1)
+            medium.tick(timestamp)
+            if medium.buffer:
+                for target in medium.stalled(): # Queues only stall while the medium is ticked
+                    self.waiting.setdefault(target, set()).add(medium)
+            self.reschedule(medium)
+        self.cursor = len(self.media)
+        if self.scenario.next_event(timestamp) == timestamp:
+            self.scenario.tick(timestamp, self.media_table)
+    # Run until everything has been delivered or dropped, or the time limit is hit.
+    # The workload is a streaming workload source, done() says whether the simulation has finished, and on_frame is called for each timestamp in range(0, limit, frame_stride) that the simulation passes through (state does not change during skipped timestamps, so the frame is the same as the fixed-step loop would see).
+    # Returns the timestamp the simulation stopped at.
+    def run(self, workload, done, on_frame=None, frame_stride=1):
+        t = 0
+        next_frame = 0
+        while True:
+            t = self.next_time(workload.next_time())
+            if t is None or t > self.limit: t = self.limit
+            if on_frame:
+                while next_frame < t:
+                    on_frame(next_frame)
+                    next_frame += frame_stride
+            self.step(t, workload.pop(t))
+            if on_frame and next_frame == t:
+                on_frame(t)
+                next_frame += frame_stride
+            if done() or t >= self.limit: return t
+            self.now = t + 1
@@ -1,11 +1,12 @@
-import random
+import argparse
 import math
+import time
+import numpy as np
 
-# I/O
-OUTFILE = 'topologies/100_hosts_procedural_1.csv'
+from simulation import rng_init, rng_seed
 
-# Hosts
-N_HOSTS = 100
+# Procedurally generate a topology: hosts with power law distributed latencies, throughputs, multiprocessing and drop rates, joined by links whose number per host is power law distributed too.
+# Everything is sampled in bulk with NumPy, the links are kept as arrays of endpoints, connectivity is worked out with union-find, and rows are written out in chunks, so even 100k host topologies only take seconds.
 
 # Power law distributions
 DISTRIBUTION_PARAMETERS = {
@@ -35,89 +36,120 @@ DISTRIBUTION_PARAMETERS = {
 # Randomization across +/- orders of magnitude
 DEVIATION = 2
 
-for key in DISTRIBUTION_PARAMETERS:
-    param = DISTRIBUTION_PARAMETERS[key]
-    param *= math.exp(DEVIATION*random.uniform(-1, 1))
-    DISTRIBUTION_PARAMETERS[key] = param
+CHUNK = 65536 # rows formatted and written at a time
 
-def pareto(maximum, falloff):
-    return lambda x: (maximum/falloff) * (falloff/x**(falloff+1))
+# Randomize every distribution parameter across orders of magnitude, so each generated topology has a character of its own.
+def randomize(params, deviation, rng):
+    return {key: param * math.exp(deviation * rng.uniform(-1, 1)) for key, param in params.items()}
 
-def sample(function):
-    return math.ceil(function(random.random() * 9 + 1))
+# Power law samples, count of them, with the given maximum and falloff.
+def pareto(rng, count, maximum, falloff):
+    return maximum / (rng.random(count) * 9 + 1) ** (falloff + 1)
 
-def float_sample(function):
-    return function(random.random() * 9 + 1)
+def sample(rng, count, maximum, falloff):
+    return np.ceil(pareto(rng, count, maximum, falloff)).astype(np.int64)
 
-params = DISTRIBUTION_PARAMETERS
-degree = pareto(params['degree_max'], params['degree_pareto'])
-host_latency = pareto(params['host_latency_max'], params['host_latency_pareto'])
-link_latency = pareto(params['link_latency_max'], params['link_latency_pareto'])
-host_throughput = pareto(params['host_throughput_max'], params['host_throughput_pareto'])
-link_throughput = pareto(params['link_throughput_max'], params['link_throughput_pareto'])
-multiprocessing = pareto(params['host_multiprocessing_max'], params['host_multiprocessing_pareto'])
-host_drop = pareto(params['host_drop_max'], params['host_drop_pareto'])
-link_drop = pareto(params['link_drop_max'], params['link_drop_pareto'])
+# Representative of the set x is in, halving paths along the way.
+def find(parents, x):
+    while parents[x] != x:
+        parents[x] = parents[parents[x]]
+        x = parents[x]
+    return x
 
-hosts = []
-links = []
+# Give each host links to random other hosts, up to the number of links sampled for it (counting the links earlier hosts already gave it), returning the two ends of every link.
+def generate_links(hosts, params, rng):
+    wanted = sample(rng, hosts, params['degree_max'], params['degree_pareto'])
+    degrees = np.zeros(hosts, dtype=np.int64)
+    sources = []
+    targets = []
+    if hosts < 2: return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64) # A lone host has nobody to link to
+    for id in range(hosts):
+        count = wanted[id] - degrees[id]
+        if count <= 0: continue
+        linked = rng.integers(0, hosts - 1, count)
+        linked += linked >= id # Never link a host to itself
+        np.add.at(degrees, linked, 1)
+        degrees[id] += count
+        sources.append(np.full(count, id))
+        targets.append(linked)
+    if not sources: return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(sources), np.concatenate(targets)
 
-# Generate hosts in the network
-for id in range(N_HOSTS):
-    hosts.append([id, sample(multiprocessing), sample(host_latency), sample(host_throughput), float_sample(host_drop), 1])
+# Links needed to make the graph connected: every component not connected to host 0 gets a single link, to a random host among the ones connected so far.
+# Components are joined in a random order weighted by their size, as if picking a random disconnected host each time.
+def bridge_links(hosts, sources, targets, rng):
+    parents = list(range(hosts))
+    for a, b in zip(sources.tolist(), targets.tolist()):
+        a, b = find(parents, a), find(parents, b)
+        if a != b: parents[a] = b
+    roots = np.array([find(parents, x) for x in range(hosts)])
+    order = np.argsort(roots, kind='stable')
+    starts = np.flatnonzero(np.r_[True, roots[order][1:] != roots[order][:-1]])
+    members = np.split(order, starts[1:])
+    main = next(i for i, component in enumerate(members) if component[0] == 0)
+    connected = list(members.pop(main))
+    if not members: return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    sizes = np.array([len(component) for component in members])
+    keys = rng.random(len(members)) ** (1 / sizes)
+    bridge_sources = []
+    bridge_targets = []
+    for i in np.argsort(-keys).tolist():
+        bridge_sources.append(connected[rng.integers(len(connected))])
+        bridge_targets.append(members[i][rng.integers(len(members[i]))])
+        connected.extend(members[i])
+    return np.array(bridge_sources), np.array(bridge_targets)
 
-# Generate a network graph where the degree of each vertex is approximately described by a power law
-link_idx = len(hosts)
-for host in hosts:
-    id = host[0]
-    existing_links = 0
-    # existing_links = []
-    for link in links:
-        if link[-1].split(' ')[1][:-1] == str(id) or link[-1].split(' ')[0][1:] == str(id):
-            existing_links += 1
-            # existing_links.append()
-    n_links = sample(degree)
-    if n_links > existing_links: #len(existing_links)
-        for _ in range(n_links - existing_links):
-            target = random.randint(0, len(hosts)-1) # not in existing_links
-            while target == id: target = random.randint(0, len(hosts)-1)
-            links.append([link_idx, 1, sample(link_latency), sample(link_throughput), float_sample(link_drop), 0, f'[{id} {target}]'])
-            link_idx += 1
+def write_rows(out, rows):
+    out.write(''.join(', '.join(str(value) for value in row) + '\n' for row in rows))
 
-# Make sure the graph is connected
-def get_connected(source):
-    connected = []
-    frontier = [source]
-    while len(frontier) != 0:
-        for host in frontier:
-            if host not in connected: connected.append(host)
-        newfrontier = []
-        for host in frontier:
-            id = host[0]
-            for link in links:
-                if link[-1].split(' ')[1][:-1] == str(id):
-                    target = int(link[-1].split(' ')[0][1:])
-                    if hosts[target] not in connected:
-                        newfrontier.append(hosts[target])
-                if link[-1].split(' ')[0][1:] == str(id):
-                    target = int(link[-1].split(' ')[1][:-1])
-                    if hosts[target] not in connected:
-                        newfrontier.append(hosts[target])
-        frontier = newfrontier
-    return connected
+# Generate a topology with the given number of hosts and write it to outfile.
+def generate(hosts, outfile, seed=None, params=DISTRIBUTION_PARAMETERS, deviation=DEVIATION, chunk=CHUNK):
+    rng_init(seed)
+    rng = np.random.default_rng(rng_seed('topology'))
+    params = randomize(params, deviation, rng)
+    sources, targets = generate_links(hosts, params, rng)
+    bridge_sources, bridge_targets = bridge_links(hosts, sources, targets, rng)
+    sources = np.concatenate((sources, bridge_sources))
+    targets = np.concatenate((targets, bridge_targets))
+    with open(outfile, 'w') as out:
+        for start in range(0, hosts, chunk):
+            count = min(chunk, hosts - start)
+            write_rows(out, zip(
+                range(start, start + count),
+                sample(rng, count, params['host_multiprocessing_max'], params['host_multiprocessing_pareto']).tolist(),
+                sample(rng, count, params['host_latency_max'], params['host_latency_pareto']).tolist(),
+                sample(rng, count, params['host_throughput_max'], params['host_throughput_pareto']).tolist(),
+                pareto(rng, count, params['host_drop_max'], params['host_drop_pareto']).tolist(),
+                [1] * count,
+            ))
+        for start in range(0, len(sources), chunk):
+            count = min(chunk, len(sources) - start)
+            write_rows(out, zip(
+                range(hosts + start, hosts + start + count),
+                [1] * count,
+                sample(rng, count, params['link_latency_max'], params['link_latency_pareto']).tolist(),
+                sample(rng, count, params['link_throughput_max'], params['link_throughput_pareto']).tolist(),
+                pareto(rng, count, params['link_drop_max'], params['link_drop_pareto']).tolist(),
+                [0] * count,
+                (f'[{a} {b}]' for a, b in zip(sources[start:start+count].tolist(), targets[start:start+count].tolist())),
+            ))
+    return hosts + len(sources)
 
-connected_graph = get_connected(hosts[0])
-while len(connected_graph) < N_HOSTS:
-    connected_ids = [host[0] for host in connected_graph]
-    disconnected_ids = [host[0] for host in hosts if host[0] not in connected_ids]
-    source = random.choice(connected_ids)
-    dest = random.choice(disconnected_ids)
-    links.append([link_idx, 1, sample(link_latency), sample(link_throughput), float_sample(link_drop), 0, f'[{source} {dest}]'])
-    link_idx += 1
-    connected_graph = get_connected(hosts[0])
+def parse_args():
+    parser = argparse.ArgumentParser(description='Procedurally generate a network topology.')
+    parser.add_argument('--hosts', type=int, default=100)
+    parser.add_argument('--output', help='file to write the topology to (default: topologies/<hosts>_hosts_procedural.csv)')
+    parser.add_argument('--seed', type=int, help='seed to generate the topology from (default: a fresh one every time)')
+    parser.add_argument('--degree-max', type=float, default=DISTRIBUTION_PARAMETERS['degree_max'], help='8 for 20 hosts, 25 for 100 hosts, 100 for 500 hosts')
+    parser.add_argument('--degree-pareto', type=float, default=DISTRIBUTION_PARAMETERS['degree_pareto'], help='0.1 for 20 hosts, 0.25 for 100 hosts, 1 for 500 hosts')
+    parser.add_argument('--deviation', type=float, default=DEVIATION, help='how far parameters are randomized, in orders of magnitude either way')
+    return parser.parse_args()
 
-nodes = hosts + links
-with open(OUTFILE, 'w') as out:
-    for node in nodes:
-        out.write(', '.join([str(i) for i in node]))
-        out.write('\n')
\ No newline at end of file
+if __name__ == '__main__':
+    args = parse_args()
+    if args.hosts < 1: raise RuntimeError(f'generate_topology: need at least one host, got {args.hosts}')
+    outfile = args.output or f'topologies/{args.hosts}_hosts_procedural.csv'
+    params = dict(DISTRIBUTION_PARAMETERS, degree_max=args.degree_max, degree_pareto=args.degree_pareto)
+    start = time.perf_counter()
+    rows = generate(args.hosts, outfile, args.seed, params, args.deviation)
+    print(f'WROTE {rows} MEDIA ({args.hosts} HOSTS) TO {outfile} IN {time.perf_counter() - start:.2f}s')
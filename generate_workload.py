@@ -1,14 +1,15 @@
-import random
+import argparse
+import heapq
+import itertools
 import math
+import time
+import numpy as np
 
-# I/O
-OUTFILE = 'workloads/500_hosts_procedural_5.csv'
+from simulation import rng_init, rng_seed
+from workload import COLUMNS, CHUNK, WorkloadWriter
 
-# Setup
-N_HOSTS = 20
-N_CONNECTIONS = 50 # 8 for 20_hosts, 50 for 100_hosts, 150 for 500_hosts
-TIME = 800 # 800 for 20_hosts, 2000 for 100_hosts and 500_hosts
-LEAD_TIME = 200 # Amount of time before any packets get sent, allows non-ad-hoc protocols some time to set up
+# Procedurally generate a workload: connections between random pairs of hosts, each sending a power law distributed number of packets of power law distributed sizes, spread out over the duration.
+# Every connection produces its packets as a stream sorted by time, a block at a time, and the streams are merged as they go and written out in chunks, so memory stays bounded however many packets the workload has.
 
 # Power law distributions
 DISTRIBUTION_PARAMETERS = {
@@ -23,39 +24,78 @@ DISTRIBUTION_PARAMETERS = {
 # Randomization across orders of magnitude
 DEVIATION = 3
 
-for key in DISTRIBUTION_PARAMETERS:
-    param = DISTRIBUTION_PARAMETERS[key]
-    param *= math.exp(DEVIATION*random.uniform(-1, 1))
-    DISTRIBUTION_PARAMETERS[key] = param
-
-def pareto(maximum, falloff):
-    return lambda x: (maximum/falloff) * (falloff/x**(falloff+1))
-
-def sample(function):
-    return math.ceil(function(random.random() * 9 + 1))
-
-params = DISTRIBUTION_PARAMETERS
-packet_size = pareto(params['packet_max'], params['packet_pareto'])
-connection_density = pareto(params['connection_max'], params['connection_pareto'])
-
-workload = []
-for _ in range(N_CONNECTIONS):
-    source = random.randint(0,N_HOSTS-1)
-    dest = random.randint(0,N_HOSTS-1)
-    packet_count = sample(connection_density)
-    avg_time_increment = TIME / (packet_count+1)
-    t = LEAD_TIME
-    for _ in range(packet_count):
-        byte_size = sample(packet_size)
-        t += random.uniform(0.5,1.5)*avg_time_increment
-        if random.random() > 0.5:
-            workload.append([int(t), source, dest, byte_size])
-        else:
-            workload.append([int(t), dest, source, byte_size])
-
-workload = sorted(workload, key = lambda x: x[0])
-
-with open(OUTFILE, 'w') as out:
-    for packet in workload:
-        out.write(', '.join([str(i) for i in packet]))
-        out.write('\n')
\ No newline at end of file
+LEAD_TIME = 200 # Amount of time before any packets get sent, allows non-ad-hoc protocols some time to set up
+
+def pareto(rng, count, maximum, falloff):
+    return maximum / (rng.random(count) * 9 + 1) ** (falloff + 1)
+
+def sample(rng, count, maximum, falloff):
+    return np.ceil(pareto(rng, count, maximum, falloff)).astype(np.int64)
+
+# The packets of one connection, generated a block at a time from a random stream of its own.
+# Packets go at roughly even intervals across the duration, each one either way along the connection.
+class Connection:
+    def __init__(self, index, hosts, duration, lead_time, params):
+        self.index = index
+        self.rng = np.random.default_rng(rng_seed('workload', index + 1))
+        self.source, self.dest = self.rng.integers(0, hosts, 2).tolist()
+        self.remaining = int(sample(self.rng, 1, params['connection_max'], params['connection_pareto'])[0])
+        self.increment = duration / (self.remaining + 1)
+        self.t = lead_time
+        self.params = params
+    def next_block(self, size):
+        count = min(size, self.remaining)
+        self.remaining -= count
+        times = self.t + np.cumsum(self.rng.uniform(0.5, 1.5, count) * self.increment)
+        self.t = times[-1]
+        rows = np.zeros(count, dtype=COLUMNS)
+        rows['time'] = times.astype(np.int64)
+        rows['size'] = sample(self.rng, count, self.params['packet_max'], self.params['packet_pareto'])
+        forward = self.rng.random(count) > 0.5
+        rows['source'] = np.where(forward, self.source, self.dest)
+        rows['dest'] = np.where(forward, self.dest, self.source)
+        return rows
+    # The packets of the connection as a stream of (start_time, connection index, source, dest, byte_size) rows, which sort by time and then connection.
+    def rows(self, block):
+        while self.remaining:
+            rows = self.next_block(block)
+            yield from zip(rows['time'].tolist(), itertools.repeat(self.index), rows['source'].tolist(), rows['dest'].tolist(), rows['size'].tolist())
+
+# Merge the sorted packet streams of the connections into one, writing it out a chunk at a time.
+# Packets at the same time come out in connection order.
+def merge(connections, writer, block, chunk=CHUNK):
+    merged = heapq.merge(*(connection.rows(block) for connection in connections))
+    while True:
+        merged_rows = np.array(list(itertools.islice(merged, chunk)), dtype=np.int64).reshape(-1, 5)
+        if len(merged_rows) == 0: return
+        rows = np.zeros(len(merged_rows), dtype=COLUMNS)
+        rows['time'], rows['source'], rows['dest'], rows['size'] = merged_rows[:, 0], merged_rows[:, 2], merged_rows[:, 3], merged_rows[:, 4]
+        writer.write(rows)
+
+# Generate a workload between the given number of hosts, and write it to outfile.
+def generate(hosts, connections, duration, outfile, seed=None, binary=False, lead_time=LEAD_TIME, params=DISTRIBUTION_PARAMETERS, deviation=DEVIATION, chunk=CHUNK):
+    rng_init(seed)
+    rng = np.random.default_rng(rng_seed('workload'))
+    params = {key: param * math.exp(deviation * rng.uniform(-1, 1)) for key, param in params.items()}
+    writer = WorkloadWriter(outfile, binary)
+    merge([Connection(i, hosts, duration, lead_time, params) for i in range(connections)], writer, max(16, chunk // max(connections, 1)), chunk)
+    writer.close()
+    return writer.written
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Procedurally generate a traffic workload.')
+    parser.add_argument('--hosts', type=int, default=20, help='number of hosts in the topology the workload is for')
+    parser.add_argument('--connections', type=int, default=50, help='8 for 20 hosts, 50 for 100 hosts, 150 for 500 hosts')
+    parser.add_argument('--time', type=int, default=800, help='duration packets are spread over, 800 for 20 hosts, 2000 for 100 and 500 hosts')
+    parser.add_argument('--lead-time', type=int, default=LEAD_TIME)
+    parser.add_argument('--seed', type=int, help='seed to generate the workload from (default: a fresh one every time)')
+    parser.add_argument('--output', help='file to write the workload to (default: workloads/<hosts>_hosts_procedural.csv, or .bin with --binary)')
+    parser.add_argument('--binary', action='store_true', help='write the compact binary format rather than CSV')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    outfile = args.output or f'workloads/{args.hosts}_hosts_procedural.{"bin" if args.binary else "csv"}'
+    start = time.perf_counter()
+    packets = generate(args.hosts, args.connections, args.time, outfile, args.seed, args.binary, args.lead_time)
+    print(f'WROTE {packets} PACKETS TO {outfile} IN {time.perf_counter() - start:.2f}s')
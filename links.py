@@ -0,0 +1,115 @@
+import numpy as np
+
+import simulation
+
+# Passive links (media without logic) all count their transfers down the same way, so rather than each one looping over its own in_transit list every tick, the transfers of every link are kept together in flat arrays and counted down in one go.
+# A link's in_transit list then holds [packet, one_hop_sender, slot] records, where slot is the position of the transfer in the arrays, so len(in_transit) still tells everyone how busy the link is.
+# Only the transfers that finish on a tick come back out to Python, to be handed on by the link's finish() in the same order its own tick() would have handled them.
+# Each run of consecutive links in the tick order is counted down at that point in the order (see schedule()), so the results match ticking every link on its own exactly, as long as links only connect to routers.
+# This is for the fixed-step loop, which ticks every link on every unit of time, the event engine ticks links one at a time only when they have something to do.
+class LinkLayer:
+    def __init__(self, links):
+        self.links = list(links) # in tick order
+        self.positions = {link.id: i for i, link in enumerate(self.links)}
+        capacity = sum(link.pathways for link in self.links) # Links refuse packets beyond their pathways, so this many transfers can never be exceeded
+        self.remaining = np.zeros(capacity, dtype=np.float64) # bytes left to transfer, less the link's share of what it has served since (see Medium.tick())
+        self.medium = np.zeros(capacity, dtype=np.int32)      # position of the link carrying the transfer
+        self.order = np.zeros(capacity, dtype=np.int64)       # when the transfer started, relative to the others, so finished ones are handed on in arrival order
+        self.records = [None] * capacity                      # the in_transit record of the transfer, its packet handle
+        self.count = 0
+        self.started = 0
+        self.active = np.zeros(len(self.links), dtype=np.int64)        # number of transfers in each link
+        self.served = np.zeros(len(self.links), dtype=np.float64)      # rounded throughput of each link since its transfers last changed, a whole number
+        self.operational = np.array([link.operational for link in self.links], dtype=bool)
+        self.ids = np.array([link.id for link in self.links], dtype=np.int64)
+        self.means = np.array([link.throughput.mean for link in self.links], dtype=np.float32)
+        self.cached = simulation.noise_cache is not None and all(link.throughput.cached is not None for link in self.links)
+        for link in self.links:
+            if link.logic: raise RuntimeError(f'LinkLayer: medium {link.id} runs routing logic, only passive links can be counted down together')
+            if link.in_transit: raise RuntimeError(f'LinkLayer: medium {link.id} already has packets in transit')
+            link.link_layer = self
+    # Start a transfer through a link, returning its in_transit record.
+    def add(self, link, packet, one_hop_sender, remaining):
+        slot = self.count
+        position = self.positions[link.id]
+        self.settle(link, position)
+        record = [packet, one_hop_sender, slot]
+        self.remaining[slot] = remaining
+        self.medium[slot] = position
+        self.order[slot] = self.started
+        self.records[slot] = record
+        self.active[position] += 1
+        self.count += 1
+        self.started += 1
+        return record
+    # Count the timers of a link's transfers down by their share of what it has served, before they change (see Medium.settle()).
+    def settle(self, link, position):
+        if self.served[position] and self.active[position]:
+            share = self.served[position] / self.active[position]
+            for record in link.in_transit:
+                self.remaining[record[2]] -= share
+        self.served[position] = 0
+    def set_operational(self, link, operational):
+        self.operational[self.positions[link.id]] = operational
+    # Throughput at the given timestamp of each link at the given positions.
+    # With the noise cache, this reads straight from the cached noise with the same single precision arithmetic NoiseSeries uses, so the values are identical.
+    def throughput(self, positions, timestamp):
+        if self.cached:
+            means = self.means[positions]
+            return simulation.noise_cache[self.ids[positions], 0, timestamp] * means + means
+        return np.fromiter((self.links[position].throughput[timestamp] for position in positions), dtype=np.float32, count=len(positions))
+    # Model the passage of time for the links at positions start to stop, all at once.
+    def tick(self, timestamp, start=0, stop=None):
+        if self.count == 0: return
+        if stop is None: stop = len(self.links)
+        count = self.count
+        busy = start + np.flatnonzero((self.active[start:stop] > 0) & self.operational[start:stop]) # If a link has been disrupted, its timers don't tick down
+        if len(busy) == 0: return
+        self.served[busy] += np.rint(self.throughput(busy, timestamp))
+        shares = np.zeros(len(self.links))
+        shares[busy] = self.served[busy] / self.active[busy]
+        finished = np.flatnonzero(self.remaining[:count] - shares[self.medium[:count]] <= 0) # Only busy links have a share, the rest have nothing finishing
+        if len(finished) == 0: return
+        finished = finished[np.lexsort((self.order[finished], self.medium[finished]))] # Tick order of the links, then arrival order within each
+        finished_records = [self.records[slot] for slot in finished]
+        for record in finished_records:
+            self.links[self.medium[record[2]]].finish(record[0], record[1], timestamp)
+        # Packets handed on above may have started new transfers (at the end of the arrays), so the finished ones are only freed now
+        for position in np.unique(self.medium[finished]):
+            link = self.links[position]
+            self.settle(link, position)
+            link.in_transit = [record for record in link.in_transit if self.remaining[record[2]] > 0]
+            self.active[position] = len(link.in_transit)
+        for slot in sorted(finished, reverse=True): # Back to front, so the transfer moved into a freed slot is never one still waiting to be freed
+            self.count -= 1
+            last = self.count
+            if slot != last:
+                self.remaining[slot] = self.remaining[last]
+                self.medium[slot] = self.medium[last]
+                self.order[slot] = self.order[last]
+                self.records[slot] = self.records[last]
+                self.records[slot][2] = slot
+            self.records[last] = None
+        if simulation.tally: simulation.tally.in_transit -= sum(record[0].content == '' for record in finished_records)
+    # The order to tick things in, given every medium in tick order: the media themselves, with each run of consecutive links that belong to this layer replaced by one step that counts them all down together.
+    def schedule(self, media):
+        order = []
+        for medium in media:
+            if medium.link_layer is not self:
+                order.append(medium)
+                continue
+            position = self.positions[medium.id]
+            if order and isinstance(order[-1], LinkRun) and order[-1].stop == position:
+                order[-1].stop += 1
+            else:
+                order.append(LinkRun(self, position, position + 1))
+        return order
+
+# A run of links that are next to each other in a LinkLayer (and in the tick order), ticked together.
+class LinkRun:
+    def __init__(self, layer, start, stop):
+        self.layer = layer
+        self.start = start
+        self.stop = stop
+    def tick(self, timestamp):
+        self.layer.tick(timestamp, self.start, self.stop)
@@ -4,6 +4,13 @@ import numpy as np
 
 from simulation import *
 from visualization import *
+from engine import EventEngine
+from workload import Workload
+from links import LinkLayer
+from tracing import tracing_init, tracing_close
+from metrics import metrics_init
+from topology import load_topology
+from optimal import lower_bounds, peak_rates
 
 from routing_algorithms import baseline_slow
 from routing_algorithms import baseline_fast
@@ -16,110 +23,139 @@ from scenarios import normal
 from scenarios import disruption
 from scenarios import topology_shift
 
-algorithms = [os.path.splitext(filename)[0] for filename in os.listdir('routing_algorithms')]
-topologies = os.listdir('topologies')
-workloads = os.listdir('topologies')
+algorithms = sorted(os.path.splitext(filename)[0] for filename in os.listdir('routing_algorithms') if filename.endswith('.py'))
+topologies = sorted(os.path.splitext(filename)[0] for filename in os.listdir('topologies') if filename.endswith('.csv'))
+workloads = sorted({os.path.splitext(filename)[0] for filename in os.listdir('workloads') if filename.endswith(('.csv', '.bin'))}) # binary workloads from generate_workload.py are .bin
+scenarios = sorted(os.path.splitext(filename)[0] for filename in os.listdir('scenarios') if filename.endswith('.py'))
 
-ALGORITHM = 'baseline_slow' # Should eventually be picked via command line arg
+# Defaults for a single run, main() can be given others (see sweep.py for running many)
+ALGORITHM = 'baseline_slow'
 TOPOLOGY = '20_hosts_procedural_1'
 WORKLOAD = '20_hosts_procedural_1'
 SCENARIO = 'disruption'
+QUEUE_POLICY = 'tail_drop' # How router queues decide what to drop once they fill up, one of the QUEUE_POLICIES in simulation.py
 
 # fractal gaussian noise parameters
 RATE_DEVIATION = 1
 HURST = 0.75 # While the specific value of this is a bit uncertain, most sources I've seen seem to indicate that a value in the ballpark of 0.75 works best for approximately modeling delays over the actual internet
+SEED = 0 # Every random stream of a run (noise, losses, routing decisions, scenario events) is derived from this, runs of different algorithms with the same seed share the same draws wherever they can
+NOISE_CACHE = None # Directory to keep generated noise in, so later runs with the same parameters can reuse it (for example 'noise_cache'), the noise is the same either way
+NOISE_CACHE_SIZE = 2**30 # Bytes the noise cache directory may take up, the least recently used noise is deleted beyond that
 
 # animation / timing parameters
 LIMIT = 20000
-ANIMATION_SPEEDUP = 1#5
+ANIMATION_SPEEDUP = 1#5 # Record a frame every this many units of time
 ANIMATE = False
+RECORD_FRAMES = False # Record frames of how busy each medium is even without animating them, for example to analyze afterwards
+FRAMES_PATH = None    # .npy file to memory map the recorded frames to (None to keep them in memory)
+
+# Work out lower bounds on the latency and completion time any algorithm could get for the workload (see optimal.py), and report how far the run is from them
+# Off by default, since it is worked out again for every run (the bounds depend on the noise of the run too) and it is slow on the bigger topologies, about 20s and 400MB for 500_hosts_procedural_10
+LOWER_BOUNDS = False
+
+# Jump from one event to the next instead of ticking every medium on every unit of time (gives the same results)
+# Much faster when most of the network is idle most of the time (about 10x for the defaults), but slower than ticking once routers are busy on nearly every unit of time, for example aodv on 100_hosts_procedural_2 with topology_shift
+EVENT_DRIVEN = False
+# Directory to write a binary trace of packet events to (None to not trace), which event types to include, and what fraction of them to keep
+TRACE = None
+TRACE_EVENTS = ('receive', 'deliver', 'drop', 'forward')
+TRACE_SAMPLE = 1
+
+# When stepping every unit of time, count down the transfers of all passive links together with NumPy instead of ticking each link on its own
+# Only used if EVENT_DRIVEN is off, the event engine only ticks a link at the moments its transfers finish (found from the noise in one go), so it has no per-tick countdown to batch
+VECTORIZED_LINKS = True
 
 stochastic_init(HURST)
 
-def main():
-    print('LOADING TOPOLOGY')
+# Instantiate the media of a (compiled) topology, with routers running the given algorithm, and index how they are wired together.
+def build_media(algorithm, compiled, limit):
     media = {}
-    connections = set()
-    with open(f'topologies/{TOPOLOGY}.csv', 'r') as topology_file:
-        topology_data = topology_file.read()
-    for line in topology_data.split('\n'):
-        if len(line) == 0 or line[0] == '#': continue
-        connected_ids = []
-        vals = line.split(',')
-        print(vals)
-        if len(vals) == 7:
-            connected_ids = [int(id) for id in vals[6].split('[')[1].split(']')[0].split(' ')]
-            vals = vals[:6]
+    for id, pathways, overhead, byte_rate, drop_rate, logic in zip(compiled.ids.tolist(), compiled.pathways.tolist(), compiled.overhead.tolist(), compiled.byte_rate.tolist(), compiled.drop_rate.tolist(), compiled.logic.tolist()):
         # Instantiating the Media
-        vals = [float(val) if i == 4 else int(val) for i, val in enumerate(vals)]
-        if vals[5]: # if logic=True, patch in routing logic from one of the algorithms
-            medium = globals()[ALGORITHM.lower()].Router(*vals[:5], RATE_DEVIATION, LIMIT) #rate_deviation=1, max_duration=LIMIT
+        if logic: # if logic=True, patch in routing logic from one of the algorithms
+            medium = globals()[algorithm.lower()].Router(id, pathways, overhead, byte_rate, drop_rate, RATE_DEVIATION, limit) #rate_deviation=1, max_duration=limit
         else:
-            medium = Medium(*vals[:5], RATE_DEVIATION, LIMIT) #rate_deviation=1, max_duration=LIMIT
-        for connected_id in connected_ids:
-            connections.add((medium.id, connected_id))
+            medium = Medium(id, pathways, overhead, byte_rate, drop_rate, RATE_DEVIATION, limit) #rate_deviation=1, max_duration=limit
         media[medium.id] = medium
     # Adding connections with refs, now that the table of media ids to refs is built
-    for connection in connections:
-        media[connection[0]].connections.append(media[connection[1]])
-        media[connection[1]].connections.append(media[connection[0]])
+    for row, medium in enumerate(media.values()):
+        medium.connections = [media[id] for id in compiled.neighbors(row).tolist()]
+    Medium.network = Network(media)
+    return media
+
+# Run one simulation, returning the metrics report for it.
+# The topology can be given already loaded (compiled), for example attached to shared memory by sweep.py, otherwise it is loaded by name.
+def main(algorithm=None, topology=None, workload=None, scenario=None, seed=None, limit=None, compiled=None, queue_policy=None):
+    algorithm = algorithm or ALGORITHM
+    topology = topology or TOPOLOGY
+    workload_name = workload or WORKLOAD
+    scenario_name = scenario or SCENARIO
+    queue_policy = queue_policy or QUEUE_POLICY
+    seed = SEED if seed is None else seed
+    limit = limit or LIMIT
+    print('LOADING TOPOLOGY')
+    rng_init(seed)
+    Medium.queue_policy = QUEUE_POLICIES[queue_policy]()
+    compiled = compiled if compiled is not None else load_topology(topology)
+    noise_cache_init(HURST, RATE_DEVIATION, limit+1, int(compiled.ids.max()) + 1, seed, NOISE_CACHE, NOISE_CACHE_SIZE)
+    media = build_media(algorithm, compiled, limit)
     print('DONE LOADING TOPOLOGY')
     print('LOADING WORKLOAD')
-    workload = []
-    with open(f'workloads/{WORKLOAD}.csv', 'r') as workload_file:
-        workload_data = workload_file.read()
-    for line in workload_data.split('\n'):
-        if len(line) == 0 or line[0] == '#': continue
-        print(line)
-        vals = [int(val) for val in line.split(',')]
-        workload.append((vals[0], Packet(vals[1], vals[2], size=vals[3])))
+    workload_file = f'workloads/{workload_name}.bin'
+    if not os.path.exists(workload_file): workload_file = f'workloads/{workload_name}.csv'
+    workload = Workload(workload_file)
+    bounds = lower_bounds(compiled, workload_file, rates=peak_rates(compiled, {id: medium.throughput for id, medium in media.items()})) if LOWER_BOUNDS else None
     print('DONE LOADING WORKLOAD')
     print('LOADING SCENARIO')
-    scenario = globals()[SCENARIO.lower()].Scenario(media)
+    scenario = globals()[scenario_name.lower()].Scenario(media)
     print('DONE LOADING SCENARIO')
     print('RUNNING SIMULATION')
-    node_colors_animated = []
-    edge_colors_animated = []
-    t = 0
-    running = True
-    while running:
-        #print(f't={t}')
-        for start_time, packet in workload:
-            if start_time == t:
-                media[packet.source].receive(packet, None)
+    tally = tally_init()
+    collector = metrics_init(media, algorithm, bounds)
+    tracer = tracing_init(TRACE, TRACE_EVENTS, TRACE_SAMPLE) if TRACE else None
+    recorder = FrameRecorder(media, limit, ANIMATION_SPEEDUP, FRAMES_PATH) if ANIMATE or RECORD_FRAMES else None
+    def done():
+        return workload.exhausted() and tally.idle()
+    if EVENT_DRIVEN:
+        engine = EventEngine(media, scenario, limit)
+        t = engine.run(workload, done, recorder.record if recorder else None, ANIMATION_SPEEDUP)
+    else:
+        t = 0
+        running = True
+        ticking = list(media.values())
+        if VECTORIZED_LINKS: # Links wired straight to other links are left to tick on their own, since the layer would only pass packets between them on the next tick
+            ticking = LinkLayer(medium for medium in ticking if not medium.logic and all(connection.logic for connection in medium.connections)).schedule(ticking)
+        while running:
+            #print(f't={t}')
+            if tracer: tracer.now = t
+            for packet in workload.pop(t):
                 packet.time_sent = t
-        for medium in media.values():
-            medium.tick(t)
-        scenario.tick(t, media)
-        if t % ANIMATION_SPEEDUP == 0:
-            node_colors, edge_colors = make_colors(media)
-            node_colors_animated.append(node_colors)
-            edge_colors_animated.append(edge_colors)
-        if all([packet.time_sent != -1 for _, packet in workload]) and all([len(medium.in_transit) == 0 for medium in media.values()]) and all([medium.buffering == False for medium in media.values()]): running = False
-        if t == LIMIT: running = False
-        t += 1
-    print(f'DONE RUNNING SIMULATION ({ALGORITHM})')
-    total_data = 0
-    dropped = 0
-    lost_data = 0
-    transit_time = 0
-    tail_latency = 0
-    for _, packet in workload:
-        total_data += packet.byte_size
-        if packet.time_arrived == -1:
-            dropped += 1
-            lost_data += packet.byte_size
-        else:
-            latency = (packet.time_arrived - packet.time_sent)
-            transit_time += latency
-            if latency > tail_latency:
-                tail_latency = latency
-    print(f'PACKET LOSS RATE: {dropped / len(workload)}')
-    print(f'DATA LOSS RATE: {lost_data / total_data}')
-    print(f'TAIL LATENCY: {tail_latency} (units of time)')
-    print(f'AVERAGE THROUGHPUT: {(total_data - lost_data) / transit_time if transit_time != 0 else None} (bytes per unit of time)')
-    if ANIMATE: animate_network(media, node_colors_animated, edge_colors_animated)
-    return 0
+                media[packet.source].receive(packet, None)
+            for medium in ticking:
+                medium.tick(t)
+            scenario.tick(t, media)
+            if recorder and t % ANIMATION_SPEEDUP == 0: recorder.record(t)
+            if done(): running = False
+            if t == limit: running = False
+            if running: t += 1
+    tracing_close()
+    print(f'DONE RUNNING SIMULATION ({algorithm})')
+    report = collector.report(t, done())
+    print(f'PACKET LOSS RATE: {report["packet_loss_rate"]}')
+    print(f'DATA LOSS RATE: {report["data_loss_rate"]}')
+    print(f'TAIL LATENCY: {report["latency_max"]} (units of time)')
+    print(f'LATENCY PERCENTILES: p50={report["latency_p50"]} p99={report["latency_p99"]} p99.9={report["latency_p999"]} (units of time)')
+    if report['latency_ratio'] is not None: print(f'LATENCY VS LOWER BOUND: {report["latency_ratio"]:.3f}x (delivered packets could have had a mean latency of {report["latency_bound"]})')
+    if report['completion_ratio'] is not None: print(f'COMPLETION VS LOWER BOUND: {report["completion_ratio"]:.3f}x (every packet could have been delivered by {report["completion_bound"]}, the run took until {report["time"]})')
+    elif report['truncated'] and report['completion_bound'] is not None: print(f'COMPLETION VS LOWER BOUND: unknown (every packet could have been delivered by {report["completion_bound"]}, the run was stopped at the time limit of {report["time"]} first)')
+    print(f'AVERAGE THROUGHPUT: {report["average_throughput"]} (bytes per unit of time)')
+    print(f'FAIRNESS (JAIN INDEX OVER {report["flows"]} FLOWS): {report["fairness"]}')
+    print(f'CONTROL BYTES: {report["control_bytes"]}, DATA BYTES: {report["data_bytes"]} (summed over every hop)')
+    if report['control_cpu']: print(f'CONTROL CPU: {report["control_cpu"]:.3f}s (simulator time spent handling control messages)')
+    print(f'MEDIUM UTILIZATION: mean={report["utilization_mean"]} max={report["utilization_max"]}')
+    if recorder: recorder.close()
+    if ANIMATE: animate_network(media, recorder.frames())
+    return report
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
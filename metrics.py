@@ -2,4 +2,162 @@
 #   - Speed
 #   - Reliability
 #   - Security
-#   - Fairness
\ No newline at end of file
+#   - Fairness
+
+import numpy as np
+
+# Metrics kept up to date as packets move around, so that results can be read at any point in a run without holding on to every packet.
+# Memory stays flat however long the workload is: latencies go into a fixed-precision histogram, and everything else is a running total (per flow, or per medium).
+
+collector = None
+
+# Start collecting metrics for a new run over the given media, labelled with the routing algorithm being run, and measured against the given lower bounds (see optimal.py) if there are any.
+def metrics_init(media, algorithm=None, bounds=None):
+    global collector
+    collector = Metrics(media, algorithm, bounds)
+    return collector
+
+# Latency histogram with buckets spaced so that every value is known to within a fixed relative precision (like an HDR histogram).
+# Values below 2**significant_bits get a bucket each, and above that every power of two is split into 2**(significant_bits-1) buckets, so the error is at most 2**-(significant_bits-1) of the value however large it gets.
+class LatencyHistogram:
+    def __init__(self, significant_bits=8):
+        self.bits = significant_bits
+        self.counts = np.zeros(1 << significant_bits, dtype=np.int64)
+        self.count = 0
+        self.total = 0
+        self.max = None
+    def index(self, value):
+        if value < 1 << self.bits: return value
+        shift = value.bit_length() - self.bits
+        return (1 << self.bits) + (shift - 1) * (1 << (self.bits - 1)) + (value >> shift) - (1 << (self.bits - 1))
+    # The largest value that falls in a bucket.
+    def highest(self, index):
+        if index < 1 << self.bits: return index
+        shift, mantissa = divmod(index - (1 << self.bits), 1 << (self.bits - 1))
+        shift += 1
+        return (((1 << (self.bits - 1)) + mantissa + 1) << shift) - 1
+    def record(self, value):
+        value = int(value)
+        if value < 0: raise RuntimeError(f'LatencyHistogram: latencies can not be negative, got {value}')
+        index = self.index(value)
+        if index >= len(self.counts): self.counts = np.concatenate((self.counts, np.zeros(index + 1 - len(self.counts), dtype=np.int64)))
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        if self.max is None or value > self.max: self.max = value
+    # The latency that the given fraction of recorded latencies are at or below (to within the histogram's precision), or None if nothing was recorded.
+    def percentile(self, fraction):
+        if self.count == 0: return None
+        rank = max(1, int(np.ceil(fraction * self.count)))
+        index = int(np.searchsorted(np.cumsum(self.counts), rank))
+        return min(self.highest(index), self.max)
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+# Jain's fairness index of a set of allocations: 1 when they are all equal, down to 1/n when one gets everything.
+def jain_index(values):
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) == 0 or not values.any(): return None
+    return values.sum() ** 2 / (len(values) * (values ** 2).sum())
+
+class Metrics:
+    def __init__(self, media, algorithm=None, bounds=None):
+        self.algorithm = algorithm
+        self.bounds = bounds
+        self.latency = LatencyHistogram()
+        self.flows = {}           # (source, dest) : [packets sent, packets delivered, bytes sent, bytes delivered, total latency of delivered packets]
+        self.sent = 0             # workload packets injected
+        self.sent_bytes = 0
+        self.delivered = 0        # workload packets that got to their destination (counting each packet once, however many copies of it arrived)
+        self.delivered_bytes = 0
+        self.drops = 0            # workload packets (or copies of them) dropped along the way
+        self.data_bytes = 0       # bytes of workload packets taken on by media, summed over every hop
+        self.control_bytes = 0    # bytes of routing protocol packets taken on by media, summed over every hop
+        self.control_time = 0     # seconds of simulator CPU time routing protocols reported spending on their control messages
+        self.bounded = 0          # delivered packets there is a lower bound on the latency of
+        self.bounded_latency = 0  # their total latency
+        self.optimal_latency = 0  # total of those lower bounds
+        size = max(media.keys()) + 1 if media else 0
+        self.work = np.zeros(size)      # medium id : bytes of work (including per-packet overhead) taken on
+        self.capacity = np.zeros(size)  # medium id : average bytes of work the medium gets through per unit of time
+        for medium in media.values():
+            self.capacity[medium.id] = medium.byte_rate
+    def flow(self, packet):
+        key = (packet.source, packet.dest)
+        stats = self.flows.get(key)
+        if stats is None: stats = self.flows[key] = [0, 0, 0, 0, 0]
+        return stats
+    # A workload packet was injected into the network.
+    def send(self, packet):
+        self.sent += 1
+        self.sent_bytes += packet.byte_size
+        stats = self.flow(packet)
+        stats[0] += 1
+        stats[2] += packet.byte_size
+    # A medium took on a packet, which will take the given amount of work to get through it.
+    def receive(self, medium, packet, work):
+        if packet.content == '': self.data_bytes += packet.byte_size
+        else: self.control_bytes += packet.byte_size
+        self.work[medium.id] += work
+    # A workload packet reached its destination at the given time.
+    def deliver(self, packet, timestamp):
+        if packet.delivered: return
+        packet.delivered = True
+        latency = timestamp - packet.time_sent
+        self.delivered += 1
+        self.delivered_bytes += packet.byte_size
+        self.latency.record(latency)
+        stats = self.flow(packet)
+        stats[1] += 1
+        stats[3] += packet.byte_size
+        stats[4] += latency
+        optimal = self.bounds.latency(packet.source, packet.dest, packet.byte_size) if self.bounds else None
+        if optimal is not None:
+            self.bounded += 1
+            self.bounded_latency += latency
+            self.optimal_latency += optimal
+    # A routing protocol spent the given number of seconds of CPU time handling control messages (wall clock, so unlike everything else here it varies from run to run).
+    def control(self, seconds):
+        self.control_time += seconds
+    # A workload packet was dropped.
+    def drop(self, packet):
+        self.drops += 1
+    # Fraction of its capacity each medium has been used at, from the start of the run up to the given time, as an array indexed by medium id.
+    def utilization(self, timestamp):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.nan_to_num(self.work / (self.capacity * (timestamp + 1)))
+    # Jain's fairness index over the throughput each flow got (bytes delivered per unit of time in transit, or 0 for flows that got nothing delivered).
+    def fairness(self):
+        return jain_index([stats[3] / stats[4] if stats[4] else 0 for stats in self.flows.values()])
+    # Summary of the run so far, up to the given time, which it either finished by (every packet was delivered or dropped) or was stopped at.
+    def report(self, timestamp, finished=True):
+        utilization = self.utilization(timestamp)
+        used = utilization[self.capacity > 0]
+        return {
+            'algorithm': self.algorithm,
+            'time': timestamp,
+            'packets_sent': self.sent,
+            'packets_delivered': self.delivered,
+            'packet_drops': self.drops,
+            'packet_loss_rate': 1 - self.delivered / self.sent if self.sent else None,
+            'data_loss_rate': 1 - self.delivered_bytes / self.sent_bytes if self.sent_bytes else None,
+            'latency_mean': self.latency.mean(),
+            'latency_p50': self.latency.percentile(0.5),
+            'latency_p99': self.latency.percentile(0.99),
+            'latency_p999': self.latency.percentile(0.999),
+            'latency_max': self.latency.max,
+            'latency_bound': self.optimal_latency / self.bounded if self.optimal_latency else None,
+            'latency_ratio': self.bounded_latency / self.optimal_latency if self.optimal_latency else None,
+            'completion_bound': self.bounds.completion if self.bounds else None,
+            'completion_ratio': timestamp / self.bounds.completion if finished and self.bounds and self.bounds.completion else None, # how long the run would have taken is unknown if it was stopped first
+            'truncated': not finished,
+            'average_throughput': self.delivered_bytes / self.latency.total if self.latency.total else None,
+            'flows': len(self.flows),
+            'fairness': self.fairness(),
+            'data_bytes': self.data_bytes,
+            'control_bytes': self.control_bytes,
+            'control_cpu': self.control_time,
+            'control_fraction': self.control_bytes / (self.control_bytes + self.data_bytes) if self.control_bytes + self.data_bytes else None,
+            'utilization_mean': used.mean() if len(used) else None,
+            'utilization_max': used.max() if len(used) else None,
+        }
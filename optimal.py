@@ -0,0 +1,165 @@
+import argparse
+import math
+import os
+import time
+import numpy as np
+
+from topology import load_topology
+from workload import CHUNK, read_chunks
+from simulation import NoiseSeries, rng_init, rng_seed
+
+# Offline lower bounds on how well any routing algorithm could possibly do with a workload on a topology, to measure the real ones against.
+# Every medium is taken to run at its peak rate, the most bytes of work it gets through in any one unit of time of the run (the noise takes it above its mean byte_rate often enough), so a packet of size bytes takes ceil((overhead*byte_rate + size) / rate) - 1 units of time to get through it at the very least (it can be taken on and get started on in the same unit of time), and no medium gets through more than rate bytes of work per unit of time however many packets share it.
+# Without the peak rates of a run, the mean byte_rates are used instead, which only bounds runs without noise.
+#   - Latency: the fastest any packet could get to its destination is along the path that takes the least time with no other traffic in the way. Paths are worked out for a whole batch of (source, packet size) pairs at once, by relaxing the distances to every medium in NumPy until they stop changing.
+#   - Completion: no packet can be delivered earlier than its start time plus that latency, and every packet has to go through its source and destination hosts, each of which can only get through its work so fast. Every host is a single machine that packets are released to (at the earliest they could get there) and that can split its time between them however it likes, for which the best time to get through everything is known exactly.
+# A time-expanded network flow (or LP) over every medium and unit of time would give tighter bounds, but it has far too many variables for the bigger topologies.
+
+SIZE_TOLERANCE = 0.05   # Packets whose sizes are within this (relative) factor of each other share a path, worked out for the smallest size they could have (0 for exact sizes)
+BLOCK = 1 << 22         # Most distances relaxed at once, bounding the memory used for big topologies
+
+# Size class of a packet size, and the smallest size in it.
+def size_class(size, tolerance=SIZE_TOLERANCE):
+    if tolerance <= 0: return size
+    return int(math.log(max(size, 1)) / math.log(1 + tolerance))
+def class_size(size_class, tolerance=SIZE_TOLERANCE):
+    if tolerance <= 0: return size_class
+    return (1 + tolerance) ** size_class
+
+# Row numbers in the topology of the media with the given ids.
+def rows_of(topology, ids):
+    positions = np.full(int(topology.ids.max()) + 1, -1, dtype=np.int64)
+    positions[topology.ids] = np.arange(len(topology))
+    return positions[ids]
+
+# Most bytes of work each medium of a topology gets through in a unit of time, from the noise series of their throughputs by medium id (see Medium.tick()).
+def peak_rates(topology, throughputs):
+    return np.array([throughputs[id].peak() for id in topology.ids.tolist()], dtype=np.float64)
+
+# Least time a packet with the given work to it spends in a medium that gets through rate bytes of work per unit of time at most.
+def medium_time(work, rate):
+    return np.maximum(np.ceil(work / np.maximum(rate, 1)) - 1, 0)
+
+# Least time a packet of each size spends in each medium, as an array of (sizes x media).
+def medium_times(topology, sizes, rates):
+    sizes = np.asarray(sizes, dtype=np.float64)
+    return medium_time(topology.overhead * topology.byte_rate + sizes[:, None], rates)
+
+# Least time it takes a packet of each of the given sizes to get from each of the given sources (row numbers in the topology) to every medium, with no other traffic in the way, as an array of (pairs x media).
+# The time to a medium includes the time spent in it, and in the source.
+def path_times(topology, sources, sizes, rates):
+    sources = np.asarray(sources, dtype=np.int64)
+    neighbors = rows_of(topology, topology.indices)
+    degrees = np.diff(topology.indptr)
+    linked = np.flatnonzero(degrees)
+    starts = topology.indptr[:-1][linked]
+    times = np.empty((len(sources), len(topology)))
+    step = max(1, BLOCK // max(len(neighbors), len(topology)))
+    for block in range(0, len(sources), step):
+        rows = np.arange(block, min(block + step, len(sources)))
+        costs = medium_times(topology, np.asarray(sizes)[rows], rates)
+        distances = np.full(costs.shape, np.inf)
+        distances[np.arange(len(rows)), sources[rows]] = costs[np.arange(len(rows)), sources[rows]]
+        while len(linked):
+            closest = np.minimum.reduceat(distances[:, neighbors], starts, axis=1) # Closest neighbor of every medium that has any
+            relaxed = np.minimum(distances[:, linked], closest + costs[:, linked])
+            if np.array_equal(relaxed, distances[:, linked]): break
+            distances[:, linked] = relaxed
+        times[rows] = distances
+    return times
+
+# Best time a single machine can get through jobs in, when each job is released at a given time, takes a given time to process, and still has a given tail of time to go once it is processed.
+# The machine can switch between jobs whenever it likes, so the answer is just the worst set of jobs released from some time on, each group of jobs (by machine) being handled separately.
+# The smallest tail of a machine's jobs stands in for the tails of each set, which keeps it a lower bound.
+def machine_bounds(machines, releases, durations, tails):
+    order = np.lexsort((-releases, machines))
+    machines, releases, durations, tails = machines[order], releases[order], durations[order], tails[order]
+    starts = np.flatnonzero(np.r_[True, machines[1:] != machines[:-1]])
+    sums = np.cumsum(durations)
+    sums -= np.repeat(np.r_[0, sums[starts[1:] - 1]], np.diff(np.r_[starts, len(machines)])) # Running total within each machine
+    least_tails = np.repeat(np.minimum.reduceat(tails, starts), np.diff(np.r_[starts, len(machines)]))
+    return releases + sums - 1 + least_tails
+
+class Bounds:
+    def __init__(self, topology, times, pairs, tolerance):
+        self.rows = rows_of(topology, np.arange(int(topology.ids.max()) + 1)) # medium id : row number in the topology
+        self.times = times          # (source row, size class) pairs x media : least time to get there
+        self.pairs = pairs          # (source row, size class) : row of times
+        self.tolerance = tolerance
+        self.packets = 0            # packets in the workload
+        self.unreachable = 0        # packets whose destination can't be reached from their source at all
+        self.latency_total = 0      # lower bound on the sum of the latencies of all the reachable packets
+        self.completion = None      # lower bound on when the last reachable packet could be delivered
+        self.contention_free = None # when it could be, taking nothing into account but its own latency
+    # Lower bound on the latency of a packet, or None if it can't get there at all.
+    def latency(self, source, dest, size):
+        row = self.pairs.get((int(self.rows[source]), size_class(size, self.tolerance)))
+        if row is None: return None
+        latency = self.times[row, self.rows[dest]]
+        return float(latency) if np.isfinite(latency) else None
+    def latency_mean(self):
+        return self.latency_total / (self.packets - self.unreachable) if self.packets > self.unreachable else None
+
+# Work out lower bounds for the workload in the given file on a (compiled) topology, with the media running at the given rates by row (their peak_rates() for the run, or their mean byte_rates without noise).
+def lower_bounds(topology, filename, tolerance=SIZE_TOLERANCE, chunk=CHUNK, rates=None):
+    rates = topology.byte_rate.astype(np.float64) if rates is None else rates
+    pairs = {}
+    for rows in read_chunks(filename, chunk):
+        sources = rows_of(topology, rows['source'])
+        classes = [size_class(size, tolerance) for size in rows['size'].tolist()]
+        for pair in zip(sources.tolist(), classes):
+            if pair not in pairs: pairs[pair] = len(pairs)
+    times = path_times(topology, [source for source, _ in pairs], [class_size(size_class, tolerance) for _, size_class in pairs], rates)
+    bounds = Bounds(topology, times, pairs, tolerance)
+    machines, releases, durations, tails = [], [], [], []
+    for rows in read_chunks(filename, chunk):
+        starts = rows['time'].astype(np.float64)
+        sizes = rows['size'].astype(np.float64)
+        sources = rows_of(topology, rows['source'])
+        dests = rows_of(topology, rows['dest'])
+        latencies = times[[pairs[pair] for pair in zip(sources.tolist(), (size_class(size, tolerance) for size in rows['size'].tolist()))], dests]
+        reachable = np.isfinite(latencies)
+        bounds.packets += len(rows)
+        bounds.unreachable += int((~reachable).sum())
+        if not reachable.any(): continue
+        starts, sizes, sources, dests, latencies = starts[reachable], sizes[reachable], sources[reachable], dests[reachable], latencies[reachable]
+        bounds.latency_total += float(latencies.sum())
+        bounds.contention_free = max(bounds.contention_free or 0, float((starts + latencies).max()))
+        # A packet is at its source from its start time on, and has the rest of its path to go after it, and it gets to its destination once it could have come all the way there (packets sent to their own source only count once)
+        work_at_sources = topology.overhead[sources] * topology.byte_rate[sources] + sizes
+        work_at_dests = topology.overhead[dests] * topology.byte_rate[dests] + sizes
+        elsewhere = sources != dests
+        machines += [sources, dests[elsewhere]]
+        releases += [starts, (starts + np.maximum(latencies - medium_time(work_at_dests, rates[dests]), 0))[elsewhere]]
+        durations += [work_at_sources / np.maximum(rates[sources], 1), (work_at_dests / np.maximum(rates[dests], 1))[elsewhere]]
+        tails += [np.maximum(latencies - medium_time(work_at_sources, rates[sources]), 0), np.zeros(int(elsewhere.sum()))]
+    if machines:
+        capacity = machine_bounds(*(np.concatenate(values) for values in (machines, releases, durations, tails)))
+        bounds.completion = max(bounds.contention_free, float(capacity.max()))
+    return bounds
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Work out lower bounds on the latency and completion time any routing algorithm could get for a workload on a topology.')
+    parser.add_argument('--topology', default='20_hosts_procedural_1')
+    parser.add_argument('--workload', help='workload to bound (default: the one named after the topology)')
+    parser.add_argument('--tolerance', type=float, default=SIZE_TOLERANCE, help='relative difference in packet size below which packets share a path (0 for exact sizes)')
+    parser.add_argument('--seed', type=int, help='seed of the runs to bound, whose noise takes media above their mean byte_rate (default: bound runs without noise)')
+    parser.add_argument('--limit', type=int, default=20000, help='time limit of the runs to bound, as far as their noise goes')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    workload = args.workload or args.topology
+    filename = f'workloads/{workload}.bin'
+    if not os.path.exists(filename): filename = f'workloads/{workload}.csv'
+    start = time.perf_counter()
+    topology = load_topology(args.topology)
+    rates = None
+    if args.seed is not None:
+        import main # Noise parameters the runs use
+        rng_init(args.seed)
+        rates = peak_rates(topology, {id: NoiseSeries(byte_rate, main.RATE_DEVIATION, args.limit + 1, seed=rng_seed('noise', 2*id)) for id, byte_rate in zip(topology.ids.tolist(), topology.byte_rate.tolist())})
+    bounds = lower_bounds(topology, filename, args.tolerance, rates=rates)
+    print(f'{bounds.packets} PACKETS ({bounds.unreachable} UNREACHABLE) IN {time.perf_counter() - start:.2f}s')
+    print(f'MEAN LATENCY: at least {bounds.latency_mean()} (units of time)')
+    print(f'COMPLETION TIME: at least {bounds.completion} (units of time), {bounds.contention_free} without contention')
@@ -1,62 +1,64 @@
 import math
-import random
 from simulation import *
 
 # Ad-Hoc On-Demand Distance Vector Routing Protocol
 
+# Control messages. Every message other than HELLO is a broadcast, identified by its source and the source's broadcast count.
+class Hello(Message):
+    __slots__ = ()
+class RREQ(Message):
+    __slots__ = ('dest', 'sequence', 'broadcast')
+class RREP(Message):
+    __slots__ = ('target', 'sequence', 'next_hop', 'distance', 'broadcast')
+class RERR(Message):
+    __slots__ = ('dests', 'broadcast')
+
+# Latest time a table entry can have been updated at and still be expired at the given timestamp, since entries expire once they are strictly older than their timeout.
+def stale_before(timestamp, timeout):
+    return math.ceil(timestamp - timeout) - 1
+
 class Router(Medium):
     def __init__(self, *args):
         super(Router, self).__init__(*args)
         self.routes_table = {}         # dest id : (timestamp, sequence id, next hop id, total distance)
         self.neighbors_table = {}      # neighbor id : (timestamp, link id)
-        self.broadcasts_table = {}     # source id : broadcast count
+        self.neighbor_timers = Timers() # neighbor id : timestamp last heard from, for hello expiry
+        self.route_timers = Timers()    # dest id : timestamp of the route, for route expiry
         self.sequence_count = 0        # included in both RREQ and RREP, incremented before sending either, recipients of RREP use this to determine whether to update according to a new route
         self.broadcast_count = 0       # included in all broadcast messages, used by recipients to avoid looping by recognizing if they have already seen the same (source, broadcast_count) pair
         self.timestamp = 0
-        self.hello_timeout = 100 + random.randint(-10, 10)      # Better to have some variance in the expiration times, which require route information updates, so they don't all hit at once.
+        self.hello_timeout = 100 + self.rng.randint(-10, 10)      # Better to have some variance in the expiration times, which require route information updates, so they don't all hit at once.
         self.hello_delays = []
-        self.route_timeout = 1000 + random.randint(-100, 100)   # However, these values will automatically be updated over time based on how long it takes to send packets. This is not required by the protocol, but it is allowed by it, and it means those numbers don't have to be carefully chosen for each individual network topology.
+        self.route_timeout = 1000 + self.rng.randint(-100, 100)   # However, these values will automatically be updated over time based on how long it takes to send packets. This is not required by the protocol, but it is allowed by it, and it means those numbers don't have to be carefully chosen for each individual network topology.
         self.rrep_delays = []
         self.delay_aggregate = 20                               # Base timeouts on the average delay of up to the last N packets of the relevant type.
         self.poll_frequency = 0.01                              # Spend roughly this fraction of your time re-polling neighbors/routes.
-        self.buffer['in'] = []
-        self.buffer['out'] = []
-        self.buffer['route_pending'] = []
         self.queue_max = 200
+        self.buffer['in'] = Queue(self.queue_max, self.queue_policy, rng=self.queue_rng, inbound=True)
+        self.buffer['out'] = Queue(self.queue_max, self.queue_policy, field=1, rng=self.queue_rng, target=0)
+        self.buffer['route_pending'] = Queue(self.queue_max, self.queue_policy, rng=self.queue_rng)
+        self.broadcasts_seen = DedupCache(1000, self.route_timeout) # (source id, broadcast count) of recent broadcasts, remembered for as long as a route would be
         self.logic = True
         self.routes_table[self.id] = (-1, -1, None, 0)
     # Ignore stale broadcast packets, otherwise carry on
     def receive_clear(self, packet, one_hop_sender):
-        if packet.dest == -1 and packet.content != 'HELLO':
-            _, broadcast_identifier, _ = self.open_broadcast(packet)
-            if self.register_broadcast(broadcast_identifier) == False:
-                #print(f"* {broadcast_identifier}")
+        if packet.dest == -1 and not isinstance(packet.content, Hello):
+            if not self.broadcasts_seen.add((packet.source, packet.content.broadcast), self.timestamp):
                 return
         super(Router, self).receive_clear(packet, one_hop_sender)
     # Buffering incoming packets
     def receive_full(self, packet, one_hop_sender):
-        if len(self.buffer) < self.queue_max:
-            self.buffer['in'].append(packet)
-        else:
-            self.drop_packet(packet, 'in queue full')
-            #raise SystemExit
-    # Look up a neighbor medium by ID
+        self.enqueue(self.buffer['in'], packet, 'in queue full')
+    # Look up the link to a neighbor by ID, the one its hello messages came in through (if it is still connected)
     def get_neighbor(self, id):
         if id not in self.neighbors_table.keys(): return None
-        link_id = self.neighbors_table[id][1]
-        for connection in self.connections:
-            if connection.id == link_id:
-                return connection
+        return self.network.connection(self, self.neighbors_table[id][1])
     # Send or buffer, depending on whether the target can accept the transmission right away
     def send(self, packet, target):
         if len(target.in_transit) < target.pathways or isinstance(target, Router):
             target.receive(packet, self)
         else:
-            if len(self.buffer['out']) < self.queue_max:
-                self.buffer['out'].append((target, packet))
-            else:
-                self.drop_packet(packet, 'out queue full')
-                #raise SystemExit
+            self.enqueue(self.buffer['out'], (target, packet), 'out queue full')
     # Propagate a packet to all known neighbors
     def broadcast(self, packet, one_hop_sender=None):
         for connection in self.connections:
@@ -65,83 +67,76 @@ class Router(Medium):
     # Start a new broadcast
     def init_broadcast(self, packet):
         self.broadcast_count += 1
-        packet.content += f':{self.broadcast_count}'
+        packet.content.broadcast = self.broadcast_count
         self.broadcast(packet)
-    # Unpacks the structure of a simple AODV-style broadcast packet
-    def open_broadcast(self, packet):
-        request_type, contents, count = packet.content.split(':')
-        broadcast_identifier = (packet.source, int(count))
-        contents = contents.split(',')
-        return request_type, broadcast_identifier, contents
-    # Updates the broadcasts_table as necessary, returning True if this is a new broadcast, and False if we've seen it before and should discard it
-    def register_broadcast(self, broadcast_identifier):
-        source = broadcast_identifier[0]
-        count = broadcast_identifier[1]
-        if source not in self.broadcasts_table.keys():
-            self.broadcasts_table[source] = count
-            return True
-        if source in self.broadcasts_table.keys():
-            if self.broadcasts_table[source] < count:
-                self.broadcasts_table[source] = count
-                return True
-        return False
     # Manage queues, manage "Hello" logic, manage expiring routes
     def tick(self, timestamp):
         super(Router, self).tick(timestamp)
         self.timestamp = timestamp
         # Queue management
         if len(self.buffer['route_pending']):
-            for packet in self.buffer['route_pending']:
-                if packet.dest in self.routes_table.keys():
-                    target = self.get_neighbor(self.routes_table[packet.dest][2])
-                    if target:
-                        self.send(packet, target)
-                        self.buffer['route_pending'].remove(packet)
-                    #else:
-                    #    print('AAAAA')
-                    #    raise SystemExit
-                #elif random.random() < 0.05:
-                #    self.request_route(packet)
-                #    self.buffer['route_pending'].remove(packet)
-                #    self.drop_packet(packet)
+            self.buffer['route_pending'].drain(self.route_pending)
         if len(self.buffer['in']) and len(self.in_transit) < self.pathways:
-            self.receive_clear(self.buffer['in'][0], self)
-            self.buffer['in'] = self.buffer['in'][1:]
+            self.receive_clear(self.buffer['in'].popleft(), self)
         if len(self.buffer['out']):
-            for target, packet in self.buffer['out']:
-                if len(target.in_transit) < target.pathways or isinstance(target, Router):
-                    target.receive(packet, self)
-                    self.buffer['out'].remove((target, packet))
+            self.buffer['out'].drain(self.send_queued)
         # Sending out hello messages every timeout/3 units of time
         if self.id not in self.neighbors_table.keys() or (self.timestamp - self.neighbors_table[self.id][0]) > (self.hello_timeout // 3):
             self.neighbors_table[self.id] = (self.timestamp, -1)
-            hello = Packet(self.id, -1, content='HELLO')
+            hello = Packet(self.id, -1, content=Hello())
             hello.time_sent = timestamp
             self.broadcast(hello)
         # Deleting known neighbors if no hello is received in timeout
-        deleted = set()
-        for neighbor in self.neighbors_table.keys():
-            if neighbor == self.id: continue
-            if (self.timestamp - self.neighbors_table[neighbor][0]) > self.hello_timeout:
-                #print('EXPIRED HELLO')
-                deleted.add(neighbor)
+        deleted = set(self.neighbor_timers.expire(stale_before(self.timestamp, self.hello_timeout)))
         deleted_update = set()
         for neighbor in deleted:
             del self.neighbors_table[neighbor]
             deleted_update.update(self.remove_routes([neighbor]))
         deleted.update(deleted_update)
         # Deleting expired routes
-        for route in self.routes_table.keys():
+        for route in self.route_timers.expire(stale_before(self.timestamp, self.route_timeout)):
             if route in self.neighbors_table.keys(): continue # The hello message will provide more recent information on our immediate neighbors, this larger timeout is only for more distant routes
-            if (self.timestamp - self.routes_table[route][0]) > self.route_timeout:
-                #print('EXPIRED ROUTE')
-                deleted.add(route)
+            deleted.add(route)
         for route in deleted:
             if route in self.routes_table.keys():
-                del self.routes_table[route]
+                self.delete_route(route)
         # Broadcasting any and all deletions
         if len(deleted):
-            self.init_broadcast(Packet(self.id, -1, content=f'RERR:{",".join(str(d) for d in deleted)}'))
+            self.init_broadcast(Packet(self.id, -1, content=RERR(list(deleted), 0)))
+    # Send a packet that was waiting on a route, if there is one now.
+    def route_pending(self, packet):
+        if packet.dest not in self.routes_table.keys(): return False
+        target = self.get_neighbor(self.routes_table[packet.dest][2])
+        if not target: return False
+        self.send(packet, target)
+        return True
+    # Send a packet from the out queue, if the target has room for it now.
+    def send_queued(self, item):
+        target, packet = item
+        if len(target.in_transit) < target.pathways or isinstance(target, Router):
+            target.receive(packet, self)
+            return True
+        return False
+    # Idle ticks only move the clock forward.
+    def advance(self, timestamp):
+        if timestamp > self.clock: self.timestamp = timestamp
+        super(Router, self).advance(timestamp)
+    # Wake up for the next hello message, neighbor expiry or route expiry, whichever comes first.
+    def next_event(self, timestamp):
+        if self.id not in self.neighbors_table: return timestamp
+        hello = math.floor(self.neighbors_table[self.id][0] + self.hello_timeout // 3) + 1
+        heard = self.neighbor_timers.next_deadline()
+        updated = self.route_timers.next_deadline()
+        neighbor_expiry = math.floor(heard + self.hello_timeout) + 1 if heard is not None else None
+        route_expiry = math.floor(updated + self.route_timeout) + 1 if updated is not None else None
+        return earliest(super(Router, self).next_event(timestamp), hello, neighbor_expiry, route_expiry)
+    # Add or refresh a route, along with its expiry timer.
+    def set_route(self, dest, route):
+        self.routes_table[dest] = route
+        self.route_timers.set(dest, route[0])
+    def delete_route(self, dest):
+        del self.routes_table[dest]
+        self.route_timers.cancel(dest)
     # Delete routes that no longer work, return list of routes that ended up getting deleted.
     def remove_routes(self, routes):
         deleted = []
@@ -150,64 +145,62 @@ class Router(Medium):
             if target in routes or hop in routes:
                 deleted.append(target)
         for target in deleted:
-            del self.routes_table[target]
+            self.delete_route(target)
         return deleted
     # Either send out a RREQ or an RERR (depending on who tried to send the packet) because we don't know where to send it yet.
     def request_route(self, packet):
         if packet.source == self.id or packet.source == None:
             self.sequence_count += 1
-            request = Packet(self.id, -1, content=f'RREQ:{packet.dest},{self.sequence_count}')
+            request = Packet(self.id, -1, content=RREQ(packet.dest, self.sequence_count, 0))
             self.init_broadcast(request)
             #print(f'\t***RREQ ({self.id})\t({self.broadcast_count})\t{(packet.dest)}')
         else:
-            if packet.dest in self.routes_table.keys(): del self.routes_table[packet.dest]
-            error = Packet(self.id, -1, content=f'RERR:{packet.dest}')
+            if packet.dest in self.routes_table.keys(): self.delete_route(packet.dest)
+            error = Packet(self.id, -1, content=RERR([packet.dest], 0))
             self.init_broadcast(error)
     # Process incoming packets, attempt to route them where they need to go, and use them to update route data if they are route broadcasts
     def process(self, packet, one_hop_sender):
         # Handling broadcasts
         if packet.dest == -1:
             # Hello broadcast
-            if packet.content == 'HELLO':
+            message = packet.content
+            if isinstance(message, Hello):
                 self.neighbors_table[packet.source] = (self.timestamp, one_hop_sender.id)
-                self.routes_table[packet.source] = (self.timestamp, 0, packet.source, 1)
+                self.neighbor_timers.set(packet.source, self.timestamp)
+                self.set_route(packet.source, (self.timestamp, 0, packet.source, 1))
                 self.hello_delays.append((self.timestamp - packet.time_sent))
                 if len(self.hello_delays) > self.delay_aggregate: self.hello_delays = self.hello_delays[1:]
                 self.hello_timeout = (math.ceil((sum(self.hello_delays)+len(self.hello_delays))/len(self.hello_delays))+10) // self.poll_frequency
                 return
-            request_type, broadcast_identifier, contents = self.open_broadcast(packet)
-            broadcast_count = broadcast_identifier[1]
+            broadcast_count = message.broadcast
             # Route request broadcast
-            if request_type == 'RREQ':
-                target = int(contents[0])
-                sequence = int(contents[1])
+            if isinstance(message, RREQ):
+                target = message.dest
+                sequence = message.sequence
                 if target == self.id:
                     self.sequence_count = max(self.sequence_count, sequence)
                     self.sequence_count += 1
-                    data = [self.id, self.sequence_count, self.id, 1]
-                    reply = Packet(self.id, -1, content=f'RREP:{",".join(str(d) for d in data)}')
+                    reply = Packet(self.id, -1, content=RREP(self.id, self.sequence_count, self.id, 1, 0))
                     reply.time_sent = self.timestamp
                     self.init_broadcast(reply)
-                    #print(f'\t*RREP ({self.id})\t({self.broadcast_count})\t{(data[0], data[2], data[3])}')
+                    #print(f'\t*RREP ({self.id})\t({self.broadcast_count})\t{(reply.content.target, reply.content.next_hop, reply.content.distance)}')
                     return
                 elif target in self.routes_table:
                     if sequence > self.routes_table[target][1]:
-                        data = [target, self.routes_table[target][1], self.id, self.routes_table[target][3]+1]
-                        reply = Packet(self.id, -1, content=f'RREP:{",".join(str(d) for d in data)}')
                         self.broadcast_count += 1
-                        reply.content += f':{self.broadcast_count}'
+                        reply = Packet(self.id, -1, content=RREP(target, self.routes_table[target][1], self.id, self.routes_table[target][3]+1, self.broadcast_count))
                         reply.time_sent = self.timestamp
                         self.send(reply, one_hop_sender)
-                        #print(f'\t*RREP ({self.id})\t({broadcast_count})\t{(data[0], data[2], data[3])}')
+                        #print(f'\t*RREP ({self.id})\t({broadcast_count})\t{(reply.content.target, reply.content.next_hop, reply.content.distance)}')
                         #print(f'\t\t\t({packet.source},{self.broadcasts_table[packet.source]})')
                         #raise SystemExit
                         return
             # Route reply broadcast
-            elif request_type == 'RREP':
-                target = int(contents[0])
-                sequence = int(contents[1])
-                next_hop = int(contents[2])
-                distance = int(contents[3])
+            elif isinstance(message, RREP):
+                target = message.target
+                sequence = message.sequence
+                next_hop = message.next_hop
+                distance = message.distance
                 time_sent = packet.time_sent
                 route_good = False
                 if target not in self.routes_table: route_good = True
@@ -215,22 +208,18 @@ class Router(Medium):
                 elif sequence == self.routes_table[target][1] and distance < self.routes_table[target][3]: route_good = True
                 if route_good:
                     #print(f'\tRREP ({self.id})\t({broadcast_count})\t{(target, next_hop, distance)}')
-                    data = [target, sequence, self.id, distance+1]
-                    reply = Packet(packet.source, -1, content=f'RREP:{",".join(str(d) for d in data)}')
-                    reply.content += f':{broadcast_count}'
+                    reply = Packet(packet.source, -1, content=RREP(target, sequence, self.id, distance+1, broadcast_count))
                     reply.time_sent = time_sent
                     self.broadcast(reply, one_hop_sender)
-                    self.routes_table[target] = [self.timestamp, sequence, next_hop, distance]
+                    self.set_route(target, [self.timestamp, sequence, next_hop, distance])
                 #else:
                     #print(f'\tRREP ({self.id})\t({broadcast_count})\t(suboptimal route)')
                 return
             # Route error broadcast
-            elif request_type == 'RERR':
-                contents = [int(c) for c in contents]
-                deleted = self.remove_routes(contents)
+            elif isinstance(message, RERR):
+                deleted = self.remove_routes(message.dests)
                 if len(deleted):
-                    error = Packet(packet.source, -1, content=f'RERR:{",".join(str(d) for d in deleted)}')
-                    error.content += f':{broadcast_count}'
+                    error = Packet(packet.source, -1, content=RERR(deleted, broadcast_count))
                     self.broadcast(error, one_hop_sender)
                 return
             # If it hasn't returned yet, propagate the broadcast to other media
@@ -249,15 +238,5 @@ class Router(Medium):
             # else:
             #     self.drop_packet(packet, 'missing neighbor')
         # else:
-        if len(self.buffer['route_pending']) < self.queue_max:
-            self.buffer['route_pending'].append(packet)
-            self.request_route(packet)
-        else:
-            self.drop_packet(packet, 'routing queue full')
-        #    raise SystemExit
-    def count_buffers(self):
-        count = 0
-        count += len([i for i in self.buffer['in'] if i.content == ''])
-        count += len([i for i in self.buffer['out'] if i[1].content == ''])
-        count += len([i for i in self.buffer['route_pending'] if i.content == ''])
-        return 0
\ No newline at end of file
+        if self.enqueue(self.buffer['route_pending'], packet, 'routing queue full') is not packet:
+            self.request_route(packet)
\ No newline at end of file
@@ -1,3 +1,4 @@
+import heapq
 import math
 from simulation import *
 
@@ -7,58 +8,100 @@ from simulation import *
 # However, this algorithm, while not theoretically *perfectly* optimal, is pretty good. Probably significantly better than any real-life algorithm that doesn't cheat could be.
 # It is essentially a greedy algorithm that routes packets down whatever the fastest predicted route is, calculated again at each hop, taking into account complete knowledge of both the network topology and the current load of other packets on the network infrastructure.
 
+index = None # The adjacency index of the network being simulated, shared by all of its routers
+
+# Compact integer adjacency of a whole network in CSR form (the neighbors of medium i are targets[offsets[i]:offsets[i+1]]), built once by walking the connections out from any medium in it.
+# Thrown out whenever the network gets rewired, see forget().
+class AdjacencyIndex:
+    def __init__(self, start):
+        self.media = [start]
+        self.positions = {start.id: 0}
+        for medium in self.media:
+            for connection in medium.connections:
+                if connection.id not in self.positions:
+                    self.positions[connection.id] = len(self.media)
+                    self.media.append(connection)
+        self.offsets = [0]
+        self.targets = []
+        for medium in self.media:
+            self.targets.extend(self.positions[connection.id] for connection in medium.connections)
+            self.offsets.append(len(self.targets))
+    # Whether this index still describes the network the given medium is part of.
+    def current(self, medium):
+        position = self.positions.get(medium.id)
+        return position is not None and self.media[position] is medium
+
+# Listener for changes to the wiring of the network, which leave the index out of date.
+def forget(*_):
+    global index
+    index = None
+
 class Router(Medium):
     def __init__(self, *args):
         super(Router, self).__init__(*args)
-        self.buffer['in'] = []
-        self.buffer['out'] = []
         self.queue_max = 200
+        self.buffer['in'] = Queue(self.queue_max, self.queue_policy, rng=self.queue_rng, inbound=True)
+        self.buffer['out'] = Queue(self.queue_max, self.queue_policy, field=1, rng=self.queue_rng, target=0)
         self.logic = True
     def receive_full(self, packet, _):
-        if len(self.buffer['in']) < self.queue_max:
-            self.buffer['in'].append(packet)
-        else:
-            self.drop_packet(packet, 'incoming queue full')
+        self.enqueue(self.buffer['in'], packet, 'incoming queue full')
     # Packets can still get lost if they are randomly dropped by a poor medium, but they keep enough of a queue that they never get dropped just from a particular medium being congested.
     def tick(self, timestamp):
         super(Router, self).tick(timestamp)
         if len(self.buffer['in']) and len(self.in_transit) < self.pathways:
-            self.receive_clear(self.buffer['in'][0], self)
-            self.buffer['in'] = self.buffer['in'][1:]
+            self.receive_clear(self.buffer['in'].popleft(), self)
         if len(self.buffer['out']):
-            for target, packet in self.buffer['out']:
-                if len(target.in_transit) < target.pathways or isinstance(target, Router):
-                    target.receive(packet, self)
-                    self.buffer['out'].remove((target, packet))
+            self.buffer['out'].drain(self.send_queued)
+    # Send a packet from the out queue, if the target has room for it now.
+    def send_queued(self, item):
+        target, packet = item
+        if len(target.in_transit) < target.pathways or isinstance(target, Router):
+            target.receive(packet, self)
+            return True
+        return False
     # Send a packet, or put it in the out buffer if need be.
     def send(self, packet, target):
         if len(target.in_transit) < target.pathways or isinstance(target, Router):
             target.receive(packet, self)
         else:
-            if len(self.buffer['out']) < self.queue_max:
-                self.buffer['out'].append((target, packet))
-            else:
-                self.drop_packet(packet, 'outgoing queue full')
+            self.enqueue(self.buffer['out'], (target, packet), 'outgoing queue full')
     # We know almost the exact time it takes to pass through every medium, at least at this particular moment, since we know it's exact throughput, we know how many packets are currently in transit, and we know how many are queued up (the only thing we don't predict is the random variation that occurs in the throughput)
     def time(self, packet, medium):
         return math.ceil(packet.byte_size/(medium.byte_rate/(len(medium.in_transit)+medium.count_buffers()+1))) + medium.overhead
     # Route packets with an omniscient dijkstras algorithm
     def process(self, packet, _):
         if packet.dest == self.id: return
-        visited = [self]
-        best_paths = {self.id:([], 0)} # medium : ([shortest path], time)
-        best_paths.update({connection.id:([self], self.time(packet, connection)) for connection in self.connections})
-        frontier = [connection for connection in self.connections]
-        while len(frontier) != 0:
-            visited.extend(frontier)
-            newfrontier = []
-            for medium in frontier:
-                for connection in medium.connections:
-                    if connection not in visited:
-                        newfrontier.append(connection)
-                        t = self.time(packet, connection) + best_paths[medium.id][1]
-                        if connection not in best_paths or t < best_paths[connection.id][1]:
-                            best_paths[connection.id] = (best_paths[medium.id][0] + [medium], t)
-            frontier = newfrontier
-        target = best_paths[packet.dest][0][1]
-        self.send(packet, target)
\ No newline at end of file
+        hop = self.next_hop(packet)
+        if hop is None:
+            self.drop_packet(packet, 'destination unreachable')
+            return
+        self.send(packet, hop)
+    # Dijkstra's algorithm over the adjacency index, where the cost of a path is the predicted time() spent in every medium along it after this one.
+    # Returns the neighbor to send the packet to next, or None if the destination can't be reached.
+    # Every packet gets a search of its own, since the loads it is routed around change with every packet sent, and routes reused from a cache of shortest path trees shared between routers (tried, and about 10% faster on 500 hosts) would no longer be the ones this algorithm picks.
+    def next_hop(self, packet):
+        global index
+        if index is None or not index.current(self):
+            index = AdjacencyIndex(self)
+            self.network.subscribe(forget)
+        source = index.positions[self.id]
+        target = index.positions.get(packet.dest)
+        if target is None: return None
+        media, offsets, targets = index.media, index.offsets, index.targets
+        costs = [None] * len(media)           # predicted time spent in each medium, worked out when first needed
+        distances = [math.inf] * len(media)
+        first_hops = [None] * len(media)      # the neighbor of this router that the best known path to each medium starts with
+        distances[source] = 0
+        heap = [(0, source)]
+        while heap:
+            distance, position = heapq.heappop(heap)
+            if position == target: return media[first_hops[target]]
+            if distance > distances[position]: continue
+            for neighbor in targets[offsets[position]:offsets[position+1]]:
+                if costs[neighbor] is None: costs[neighbor] = self.time(packet, media[neighbor])
+                t = distance + costs[neighbor]
+                if t < distances[neighbor]:
+                    distances[neighbor] = t
+                    first_hops[neighbor] = neighbor if position == source else first_hops[position]
+                    heapq.heappush(heap, (t, neighbor))
+        return None
@@ -1,45 +1,45 @@
+import math
 from simulation import *
 
 # This is a broadcast-only protocol.
 # Calling this a "routing" algorithm would be charitable, since it does not really do any routing.
 # Instead, all packets are broadcast everywhere with no care for the intended recipient. Unsurprisingly, this is very slow.
-# The only two things this algorithm really does is 1) store the last N packets seen in a basic attempt to reduce route loops and 2) queue packets so they aren't constantly dropped.
+# The only two things this algorithm really does is 1) remember the packets it has seen so it doesn't flood them again and 2) queue packets so they aren't constantly dropped.
 # All of the relevant storage queues have a finite size and can be overwhelmed.
 
+SEEN_LIFETIME = 5000 # Units of time a packet is remembered for after it was first seen, well past how long copies of one keep flooding around (up to about 3000 on the 20 host topologies under disruption)
+
 class Router(Medium):
     def __init__(self, *args):
         super(Router, self).__init__(*args)
-        self.buffer['in'] = []
-        self.buffer['out'] = []
-        self.seen = []
         self.queue_max = 200
+        self.seen = DedupCache(math.inf, SEEN_LIFETIME)
+        self.buffer['in'] = Queue(self.queue_max, self.queue_policy, rng=self.queue_rng, inbound=True)
+        self.buffer['out'] = Queue(self.queue_max, self.queue_policy, field=1, rng=self.queue_rng, target=0)
         self.logic = True
     def receive_clear(self, packet, one_hop_sender):
-        if packet in self.seen: return
-        self.seen.append(packet)
-        if len(self.seen) > self.queue_max: self.seen = self.seen[1:]
+        if not self.seen.add(packet, self.clock): return
         super(Router, self).receive_clear(packet, one_hop_sender)
     def receive_full(self, packet, one_hop_sender):
-        if len(self.buffer['in']) < self.queue_max:
-            self.buffer['in'].append(packet)
-        else:
-            super(Router, self).receive_full(packet, one_hop_sender)
+        self.enqueue(self.buffer['in'], packet, 'medium is full')
     def tick(self, timestamp):
         super(Router, self).tick(timestamp)
         if len(self.buffer['in']) and len(self.in_transit) < self.pathways:
-            self.receive_clear(self.buffer['in'][0], self)
-            self.buffer['in'] = self.buffer['in'][1:]
+            self.receive_clear(self.buffer['in'].popleft(), self)
         if len(self.buffer['out']):
-            for target, packet in self.buffer['out']:
-                if len(target.in_transit) < target.pathways or isinstance(target, Router):
-                    target.receive(packet, self)
-                    self.buffer['out'].remove((target, packet))
+            self.buffer['out'].drain(self.send_queued)
+    # Send a packet from the out queue, if the target has room for it now.
+    def send_queued(self, item):
+        target, packet = item
+        if len(target.in_transit) < target.pathways or isinstance(target, Router):
+            target.receive(packet, self)
+            return True
+        return False
     def send(self, packet, target):
         if len(target.in_transit) < target.pathways or isinstance(target, Router):
             target.receive(packet, self)
         else:
-            if len(self.buffer['out']) < self.queue_max:
-                self.buffer['out'].append((target, packet))
+            self.buffer['out'].append((target, packet)) # Other copies of the packet are still out there, so this one is just discarded if it doesn't fit
     def process(self, packet, one_hop_sender):
         if packet.dest == self.id: return
         for connection in self.connections:
@@ -1,6 +1,6 @@
-import json
-import random
-from collections import Counter
+import time
+
+import metrics
 from router import *
 
 # Border Gateway Protocol
@@ -19,82 +19,167 @@ from router import *
 # Neighbors use keepalive to advertise when a route stops working
 # Neighbors use keepalive to advertise when a new route appears
 
+# Control messages. An UPDATE carries a list of (route, sign) pairs, where sign is True for a newly announced route and False for a withdrawn one.
+class Keepalive(Message):
+    __slots__ = ()
+class Update(Message):
+    __slots__ = ('routes',)
+
+# A router's table of the shortest known paths to each destination, with the paths indexed by the neighbor they go through first.
+# Paths are tuples, which routers never modify, so a path is shared by every router that learned it from the same UPDATE rather than copied.
+# Since the paths to a destination all have the same length, the only paths a withdrawn route can take down with it are the ones to its destination, so withdrawals only ever look at those.
+class RouteTable:
+    def __init__(self):
+        self.routes = {}    # dest id : [path, ...], all of the same (shortest known) length, in the order they were learned
+        self.via = {}       # next hop id : set of the paths in the table that start with it
+    def __contains__(self, path):
+        return path in self.via.get(path[0], ())
+    def index(self, path):
+        paths = self.via.get(path[0])
+        if paths is None: paths = self.via[path[0]] = set()
+        paths.add(path)
+    def unindex(self, path):
+        paths = self.via[path[0]]
+        paths.discard(path)
+        if not paths: del self.via[path[0]]
+    # Replace the paths to a destination.
+    def set(self, dest, paths):
+        self.delete(dest)
+        self.routes[dest] = paths
+        for path in paths: self.index(path)
+    def add(self, path):
+        self.routes[path[-1]].append(path)
+        self.index(path)
+    def delete(self, dest):
+        for path in self.routes.pop(dest, ()): self.unindex(path)
+    # Remove every path that starts with the given hop, returning them.
+    def delete_via(self, hop):
+        deleted = list(self.via.pop(hop, ()))
+        for path in deleted:
+            paths = self.routes[path[-1]]
+            paths.remove(path)
+            if not paths: del self.routes[path[-1]]
+        return deleted
+    # Remove the paths that end with the given (withdrawn) route, returning them in table order.
+    def withdraw(self, route):
+        dest = route[-1]
+        paths = self.routes[dest]
+        start = len(paths[0]) - len(route)
+        if start < 0: return []
+        withdrawn = [path for path in paths if path[start] == route[0] and path[start:] == route]
+        if not withdrawn: return withdrawn
+        for path in withdrawn:
+            paths.remove(path)
+            self.unindex(path)
+        if not paths: del self.routes[dest]
+        return withdrawn
+
 class Router(BasicRouter):
     def __init__(self, *args):
         super(Router, self).__init__(*args)
-        self.links = {}
-        self.advertised_routes = []
-        self.routes_to_advertise = []
-        self.neighbors = Counter()
+        self.table = RouteTable()
+        self.routes = self.table.routes
+        self.pending = {}         # path : True to announce it, False to withdraw it, the net change to advertise at the end of the current interval
+        self.advertised = {}      # neighbor id : set of the paths currently advertised to that neighbor
+        self.syncing = set()      # neighbors we (re)gained a session with, which get told the difference between the whole table and what they were told before at the end of the interval
+        self.neighbors = Timers() # neighbor id : timestamp its hold time runs out at, unless another keepalive comes in first
         self.last_sent = -60
         self.last_advertised = -60
-        self.timeout = 200 + random.randint(-20, 20)
+        self.timeout = 200 + self.rng.randint(-20, 20)
+    # A keepalive from a neighbor we have no session with starts one, and since it missed every UPDATE while there was none, it gets resynced.
     def add_neighbor(self, neighbor):
-        self.routes[neighbor] = [[neighbor]]
-        self.routes_to_advertise.append(([self.id, neighbor], True))
-        self.neighbors[neighbor] = self.timeout
+        if neighbor not in self.neighbors:
+            self.syncing.add(neighbor)
+            self.advertised.setdefault(neighbor, set())
+        self.table.set(neighbor, [(neighbor,)])
+        self.pending[(self.id, neighbor)] = True
+        self.neighbors.set(neighbor, self.clock + self.timeout - 1)
+    # A session that just timed out while the link is still there is most likely down to congestion, and comes back as soon as a keepalive gets through, so the routes learned over it are kept (and what it was told is remembered, to resync it from).
+    # If the link itself is gone though, so is every route through that neighbor, and it has to be told the whole table again if it ever comes back.
     def remove_neighbor(self, neighbor):
-        del self.routes[neighbor]
-        if [self.id, neighbor] in self.advertised_routes: self.advertised_routes.remove([self.id, neighbor])
-        self.routes_to_advertise.append(([self.id, neighbor], False))
+        self.table.delete(neighbor)
+        self.pending[(self.id, neighbor)] = False
+        if self.network.link(self, neighbor) is None:
+            for path in self.table.delete_via(neighbor):
+                self.pending[(self.id,) + path] = False
+            self.advertised.pop(neighbor, None)
+            self.syncing.discard(neighbor)
     # Send routing updates
     def tick(self, timestamp):
         super(Router, self).tick(timestamp)
         if (self.timestamp - self.last_sent) > (self.timeout // 4):
             self.last_sent = self.timestamp
-            keepalive = Packet(self.id, -1, content='KEEPALIVE')
+            keepalive = Packet(self.id, -1, content=Keepalive())
             for connection in self.connections: self.send(keepalive, connection)
-        for neighbor in self.neighbors.keys():
-            self.neighbors[neighbor] -= 1
-            if self.neighbors[neighbor] == 0:
-                self.remove_neighbor(neighbor)
+        for neighbor in self.neighbors.expire(timestamp):
+            self.remove_neighbor(neighbor)
         if (self.timestamp - self.last_advertised) > (self.timeout // 10):
             self.last_advertised = self.timestamp
-            trimmed_routes_to_advertise = [route for route in self.routes_to_advertise if route[1] == False or route[0] not in self.advertised_routes]
-            if len(trimmed_routes_to_advertise):
-                print(trimmed_routes_to_advertise)
-                routes = json.dumps(trimmed_routes_to_advertise)
-                update = Packet(self.id, -1, content=f'UPDATE:{routes}')
-                for connection in self.connections: self.send(update, connection)
-                self.advertised_routes.extend([route[0] for route in trimmed_routes_to_advertise])
-            self.routes_to_advertise = []
+            if self.pending or self.syncing:
+                start = time.perf_counter()
+                self.advertise()
+                if metrics.collector: metrics.collector.control(time.perf_counter() - start)
+    # Send each neighbor an UPDATE with the net changes to what it has been told since the last one, once per interval (like BGP's minimum route advertisement interval).
+    # A route announced and withdrawn again within the interval (or the other way around) cancels out, nobody is told about a route that goes through them (split horizon), and withdrawals only go to neighbors that were told about the route.
+    def advertise(self):
+        for neighbor, link in self.network.neighbors[self.id].items():
+            if neighbor not in self.neighbors: continue # No session with it (yet)
+            advertised = self.advertised[neighbor]
+            changes = []
+            if neighbor in self.syncing: # Withdraw whatever it was told that we no longer have, and announce whatever it wasn't told
+                current = {(self.id,) + path for paths in self.routes.values() for path in paths if neighbor not in path}
+                changes = [(path, False) for path in advertised if path not in current]
+                changes += [((self.id,) + path, True) for paths in self.routes.values() for path in paths if neighbor not in path and (self.id,) + path not in advertised]
+                self.advertised[neighbor] = current
+            else:
+                for path, sign in self.pending.items():
+                    if sign:
+                        if path in advertised or neighbor in path: continue
+                        advertised.add(path)
+                    else:
+                        if path not in advertised: continue
+                        advertised.discard(path)
+                    changes.append((path, sign))
+            if changes: self.send(Packet(self.id, neighbor, content=Update(changes)), link)
+        self.pending = {}
+        self.syncing = set()
+    # Wake up for the next keepalive, advertisement or neighbor timeout, whichever comes first.
+    def next_event(self, timestamp):
+        keepalive = self.last_sent + self.timeout // 4 + 1
+        advertisement = self.last_advertised + self.timeout // 10 + 1
+        return earliest(super(Router, self).next_event(timestamp), keepalive, advertisement, self.neighbors.next_deadline())
     # Handle routing updates
     def process(self, packet, one_hop_sender):
         if packet.content:
-            if packet.content == 'KEEPALIVE':
-                self.links[packet.source] = one_hop_sender
+            if isinstance(packet.content, Keepalive):
                 self.add_neighbor(packet.source)
                 return
-            if packet.content.startswith('UPDATE'):
-                routes = json.loads(packet.content.split(':')[1])
-                for route_data in routes:
-                    route, sign = route_data
-                    dest = route[-1]
-                    if dest in self.routes.keys() and len(self.routes[dest]) > 0:
-                        if sign == False:
-                            my_routes = self.routes[dest].copy()
-                            for my_route in my_routes:
-                                if len(route) > len(my_route): continue
-                                if sign == False:
-                                    if my_route[-len(route):] == route: # The update is saying a route we have is bust, so we forget it and forward the removal message to others
-                                        self.routes[dest].remove(my_route)
-                                        if len(self.routes[dest]) == 0: del self.routes[dest]
-                                        full_route = [self.id] + my_route
-                                        self.routes_to_advertise.append((full_route, False))
-                                        if full_route in self.advertised_routes: self.advertised_routes.remove(full_route)
-                        else:
-                            if route in self.routes[dest]: continue
-                            current_shortest_path = min([len(r) for r in self.routes[dest]])
-                            if len(route) <= current_shortest_path:    # The update has a route that is at least as good as anything we already had for that destination, so we add it to our table and forward it to others
-                                if len(route) < current_shortest_path: # The update has a route to a destintion that is strictly better than anything we have, so we forget all our other routes
-                                    self.routes[dest] = []
-                                full_route = [self.id] + route
-                                self.routes[dest].append(route)
-                                self.routes_to_advertise.append((full_route, True))
-                    else:
-                        if sign == True: # The update is saying a new route exists for a destination we have no routes for, so we save it
-                            full_route = [self.id] + route
-                            self.routes[dest] = [route]
-                            self.routes_to_advertise.append((full_route, True))
+            if isinstance(packet.content, Update):
+                if packet.dest == self.id:
+                    start = time.perf_counter()
+                    self.update(packet.content.routes)
+                    if metrics.collector: metrics.collector.control(time.perf_counter() - start)
                 return
-        super(Router, self).process(packet, one_hop_sender)
\ No newline at end of file
+        super(Router, self).process(packet, one_hop_sender)
+    # Apply the changes in an UPDATE from a neighbor to the table, and queue up the resulting changes to our own advertisements.
+    def update(self, routes):
+        for route, sign in routes:
+            dest = route[-1]
+            if dest in self.routes:
+                if sign == False:
+                    for my_route in self.table.withdraw(route): # The update is saying routes we have are bust, so we forget them and forward the removal message to others
+                        self.pending[(self.id,) + my_route] = False
+                else:
+                    if route in self.table: continue
+                    current_shortest_path = len(self.routes[dest][0])
+                    if len(route) <= current_shortest_path:    # The update has a route that is at least as good as anything we already had for that destination, so we add it to our table and forward it to others
+                        if len(route) < current_shortest_path: # The update has a route to a destintion that is strictly better than anything we have, so we forget all our other routes
+                            for my_route in self.routes[dest]:
+                                if self.pending.get((self.id,) + my_route): del self.pending[(self.id,) + my_route] # Not worth announcing any more
+                            self.table.set(dest, [])
+                        self.table.add(route)
+                        self.pending[(self.id,) + route] = True
+            else:
+                if sign == True: # The update is saying a new route exists for a destination we have no routes for, so we save it
+                    self.table.set(dest, [route])
+                    self.pending[(self.id,) + route] = True
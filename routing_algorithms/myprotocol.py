@@ -1,14 +1,14 @@
+import math
 from simulation import *
 
 class Router(Medium):
     def __init__(self, *args):
         super(Router, self).__init__(*args)
         self.send_buffer = [] # TODO: all lists of packet refs anywhere should count towards a metric for their lengths, memory usage should be at least a little penalized
-        self.seen = []
+        self.seen = DedupCache(math.inf, 5000) # Packets that have already come through (in the last 5000 units of time, longer than any flood lasts), so they aren't flooded again
         self.logic = True
     def receive(self, packet, one_hop_sender):
-        if packet in self.seen: return
-        self.seen.append(packet)
+        if not self.seen.add(packet, self.clock): return
         super(Router, self).receive(packet, one_hop_sender)
     def receive_full(self, packet, _):
         self.buffer.append(packet)
@@ -23,6 +23,9 @@ class Router(Medium):
                 if len(target.in_transit) < target.pathways or isinstance(target, Router):
                     target.receive(packet, self)
                     self.send_buffer.remove((target, packet))
+    def next_event(self, timestamp):
+        if len(self.send_buffer): return timestamp
+        return super(Router, self).next_event(timestamp)
     def process(self, packet, one_hop_sender):
         if packet.dest == self.id: return
         for connection in self.connections:
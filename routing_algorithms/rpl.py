@@ -1,33 +1,263 @@
-from simulation import *
+from router import *
 
-class Router(Medium):
+# Routing Protocol for Low-Power and Lossy Networks (RFC 6550), in storing mode
+# Routers organize themselves into a DODAG (destination oriented directed acyclic graph) towards a single root, each one picking a preferred parent among its neighbors with a lower rank (roughly, distance from the root).
+#   - DIO: Broadcast by routers in the DODAG to advertise their rank, on a Trickle timer (RFC 6206) so that they go out quickly while things are changing and ever more rarely once they settle down.
+#   - DIS: Broadcast by routers that aren't in the DODAG (yet), which makes neighbors that are reset their Trickle timers and advertise themselves soon.
+#   - DAO: Sent by every router to its parent, listing every destination in its sub-DODAG (including itself), which the parent stores downward routes for and passes on to its own parent in turn. Withdrawn destinations are listed separately (a No-Path DAO).
+#     DAOs are numbered, since a big one can take longer to get through than a small one sent after it, and the parent ignores any older than the last one it took from the same child.
+#   - DAO-ACK: Sent back by the parent for every DAO, which is how a router can tell its parent is still there once DIOs have become rare.
+# Packets go up towards the root until they reach a router with a downward route to their destination, and then down from there.
+# Ranks follow Objective Function Zero (RFC 6552) with hop count as the metric, so a router's rank is its parent's plus MIN_HOP_RANK_INCREASE.
+# Each router forwarding a packet adds the rank it has and the direction it sent the packet in (the RPL option of RFC 6553, carried as the packet's option), so that the next router can tell when ranks are inconsistent, which means there might be a loop.
+
+ROOT = None                     # id of the router at the root of the DODAG, None for the lowest router id
+MIN_HOP_RANK_INCREASE = 256
+INFINITE_RANK = 0xffff
+
+TRICKLE_IMIN = 16               # shortest interval between DIOs
+TRICKLE_DOUBLINGS = 6           # times the interval doubles while things stay consistent, up to 16 * 2**6 = 1024
+TRICKLE_REDUNDANCY = 3          # DIOs are not sent in an interval in which at least this many were heard from siblings (neighbors of the same rank)
+
+DIS_INTERVAL = 64               # time between DISes while not in the DODAG, doubling (up to the longest Trickle interval) while nobody answers
+DAO_INTERVAL = 250              # time between DAOs refreshing the downward routes in the parent
+DAO_DELAY = 4                   # how long new and withdrawn destinations are collected up for, before a DAO with them goes out
+DAO_LIFETIME = 4 * DAO_INTERVAL # downward routes that aren't refreshed for this long are withdrawn
+PARENT_TIMEOUT = 3 * DAO_INTERVAL                               # a parent not heard from (DIO or DAO-ACK) for this long is gone
+CANDIDATE_TIMEOUT = 2 * TRICKLE_IMIN * 2 ** TRICKLE_DOUBLINGS   # other neighbors not heard from for this long are forgotten
+
+class DIO(Message):
+    __slots__ = ('rank',)
+class DIS(Message):
+    __slots__ = ()
+class DAO(Message):
+    __slots__ = ('sequence', 'targets', 'withdrawn')
+class DAOAck(Message):
+    __slots__ = ()
+class RankOption(Message):
+    __slots__ = ('rank', 'down', 'error')
+
+# Trickle timer: the interval starts out at imin and doubles every time it runs out, up to imax, and a message is sent at a random point in the second half of every interval, unless redundancy consistent messages were already heard in it.
+# Hearing something inconsistent resets the interval to imin.
+class Trickle:
+    def __init__(self, imin, doublings, redundancy, rng):
+        self.imin = imin
+        self.imax = imin * 2 ** doublings
+        self.redundancy = redundancy
+        self.rng = rng
+        self.interval = imin
+        self.start = None   # when the current interval started, None while stopped
+        self.fire = None    # when to send in the current interval, None once that has gone by
+        self.heard = 0      # consistent messages heard in the current interval
+    def begin(self, timestamp, interval):
+        self.interval = interval
+        self.start = timestamp
+        self.fire = timestamp + self.rng.randint(interval // 2, interval - 1)
+        self.heard = 0
+    def reset(self, timestamp):
+        if self.start is not None and self.interval == self.imin: return
+        self.begin(timestamp, self.imin)
+    def stop(self):
+        self.start = self.fire = None
+    def hear(self):
+        self.heard += 1
+    # Whether to send at the given time, moving on to the next interval if the current one is over.
+    def due(self, timestamp):
+        if self.start is None: return False
+        if timestamp >= self.start + self.interval:
+            self.begin(self.start + self.interval, min(2 * self.interval, self.imax))
+        if self.fire is not None and timestamp >= self.fire:
+            self.fire = None
+            return self.heard < self.redundancy
+        return False
+    def next_time(self):
+        if self.start is None: return None
+        return self.fire if self.fire is not None else self.start + self.interval
+
+class Router(BasicRouter):
     def __init__(self, *args):
         super(Router, self).__init__(*args)
-        self.send_buffer = [] # TODO: all lists of packet refs anywhere should count towards a metric for their lengths, memory usage should be at least a little penalized
-        self.seen = []
-        self.logic = True
-    def receive(self, packet, one_hop_sender):
-        if packet in self.seen: return
-        self.seen.append(packet)
-        super(Router, self).receive(packet, one_hop_sender)
-    def receive_full(self, packet, _):
-        self.buffer.append(packet)
-    # Packets can still get lost if they are randomly dropped by a poor medium, but they keep enough of a queue that they never get dropped just from a particular medium being congested.
+        self.root = None            # whether this router is the root of the DODAG, worked out on the first tick
+        self.rank = INFINITE_RANK
+        self.parent = None          # id of the preferred parent
+        self.candidates = {}        # neighbor id : rank it last advertised
+        self.heard = Timers()       # neighbor id : when it is considered gone, unless heard from before then
+        self.downward = {}          # destination id : id of the child it is reachable through
+        self.lifetimes = Timers()   # destination id : when its downward route is withdrawn, unless refreshed before then
+        self.withdrawn = set()      # destinations to tell the parent we no longer have routes to, with the next DAO
+        self.dao_sequence = 0       # number of the last DAO we sent
+        self.sequences = {}         # child id : number of the last DAO taken from it
+        self.trickle = Trickle(TRICKLE_IMIN, TRICKLE_DOUBLINGS, TRICKLE_REDUNDANCY, self.rng)
+        self.dao_interval = DAO_INTERVAL + self.rng.randint(-DAO_INTERVAL // 10, DAO_INTERVAL // 10)
+        self.next_dao = None
+        self.solicit_interval = DIS_INTERVAL
+        self.next_solicit = self.rng.randint(DIS_INTERVAL // 2, DIS_INTERVAL)
+    # Broadcast a control message to every neighbor.
+    def broadcast(self, message):
+        packet = Packet(self.id, -1, content=message)
+        for connection in self.connections: self.send(packet, connection)
+    # Send a control message to a neighbor, returning False if it isn't one any more.
+    def unicast(self, neighbor, message):
+        link = self.network.link(self, neighbor)
+        if link is None: return False
+        self.send(Packet(self.id, neighbor, content=message), link)
+        return True
+    def set_rank(self, rank):
+        if rank == self.rank: return
+        self.rank = rank
+        self.trickle.reset(self.timestamp)
+    def set_parent(self, parent):
+        old = self.parent
+        self.parent = parent
+        self.heard.set(parent, self.timestamp + PARENT_TIMEOUT)
+        self.set_rank(self.candidates[parent] + MIN_HOP_RANK_INCREASE)
+        self.solicit_interval = DIS_INTERVAL
+        for target, child in list(self.downward.items()):
+            if child == parent: self.remove_target(target) # Our parent can't also be in our sub-DODAG, so those routes are stale
+        if old is not None and old != parent: self.unicast(old, self.dao([], [self.id] + list(self.downward)))
+        self.trigger_dao()
+    # The neighbor with the lowest rank below the given one that we are still wired to, or None if there is none.
+    def best_candidate(self, below):
+        best = None
+        for neighbor, rank in self.candidates.items():
+            if rank < below and (best is None or rank < self.candidates[best]) and self.network.link(self, neighbor):
+                best = neighbor
+        return best
+    # Local repair: move over to the best other neighbor that is still closer to the root than we were, or leave the DODAG if there is none.
+    def lose_parent(self):
+        self.candidates.pop(self.parent, None)
+        self.parent = None
+        parent = self.best_candidate(self.rank)
+        if parent is not None: self.set_parent(parent)
+        else: self.detach()
+    # Leave the DODAG, poisoning our routes so that our sub-DODAG looks elsewhere too, and forget the neighbors that might be in it.
+    def detach(self):
+        for neighbor, rank in list(self.candidates.items()):
+            if rank >= self.rank: del self.candidates[neighbor]
+        self.rank = INFINITE_RANK
+        self.next_dao = None
+        self.broadcast(DIO(INFINITE_RANK))
+        self.trickle.stop()
+        self.next_solicit = self.timestamp
+    # Send a DAO soon, with whatever else changes in the meantime.
+    def trigger_dao(self):
+        if self.parent is None: return
+        self.next_dao = earliest(self.next_dao, self.timestamp + DAO_DELAY)
+    def dao(self, targets, withdrawn):
+        self.dao_sequence += 1
+        return DAO(self.dao_sequence, targets, withdrawn)
+    def send_dao(self):
+        self.next_dao = self.timestamp + self.dao_interval
+        if not self.unicast(self.parent, self.dao([self.id] + list(self.downward), sorted(self.withdrawn))):
+            self.lose_parent()
+            return
+        self.withdrawn = set()
+    def remove_target(self, target):
+        del self.downward[target]
+        self.lifetimes.cancel(target)
+        self.withdrawn.add(target)
+        self.trigger_dao()
+    # DODAG maintenance.
     def tick(self, timestamp):
         super(Router, self).tick(timestamp)
-        if len(self.buffer) and len(self.in_transit) < self.pathways:
-            self.receive(self.buffer[0], self)
-            self.buffer = self.buffer[1:]
-        if len(self.send_buffer):
-            for target, packet in self.send_buffer:
-                if len(target.in_transit) < target.pathways or isinstance(target, Router):
-                    target.receive(packet, self)
-                    self.send_buffer.remove((target, packet))
+        if not self.operational: return
+        if self.root is None:
+            self.root = self.id == (ROOT if ROOT is not None else min(self.network.neighbors))
+            if self.root: self.set_rank(MIN_HOP_RANK_INCREASE)
+        for neighbor in self.heard.expire(timestamp):
+            if neighbor == self.parent: self.lose_parent()
+            else: self.candidates.pop(neighbor, None)
+        for target in self.lifetimes.expire(timestamp):
+            self.remove_target(target)
+        if not self.root and self.parent is None and timestamp >= self.next_solicit:
+            self.broadcast(DIS())
+            self.next_solicit = timestamp + self.solicit_interval
+            self.solicit_interval = min(2 * self.solicit_interval, self.trickle.imax)
+        if self.trickle.due(timestamp):
+            self.broadcast(DIO(self.rank))
+        if self.next_dao is not None and timestamp >= self.next_dao:
+            self.send_dao()
+    # Wake up for the next DIO, DIS, DAO, or neighbor or route timeout, whichever comes first.
+    def next_event(self, timestamp):
+        if self.root is None: return timestamp
+        if not self.operational: return super(Router, self).next_event(timestamp)
+        solicit = self.next_solicit if not self.root and self.parent is None else None
+        return earliest(super(Router, self).next_event(timestamp), self.trickle.next_time(), self.heard.next_deadline(), self.lifetimes.next_deadline(), self.next_dao, solicit)
     def process(self, packet, one_hop_sender):
-        if packet.dest == self.id: return
-        for connection in self.connections:
-            if connection != one_hop_sender:
-                if len(connection.in_transit) < connection.pathways or isinstance(connection, Router):
-                    connection.receive(packet, self)
-                else:
-                    self.send_buffer.append((connection, packet))
\ No newline at end of file
+        message = packet.content
+        if isinstance(message, DIO):
+            self.receive_dio(packet.source, message.rank)
+        elif isinstance(message, DIS):
+            if self.rank < INFINITE_RANK: self.trickle.reset(self.timestamp)
+        elif isinstance(message, DAO):
+            if packet.dest == self.id: self.receive_dao(packet.source, message)
+        elif isinstance(message, DAOAck):
+            if packet.dest == self.id and packet.source == self.parent: self.heard.set(self.parent, self.timestamp + PARENT_TIMEOUT)
+        elif packet.dest != self.id:
+            if not self.validate(packet): return
+            if not self.forward(packet): self.enqueue(self.buffer['routing'], packet, 'routing queue full')
+    def receive_dio(self, neighbor, rank):
+        if rank >= INFINITE_RANK:
+            self.candidates.pop(neighbor, None)
+            self.heard.cancel(neighbor)
+            if neighbor == self.parent: self.lose_parent()
+            return
+        self.candidates[neighbor] = rank
+        self.heard.set(neighbor, self.timestamp + (PARENT_TIMEOUT if neighbor == self.parent else CANDIDATE_TIMEOUT))
+        if rank == self.rank: self.trickle.hear() # Our neighbors have heard the same rank as ours from a sibling already
+        if self.root or self.network.link(self, neighbor) is None: return
+        if neighbor == self.parent:
+            if rank + MIN_HOP_RANK_INCREASE == self.rank: return
+            parent = self.best_candidate(self.rank) # The parent's rank changed, which might make another neighbor the better choice
+            if parent is not None and self.candidates[parent] < rank: self.set_parent(parent)
+            else: self.set_rank(rank + MIN_HOP_RANK_INCREASE)
+        elif rank + MIN_HOP_RANK_INCREASE < self.rank:
+            self.set_parent(neighbor)
+    # Store downward routes to the destinations a child lists, drop the ones it withdraws, and acknowledge.
+    def receive_dao(self, child, message):
+        if child == self.parent or message.sequence <= self.sequences.get(child, 0): return
+        self.sequences[child] = message.sequence
+        for target in message.targets:
+            if target == self.id: continue
+            if self.downward.get(target) != child:
+                self.downward[target] = child
+                self.withdrawn.discard(target)
+                self.trigger_dao()
+            self.lifetimes.set(target, self.timestamp + DAO_LIFETIME)
+        for target in message.withdrawn:
+            if self.downward.get(target) == child: self.remove_target(target)
+        self.unicast(child, DAOAck())
+    # Check the RPL option of a packet against our rank: a packet going up has to come from a higher rank, and one going down from a lower one.
+    # The first time that fails the packet is marked and carries on (ranks may just not have caught up yet), the second time it is dropped, and either way our DIOs go out again soon.
+    # Routers that have left the DODAG have no rank to compare, so there is nothing to check.
+    def validate(self, packet):
+        option = packet.option
+        if option is None: return True
+        if (option.rank < self.rank) == option.down or INFINITE_RANK in (option.rank, self.rank): return True
+        self.trickle.reset(self.timestamp)
+        if option.error:
+            self.drop_packet(packet, 'rank error')
+            return False
+        packet.option = RankOption(option.rank, option.down, True)
+        return True
+    # Send a packet down towards its destination if we have a route to it, or else up to our parent, returning False if neither is possible yet.
+    # A packet that already went down never goes back up, which could only be into a loop, so it waits for a downward route instead.
+    def forward(self, packet):
+        down, error = (packet.option.down, packet.option.error) if packet.option is not None else (None, False)
+        child = self.downward.get(packet.dest)
+        if child is not None:
+            link = self.network.link(self, child)
+            if link is not None:
+                packet.option = RankOption(self.rank, True, error)
+                self.send(packet, link)
+                return True
+            self.remove_target(packet.dest)
+        if down: return False
+        if self.parent is not None and self.network.link(self, self.parent) is None: self.lose_parent()
+        if self.parent is None: return False
+        packet.option = RankOption(self.rank, False, error)
+        self.send(packet, self.network.link(self, self.parent))
+        return True
+    # Forward a packet that was waiting for us to join the DODAG (or, at the root, for a DAO with its destination).
+    def route_pending(self, packet):
+        return self.forward(packet)
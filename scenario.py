@@ -1,5 +1,8 @@
 class Scenario:
     def __init__(self):
         return
+    # Timestamp of the next time tick() will change anything, or None if it never will
+    def next_event(self, timestamp):
+        return None
     def tick(self, all_media):
         return
\ No newline at end of file
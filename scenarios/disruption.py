@@ -1,17 +1,20 @@
 # Scenario where hosts and links are gradually disrupted over the course of the simulation. Up to a maximum ratio of N media are disrupted.
 
-import random
+from simulation import rng_stream
 
 N = 0.2
 
 class Scenario:
     def __init__(self, media):
         self.interval = round(1000/round(len(media) * N))
-        self.counter = self.interval
+        self.next_change = self.interval - 1
+        self.rng = rng_stream('scenario')
+    # Timestamp of the next disruption
+    def next_event(self, timestamp):
+        return self.next_change
     def tick(self, timestamp, media):
-        self.counter -= 1
-        if self.counter == 0:
-            medium = random.choice(media)
+        if timestamp == self.next_change:
+            medium = self.rng.choice(media)
             print(f'disabling {medium.id}')
-            medium.operational = False
-            self.counter = self.interval
\ No newline at end of file
+            medium.set_operational(False)
+            self.next_change += self.interval
\ No newline at end of file
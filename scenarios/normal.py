@@ -4,5 +4,7 @@
 class Scenario:
     def __init__(self, media):
         return
+    def next_event(self, timestamp):
+        return None
     def tick(self, timestamp, media):
         return
\ No newline at end of file
@@ -1,6 +1,6 @@
 # Scenario where links are gradually changed over the course of the simulation, so that they now connect different different hosts and/or have very different delays than they used to have. Up to a maximum ratio of N links are shifted.
 
-import random
+from simulation import Medium, rng_stream
 
 N = 0.2
 
@@ -9,19 +9,16 @@ class Scenario:
         self.links = [medium for medium in media.values() if medium.logic == False]
         self.routers = [medium for medium in media.values() if medium.logic == True]
         self.interval = round(1000/round(len(self.links) * N))
-        self.counter = self.interval
+        self.next_change = self.interval - 1
+        self.rng = rng_stream('scenario')
+    # Timestamp of the next link shift
+    def next_event(self, timestamp):
+        return self.next_change
     def tick(self, timestamp, media):
-        self.counter -= 1
-        if self.counter == 0:
-            link = random.choice(self.links)
+        if timestamp == self.next_change:
+            link = self.rng.choice(self.links)
             print(f'altering {link.id}')
-            source = random.choice(self.routers)
-            target = random.choice(self.routers)
-            link.connections[0].connections.remove(link)
-            link.connections[1].connections.remove(link)
-            link.connections = []
-            link.connections.append(source)
-            link.connections.append(target)
-            source.connections.append(link)
-            target.connections.append(link)
-            self.counter = self.interval
\ No newline at end of file
+            source = self.rng.choice(self.routers)
+            target = self.rng.choice(self.routers)
+            Medium.network.rewire(link, [source, target])
+            self.next_change += self.interval
\ No newline at end of file
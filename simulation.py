@@ -1,76 +1,616 @@
+import hashlib
+import heapq
+import math
+import os
 import random
+from collections import deque, OrderedDict
+import numpy as np
+import metrics
+import tracing
 from stochastic.processes.noise import FractionalGaussianNoise
 
 noise = None
+noise_cache = None
+tally = None
+seeds = np.random.SeedSequence() # root of all the random streams of a run, see rng_init()
+
+NOISE_BLOCK = 1024      # number of time steps of stochastic noise generated at a time
+NOISE_CACHE_BATCH = 64  # number of noise series generated at once when filling the on-disk noise cache
+RNG_STREAMS = ('noise', 'loss', 'protocol', 'scenario', 'workload', 'topology', 'queue') # the kinds of independent random streams there are
 
 def stochastic_init(hurst):
     global noise
     noise = FractionalGaussianNoise(hurst=hurst)
 
+# Derive all the randomness of a run from a single seed (None for a fresh one every run).
+# Every stream is keyed by what it is for and who it belongs to (a medium id, for instance), never by the order it happens to be asked for in, so that runs sharing a seed also share random draws wherever they can.
+# For example every medium sees the same noise and the same sequence of loss draws, and a scenario makes the same disruptions, whichever routing algorithm is being run (common random numbers), which makes comparisons between algorithms much less noisy.
+def rng_init(seed=None):
+    global seeds
+    seeds = np.random.SeedSequence(seed)
+    return seeds
+
+# Seed of the random stream of the given kind and index.
+def rng_seed(stream, index=0):
+    return int(np.random.SeedSequence(seeds.entropy, spawn_key=(RNG_STREAMS.index(stream), index)).generate_state(1, np.uint64)[0])
+
+# An independent random.Random for the given kind of stream and index.
+def rng_stream(stream, index=0):
+    return random.Random(rng_seed(stream, index))
+
+# Sample a matrix of fractional gaussian noise over [0, 1] of the given length, one row drawn from each of the given numpy generators, with the Davies-Harte method vectorized across rows.
+# Unless hurst is 0.5, a row comes out the same as FractionalGaussianNoise(hurst, rng=rng).sample(length) would give it.
+def sample_noise_matrix(hurst, length, rngs):
+    m = 2 ** (length - 2).bit_length() + 1
+    ns_2h = np.arange(m + 1) ** (2 * hurst)
+    autocovariance = np.insert((ns_2h[:-2] - 2 * ns_2h[1:-1] + ns_2h[2:]) / 2, 0, 1)
+    sqrt_eigenvals = np.fft.irfft(autocovariance)[:m] ** (1 / 2)
+    scale = (1 / length) ** hurst * 2 ** (1 / 2) * (m - 1)
+    w = np.stack([rng.normal(scale=scale, size=2 * m) for rng in rngs]).view(complex)
+    w[:, 0] = w[:, 0].real * 2 ** (1 / 2)
+    w[:, -1] = w[:, -1].real * 2 ** (1 / 2)
+    return np.fft.irfft(sqrt_eigenvals * w, axis=1)[:, :length]
+
+# Relative fluctuations (in single precision) making up the given block of each of the noise series with the given seeds, for series of the given length.
+# Each block is scaled as if it were a slice of a single sample spanning the whole length, so the size of the fluctuations is the same as sampling it all at once (correlations between neighboring blocks are not kept, but within each block they are).
+# Blocks are seeded by their position in the series, so the values do not depend on the order in which the simulation happens to ask for them.
+# This is the only noise model, both NoiseSeries and the noise cache get their blocks from here, so runs come out the same with the cache on or off.
+def noise_blocks(hurst, deviation, length, seeds, index):
+    size = min(NOISE_BLOCK, length - index * NOISE_BLOCK)
+    sample = sample_noise_matrix(hurst, NOISE_BLOCK, [np.random.default_rng([seed, index]) for seed in seeds])[:, :size]
+    return (sample * (NOISE_BLOCK / length) ** hurst * deviation).astype(np.float32)
+
+# Use an on-disk cache of noise for the media of a network, so that runs sharing the same parameters (for example the same topology under different routing algorithms) pay for generating it once.
+# The cache is a (media x 2 x length) float32 matrix of relative fluctuations (throughput and drop rate for each medium id), named by a hash of everything that goes into generating it, and is memory mapped so parallel runs share the same pages.
+# It holds exactly the blocks each medium would otherwise generate lazily from its own noise seed (see noise_blocks()), so must be set up after rng_init().
+# The directory is kept to at most size bytes by deleting the least recently used caches, and a cache that would not fit on its own is not kept at all.
+# Passing directory=None (the default) turns the cache off, so every medium generates its own noise, as does a run without a fixed seed, whose noise is never seen again.
+def noise_cache_init(hurst, rate_deviation, length, media_count, seed, directory=None, size=2**30):
+    global noise_cache
+    noise_cache = None
+    if directory is None or seed is None or media_count * 2 * length * 4 > size:
+        return None
+    key = hashlib.sha256(f'fgn-v2:{hurst}:{rate_deviation}:{length}:{media_count}:{seed}:{NOISE_BLOCK}'.encode()).hexdigest()[:24]
+    path = os.path.join(directory, f'{key}.npy')
+    if os.path.exists(path):
+        os.utime(path) # Most recently used now
+    else:
+        os.makedirs(directory, exist_ok=True)
+        partial = f'{path}.{os.getpid()}.partial'
+        matrix = np.lib.format.open_memmap(partial, mode='w+', dtype=np.float32, shape=(media_count, 2, length))
+        for start in range(0, media_count, NOISE_CACHE_BATCH):
+            stop = min(start + NOISE_CACHE_BATCH, media_count)
+            media_seeds = [rng_seed('noise', i) for i in range(2 * start, 2 * stop)] # throughput and drop rate of each medium, as in Medium.__init__()
+            for index in range(-(-length // NOISE_BLOCK)):
+                block = noise_blocks(hurst, rate_deviation, length, media_seeds, index)
+                matrix[start:stop, :, index * NOISE_BLOCK:index * NOISE_BLOCK + block.shape[1]] = block.reshape(stop - start, 2, -1)
+        matrix.flush()
+        del matrix
+        os.replace(partial, path) # Atomic, so that parallel runs racing to fill the same cache never see half of one
+        noise_cache_evict(directory, size, path)
+    noise_cache = np.load(path, mmap_mode='r')
+    return noise_cache
+
+# Delete the least recently used noise caches in the directory until what is left fits in size bytes, never deleting the one at keep.
+def noise_cache_evict(directory, size, keep):
+    caches = []
+    for name in os.listdir(directory):
+        if not name.endswith('.npy'): continue
+        try: stat = os.stat(os.path.join(directory, name))
+        except FileNotFoundError: continue # Evicted by a parallel run
+        caches.append((stat.st_mtime, stat.st_size, os.path.join(directory, name)))
+    total = sum(cache[1] for cache in caches)
+    for mtime, used, path in sorted(caches):
+        if total <= size: break
+        if path == keep: continue
+        try: os.remove(path) # Runs that have it mapped keep their pages until they are done
+        except FileNotFoundError: pass
+        total -= used
+
+# A stochastic model of some rate over time, fluctuating around its mean with fractional gaussian noise.
+# Generating the whole series up front for every medium is slow and mostly wasted, since most runs end long before the time limit, so it is generated one block at a time as the simulation gets to it (see noise_blocks()), and stored in single precision.
+# If a row of relative fluctuations from the noise cache is given, blocks are read from that instead of being generated, which gives the same values.
+class NoiseSeries:
+    def __init__(self, mean, deviation, length, cached=None, seed=None):
+        self.mean = mean
+        self.deviation = deviation
+        self.length = length
+        self.cached = cached
+        if cached is None:
+            self.seed = seed if seed is not None else int(noise.rng.integers(2**63))
+        elif len(cached) < length:
+            raise RuntimeError(f'NoiseSeries: cached noise has {len(cached)} time steps, {length} are needed')
+        self.blocks = [None] * -(-length // NOISE_BLOCK)
+        self.totals = [None] * len(self.blocks)
+        self.rising = [None] * len(self.blocks) # block index : whether its running totals never go down (no value rounds to below 0), so they can be binary searched
+    def __len__(self):
+        return self.length
+    def __getitem__(self, timestamp):
+        if not 0 <= timestamp < self.length: raise IndexError(f'NoiseSeries: timestamp {timestamp} out of range')
+        block = self.blocks[timestamp // NOISE_BLOCK]
+        if block is None: block = self.generate(timestamp // NOISE_BLOCK)
+        return block[timestamp % NOISE_BLOCK]
+    def generate(self, index):
+        block = self.compute(index)
+        self.blocks[index] = block
+        return block
+    def compute(self, index):
+        if self.cached is not None:
+            start = index * NOISE_BLOCK
+            relative = self.cached[start:start+NOISE_BLOCK]
+        else:
+            relative = noise_blocks(noise.hurst, self.deviation, self.length, [self.seed], index)[0]
+        return relative * self.mean + self.mean # Single precision throughout, as LinkLayer.throughput() computes it too
+    # Largest value the series takes, rounded to a whole number the same as round() gives it.
+    # Blocks that haven't been generated yet are computed to find it but not kept, so this doesn't hold on to the whole series.
+    def peak(self):
+        peak = 0
+        for index, block in enumerate(self.blocks):
+            if block is None: block = self.compute(index)
+            peak = max(peak, float(np.rint(block[:self.length - index * NOISE_BLOCK]).max()))
+        return peak
+    # Running totals of the values in the given block rounded to whole numbers, the same as round() gives them.
+    # They are kept in double precision, which holds whole numbers exactly up to 2**53, so totals over any stretch of time come out exact.
+    def cumulative(self, index):
+        totals = self.totals[index]
+        if totals is None:
+            block = self.blocks[index]
+            if block is None: block = self.generate(index)
+            rounded = np.rint(block)
+            totals = np.cumsum(rounded, dtype=np.float64)
+            self.totals[index] = totals
+            self.rising[index] = bool((rounded >= 0).all())
+        return totals
+    # First timestamp from start on by which the rounded values from start add up to at least amount (a whole number), or None if they never do.
+    def reach(self, start, amount):
+        for index in range(start // NOISE_BLOCK, len(self.blocks)):
+            offset = index * NOISE_BLOCK
+            first = max(start - offset, 0)
+            totals = self.cumulative(index)
+            before = totals[first - 1] if first else 0
+            if self.rising[index]:
+                target = before + amount
+                guess = min(max(first + math.ceil(amount / self.mean) - 1, first), len(totals) - 1) if self.mean > 0 else first # Where it would be at the mean, which the noise is rarely far from
+                if totals[guess] >= target and (guess == first or totals[guess - 1] < target): return offset + guess
+                found = max(int(np.searchsorted(totals, target)), first)
+                if found < len(totals): return offset + found
+            else:
+                found = np.flatnonzero(totals[first:] - before >= amount)
+                if len(found): return offset + first + int(found[0])
+            amount -= int(totals[-1] - before)
+        return None
+    # Total of the rounded values over timestamps start to stop-1.
+    def total(self, start, stop):
+        total = 0
+        while start < stop:
+            index = start // NOISE_BLOCK
+            offset = index * NOISE_BLOCK
+            end = min(stop, offset + NOISE_BLOCK)
+            totals = self.cumulative(index)
+            total += int(totals[end - offset - 1] - (totals[start - offset - 1] if start > offset else 0))
+            start = end
+        return total
+
+# Start a fresh set of running totals for a new simulation run.
+def tally_init():
+    global tally
+    tally = Tally()
+    return tally
+
+# Running totals kept up to date as packets move around, so the simulation can tell when it is finished without scanning every packet and medium on every tick.
+class Tally:
+    def __init__(self):
+        self.in_transit = 0 # workload packets currently in transit through any medium (routing traffic alone doesn't keep the simulation going, some protocols never stop sending it)
+        self.buffering = 0  # media that have workload packets waiting in a queue
+    # Nothing is moving and nothing is waiting to move.
+    def idle(self):
+        return self.in_transit == 0 and self.buffering == 0
+
+# Earliest of several optional event times, where None means "no event".
+def earliest(*times):
+    times = [time for time in times if time is not None]
+    return min(times) if times else None
+
+# Size in bytes of a value in the control message wire format: integers take 4 bytes, booleans 1 byte, and sequences take 2 bytes for their length followed by their items.
+def wire_size(value):
+    if isinstance(value, bool): return 1
+    if isinstance(value, int): return 4
+    if isinstance(value, (list, tuple)): return 2 + sum(wire_size(item) for item in value)
+    raise TypeError(f'Control message: {type(value).__name__} values have no wire format')
+
+# A control message used by a routing protocol, carried as the content of a Packet.
+# Each protocol subclasses this with its message types, naming their fields in __slots__, and on the wire a message is a 1 byte type followed by its fields in order.
+class Message:
+    __slots__ = ()
+    def __init__(self, *values):
+        if len(values) != len(self.__slots__):
+            raise TypeError(f'{type(self).__name__}: expected fields {self.__slots__}, got {len(values)} values')
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+    def byte_size(self):
+        return 1 + sum(wire_size(getattr(self, name)) for name in self.__slots__)
+    def __repr__(self):
+        return f'{type(self).__name__}({", ".join(repr(getattr(self, name)) for name in self.__slots__)})'
+
 # A chunk of data to be delivered, either for the purposes of sustaining the routing protocol or to accomodate the ongoing traffic workload.
 class Packet:
+    __slots__ = ('source', 'dest', 'time_sent', 'time_arrived', 'delivered', 'content', 'byte_size', 'option')
     def __init__(self, source, dest, content="", size=0, lifespan = 25):
         self.source = source # What is allowed to be a "source" or "dest" will depend on the protocol.
         self.dest = dest     # Some protocols may allow a destination to be something other than an integer host id, for example broadcasts can use -1 as the dest.
         self.time_sent = -1
         self.time_arrived = -1
-        if content: # Specify content if this packet communication is being used by the router to facilitate routing.
+        self.delivered = False # Whether the packet (or any copy of it) has reached its destination yet
+        self.option = None     # Header option (a Message) a routing protocol carries along with the packet from hop to hop, if it uses one
+        if content: # Specify content (a Message) if this packet communication is being used by the router to facilitate routing.
             self.content = content
-            self.byte_size = len(content.encode('utf-8'))
+            self.byte_size = content.byte_size()
         elif size: # Specify size if this packet is part of the simulated traffic workload, and the particular contents do not matter, only how big it is.
             self.content = ''
             self.byte_size = size
         else:
             raise RuntimeError('Simulated Packet: Either content or size must be specified.')
 
+# Drop policies for a Queue, deciding what (if anything) gets dropped when an item arrives.
+# A policy returns the item to drop, which is either the arriving item (it never gets queued), or one already queued (removed by the policy to make room), or None if nothing needs dropping.
+# Policies hold no state of their own, so a single one can be shared by any number of queues.
+
+# Drop whatever arrives once the queue is full.
+class TailDrop:
+    def admit(self, queue, item):
+        return item if len(queue) >= queue.capacity else None
+
+# Make room by dropping the oldest item in the queue, so that what does get through is as fresh as possible.
+class DropHead:
+    def admit(self, queue, item):
+        return queue.popleft() if len(queue) >= queue.capacity else None
+
+# Random Early Detection: track a moving average of the queue length, and start dropping arrivals with a probability rising from 0 to max_probability as the average goes between the min and max thresholds (given as fractions of capacity).
+# Above the max threshold (or when the queue is actually full) every arrival is dropped.
+class RandomEarlyDetection:
+    def __init__(self, min_threshold=0.25, max_threshold=0.75, max_probability=0.1, weight=0.002):
+        self.min_threshold = min_threshold
+        self.max_threshold = max_threshold
+        self.max_probability = max_probability
+        self.weight = weight
+    def admit(self, queue, item):
+        queue.average += self.weight * (len(queue) - queue.average)
+        if len(queue) >= queue.capacity: return item
+        low = self.min_threshold * queue.capacity
+        high = self.max_threshold * queue.capacity
+        if queue.average < low: return None
+        if queue.average >= high: return item
+        return item if queue.rng.random() < self.max_probability * (queue.average - low) / (high - low) else None
+
+# Drop policies by the names they can be picked by (see QUEUE_POLICY in main.py).
+QUEUE_POLICIES = {'tail_drop': TailDrop, 'drop_head': DropHead, 'red': RandomEarlyDetection}
+
+# A bounded FIFO queue of packets (or of tuples holding packets, in which case field says which item of the tuple is the packet) for routers to buffer traffic in.
+# It keeps count of how many of the queued packets are part of the workload, so finding out whether a medium is holding on to any is O(1).
+# Out queues hold tuples that are only waiting for room in the (full) medium they are to be sent to, target says which item of the tuple that medium is.
+# Once a drain of one sends none of them, draining again gets nowhere until one of those media finishes a transfer, so the queue is stalled on them until then (see EventEngine.freed()).
+# In queues (inbound) hold packets waiting for room in the medium the queue belongs to, and are attended to whenever it has some.
+class Queue:
+    def __init__(self, capacity, policy=None, field=None, rng=random, target=None, inbound=False):
+        self.items = deque()
+        self.capacity = capacity
+        self.policy = policy or TailDrop()
+        self.field = field
+        self.workload = 0   # number of queued packets that are part of the workload
+        self.average = 0    # moving average of the length, for policies that need one
+        self.rng = rng      # for policies that drop at random
+        self.target = target
+        self.inbound = inbound
+        self.stalled = set() # media the items are waiting for room in, if the last drain sent nothing and nothing has been queued since
+    def __len__(self):
+        return len(self.items)
+    def __iter__(self):
+        return iter(self.items)
+    def __getitem__(self, index):
+        return self.items[index]
+    def packet(self, item):
+        return item if self.field is None else item[self.field]
+    # Queue an item, returning whatever the drop policy dropped to make room (possibly the item itself), or None.
+    def append(self, item):
+        dropped = self.policy.admit(self, item)
+        if dropped is item: return item
+        if self.stalled: self.stalled = set()
+        self.items.append(item)
+        if self.packet(item).content == '': self.workload += 1
+        return dropped
+    def popleft(self):
+        item = self.items.popleft()
+        if self.packet(item).content == '': self.workload -= 1
+        return item
+    # Give every queued item, oldest first, to send(), keeping the ones it returns False for (in the same order).
+    def drain(self, send):
+        sent = False
+        for _ in range(len(self.items)):
+            item = self.items.popleft()
+            if not send(item):
+                self.items.append(item)
+                continue
+            sent = True
+            if self.packet(item).content == '': self.workload -= 1
+        if self.target is not None:
+            self.stalled = set() if sent else {item[self.target] for item in self.items}
+
+# Remembers recently seen keys (packets, or broadcast identifiers) so flooding protocols can discard duplicates in O(1).
+# Memory is bounded by forgetting the oldest keys once there are more than capacity of them, and (if max_age is given) ones first seen more than max_age units of time ago.
+class DedupCache:
+    def __init__(self, capacity, max_age=None):
+        self.entries = OrderedDict() # key : timestamp first seen, oldest first
+        self.capacity = capacity
+        self.max_age = max_age
+        self.hits = 0       # keys that had been seen already
+        self.misses = 0     # keys that were new
+        self.evictions = 0  # keys forgotten to stay within capacity or max_age
+    def __len__(self):
+        return len(self.entries)
+    def __contains__(self, key):
+        return key in self.entries
+    # Record a key as seen at the given time, returning True if it is new, and False if it was seen already (so whatever it identifies should be discarded).
+    def add(self, key, timestamp=0):
+        if self.max_age is not None: self.expire(timestamp)
+        if key in self.entries:
+            self.hits += 1
+            return False
+        self.misses += 1
+        self.entries[key] = timestamp
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        return True
+    # Forget the keys that are too old to be kept at the given time.
+    def expire(self, timestamp):
+        while self.entries:
+            key, seen = next(iter(self.entries.items()))
+            if timestamp - seen <= self.max_age: return
+            del self.entries[key]
+            self.evictions += 1
+
+# Protocol timers (neighbor hold times, route lifetimes, ...) kept in a heap by deadline, so that each tick only looks at the timers that are due rather than scanning whole tables.
+# Every timer has a key, and setting a key that already has a timer moves its deadline; the old heap entry is left behind and skipped when it comes up, so refreshing a timer on every message costs O(log n).
+class Timers:
+    def __init__(self):
+        self.heap = []      # (deadline, order, key), including entries that have since been moved or cancelled
+        self.timers = {}    # key : (deadline, order) of the live timer
+        self.count = 0      # timers set so far, orders timers with the same deadline by when they were first set
+    def __len__(self):
+        return len(self.timers)
+    def __contains__(self, key):
+        return key in self.timers
+    def get(self, key):
+        timer = self.timers.get(key)
+        return timer[0] if timer else None
+    def set(self, key, deadline):
+        timer = self.timers.get(key)
+        if timer and timer[0] == deadline: return
+        order = timer[1] if timer else self.count
+        self.count += 1
+        self.timers[key] = (deadline, order)
+        heapq.heappush(self.heap, (deadline, order, key))
+        if len(self.heap) > 2 * len(self.timers) + 64: self.compact()
+    def cancel(self, key):
+        self.timers.pop(key, None)
+    # Drop the heap entries of moved and cancelled timers.
+    def compact(self):
+        self.heap = [(deadline, order, key) for key, (deadline, order) in self.timers.items()]
+        heapq.heapify(self.heap)
+    # Earliest deadline of any timer, or None if there are none.
+    def next_deadline(self):
+        while self.heap:
+            deadline, order, key = self.heap[0]
+            if self.timers.get(key) == (deadline, order): return deadline
+            heapq.heappop(self.heap)
+        return None
+    # Remove the timers with deadlines at or before the given one, returning their keys in deadline order.
+    def expire(self, deadline):
+        expired = []
+        while self.heap and self.heap[0][0] <= deadline:
+            due, order, key = heapq.heappop(self.heap)
+            if self.timers.get(key) != (due, order): continue
+            del self.timers[key]
+            expired.append(key)
+        return expired
+
+# Authoritative index of how media are wired together, kept up to date incrementally as the wiring changes.
+# Every medium's connections list stays as it was (its order is the order packets get passed on in), and alongside it the index answers in O(1) which connected medium has a given id, and through which link a router can reach a neighboring router in one hop.
+# All changes to the wiring go through connect(), disconnect() and rewire(), which tell the subscribed listeners about each connection made or broken, so that routing caches can update or throw themselves out.
+class Network:
+    def __init__(self, media):
+        self.media = media
+        self.connected = {}     # medium id : {connected medium id : medium}
+        self.neighbors = {}     # router id : {neighboring router id : link between them (or the router itself, if they are wired straight together)}
+        self.listeners = []     # called as listener(event, a, b) after every change, where event is 'connect' or 'disconnect'
+        self.version = 0        # bumped on every change
+        for medium in media.values():
+            self.update(medium)
+    # Rebuild the index entries of a medium from its connections.
+    def update(self, medium):
+        self.connected[medium.id] = {connection.id: connection for connection in medium.connections}
+        if not medium.logic: return
+        neighbors = {}
+        for connection in medium.connections:
+            if connection.logic:
+                neighbors.setdefault(connection.id, connection)
+                continue
+            for end in connection.connections:
+                if end is not medium and end.logic: neighbors.setdefault(end.id, connection) # The first link in connection order wins, if there are several
+        self.neighbors[medium.id] = neighbors
+    # The medium with the given id that a medium is connected to, or None if there is none.
+    def connection(self, medium, id):
+        return self.connected[medium.id].get(id)
+    # The link a router would send through to reach the given neighboring router in one hop, or None if they aren't neighbors.
+    def link(self, router, id):
+        return self.neighbors[router.id].get(id)
+    # The media a link connects.
+    def endpoints(self, link):
+        return link.connections
+    def subscribe(self, listener):
+        if listener not in self.listeners: self.listeners.append(listener)
+    def unsubscribe(self, listener):
+        if listener in self.listeners: self.listeners.remove(listener)
+    # Bring the index up to date after connections of the given media changed, then tell the listeners what happened.
+    def changed(self, media, events):
+        affected = {}
+        for medium in media:
+            affected[medium.id] = medium
+            for connection in medium.connections:
+                affected[connection.id] = connection
+        for medium in affected.values():
+            self.update(medium)
+        self.version += 1
+        for event in events:
+            for listener in list(self.listeners): listener(*event)
+    def connect(self, a, b):
+        a.connections.append(b)
+        b.connections.append(a)
+        self.changed([a, b], [('connect', a, b)])
+    def disconnect(self, a, b):
+        a.connections.remove(b)
+        b.connections.remove(a)
+        self.changed([a, b], [('disconnect', a, b)])
+    # Move a link so that it connects the given media instead of the ones it does now.
+    def rewire(self, link, ends):
+        old = link.connections
+        for end in old:
+            end.connections.remove(link)
+        link.connections = list(ends)
+        for end in ends:
+            end.connections.append(link)
+        self.changed([link] + old + list(ends), [('disconnect', link, end) for end in old] + [('connect', link, end) for end in ends])
+
 # A generic building block of networks, a "thing that data can pass through"
 # This could be a particular host, a physical link, or even an entire network as seen from the outside
 # Media that have computers capable of running router code will have a subclass that may overwrite parts of this with logic for a specific routing protocol
 class Medium:
+    network = None       # The Network index of how the media being simulated are wired together, which every change to the wiring goes through
+    queue_policy = None  # Drop policy used by the queues of every router (None for tail drop)
     def __init__(self, id, pathways, overhead, byte_rate, drop_rate, rate_deviation, max_duration):
         self.id = id                # a unique id associated with this medium, basically a generic ip address
         self.pathways = pathways    # may range from 1 to "infinite" i.e. as many pathways as there are queued packets, models the extent of multiplexing or multithreading in a medium. If resources *can't* be focused on a single thread if the number of active pathways goes down, then it should be modelled using two parallel media instead of by using this variable.
         self.overhead = overhead    # overhead time amount for processing 1 packet, due to a fixed header size independent of packet contents size, + physical link propagation latency, + tiny amount of processor overhead for whatever calls are needed to start looking at a new packet, this amount does not change very much at all and is modeled as constant
         self.byte_rate = byte_rate  # average throughput capacity, this number is split across all active pathways, for routers this models processing throughput, for physical links this models transmission throughput
-        self.throughput = noise.sample(n=max_duration+1)*rate_deviation*self.byte_rate + self.byte_rate # Stochastic model of throughput
+        cached = noise_cache[id] if noise_cache is not None else (None, None) # Relative fluctuations for (throughput, drop), if there is a noise cache
+        self.throughput = NoiseSeries(self.byte_rate, rate_deviation, max_duration+1, cached[0], rng_seed('noise', 2*id) if cached[0] is None else None) # Stochastic model of throughput
         self.drop_rate = drop_rate  # average odds that a packet gets lost when moving through the medium (For the experiment, does not actually model the packet getting dropped and re-sent a fraction of the time, because different protocols do different things when a packet is dropped (some do nothing and just keep moving on, i.e. voice over IP). Just calculates the cumulative probability that a given packet was dropped in the course of all of the media it passed through, and then use that to calculate a final metric: % of bytes delivered. If you want to calculate what the average overhead implications are for a more specific application like TCP, you could do that with a bit of math)
-        self.drop = noise.sample(n=max_duration+1)*rate_deviation*self.drop_rate + self.drop_rate # Stochastic model of packet loss in transit
+        self.drop = NoiseSeries(self.drop_rate, rate_deviation, max_duration+1, cached[1], rng_seed('noise', 2*id+1) if cached[1] is None else None) # Stochastic model of packet loss in transit
+        self.loss_rng = rng_stream('loss', id) # Random draws for whether packets get lost in transit
+        self.rng = rng_stream('protocol', id)  # Random draws for routing logic to make its decisions with
+        self.queue_rng = rng_stream('queue', id) # Random draws for queue drop policies, apart from the routing logic's so that the policy in use doesn't change its decisions
         self.in_transit = []        # the list of packets that are *currently* in transit through the medium, if any, and the amount of time they have left before they can move along
         self.buffer = {}            # used by routing algorithms to create one or more queues of packets to process
         self.connections = []       # the other mediums this one is connected to
         self.logic = False          # Whether this medium contains a computer that can run code to implement a protocol (in other words, whether or not its a router)
         self.operational = True     # Allows nodes to be arbitrarily disrupteds
         self.buffering = False      # Indicates that there are packets queued *somewhere* and that the simulation shouldn't stop running yet, even if there are no packets in transit.
+        self.clock = -1             # The last timestamp whose tick has been applied to this medium, lets an event-driven scheduler skip ticks where nothing happens
+        self.scheduler = None       # Set by an event-driven scheduler, which needs to hear about anything that changes this medium from the outside
+        self.link_layer = None      # Set for passive links whose transfers are counted down together by a LinkLayer rather than by tick()
+        self.served = 0             # Rounded throughput since in_transit last changed, split evenly between the transfers in it, which are that much closer to done than their timers say
+        self.finishing = None       # Timestamp no later than the first transfer in transit finishes, as next_event() last worked it out (None if it has to be worked out again)
     # Decide whether we can have the resources to handle an incoming packet at the moment
     def receive(self, packet, one_hop_sender):
+        if self.scheduler: self.scheduler.sync(self)
         if len(self.in_transit) < self.pathways:
             self.receive_clear(packet, one_hop_sender)
         else:
             self.receive_full(packet, one_hop_sender)
+        if self.scheduler: self.scheduler.reschedule(self)
+    # Disable (or re-enable) the medium, used by scenarios to model disruptions.
+    def set_operational(self, operational):
+        if self.scheduler: self.scheduler.sync(self)
+        self.operational = operational
+        if self.link_layer: self.link_layer.set_operational(self, operational)
+        if self.scheduler: self.scheduler.reschedule(self)
     # Initialize a counter for the bytes of data passing through the medium
     def receive_clear(self, packet, one_hop_sender):
-        if packet.dest != -1:
-            print(f'ID={self.id} received packet from ID={one_hop_sender.id if one_hop_sender else None}, source = {packet.source}, dest = {packet.dest}')
-        self.in_transit.append([packet, one_hop_sender, packet.byte_size + self.overhead*self.byte_rate])
+        if tracing.tracer: tracing.tracer.receive(self, packet)
+        work = packet.byte_size + self.overhead*self.byte_rate
+        if metrics.collector: metrics.collector.receive(self, packet, work)
+        if self.link_layer:
+            self.in_transit.append(self.link_layer.add(self, packet, one_hop_sender, work))
+        else:
+            self.settle()
+            if self.finishing is not None and work < min(data[2] for data in self.in_transit): self.finishing = None # Transfers only slow each other down, so only a new one that has less left to go than any other can finish sooner
+            self.in_transit.append([packet, one_hop_sender, work])
+        if tally and packet.content == '': tally.in_transit += 1
     # What do you do if you get a packet but don't currently have the resources available to transport it?
     # The default behavior here is that of a physical link with a sane implementation, which discards such packets (since it's explicitly *not* a computing node, it by definition can't store-and-forward, and it also doesn't have anywhere to send the packet at the moment).
     def receive_full(self, packet, _):
         self.drop_packet(packet, 'medium is full')
     # Model the passage of time.
+    # Transfers share the throughput evenly, and since that only changes when one starts or finishes, each tick just adds to the throughput served since then, and timers are only counted down by settle() when it does.
+    # So the time a transfer finishes only depends on whole-number totals of the throughput, which advance() and next_event() can work out in one go from the running totals of the noise series.
     def tick(self, timestamp):
+        self.clock = timestamp
         if not self.operational: return # If the medium has been disrupted, it can't send anything at all, so the byte processing timers don't tick down
-        for data in self.in_transit:
-            data[2] -= round(self.throughput[timestamp]) / len(self.in_transit) # Tick the timer down.
-            if data[2] <= 0: # If the time it takes for the packet to be handled is done, we get to process it.
-                if data[0].content == '' and random.random() < self.drop[timestamp]:   # PSYCHE we actually dropped this packet
-                    self.drop_packet(data[0], 'random loss')                           # Could be modified to be a function of the data size of the packet
-                    continue
-                if data[0].dest == self.id: # The packet actually got to it's destination, in which case we are done. At the end of the simulation, all of the packets that were generated can be examined to see how things went.
-                    data[0].time_arrived = timestamp
-                    print(f'packet arrived at dest: {self.id}, after {data[0].time_arrived - data[0].time_sent} units of time')
-                self.process(data[0], data[1])
-        self.in_transit = [data for data in self.in_transit if data[2] > 0] # Free up the medium of packets that are finished
-        self.buffering = (self.count_buffers() != 0) # Disable buffering status if all buffers are cleared, enable if some buffers contain packets still
+        in_transit = len(self.in_transit)
+        if in_transit:
+            self.served += round(self.throughput[timestamp])
+            share = self.served / in_transit
+            finished = False
+            for data in self.in_transit:
+                if data[2] - share <= 0: # If the time it takes for the packet to be handled is done, we get to process it.
+                    self.finish(data[0], data[1], timestamp)
+                    finished = True
+                    if tally and data[0].content == '': tally.in_transit -= 1
+            if finished:
+                self.finishing = None
+                self.settle()
+                self.in_transit = [data for data in self.in_transit if data[2] > 0] # Free up the medium of packets that are finished
+                if self.scheduler: self.scheduler.freed(self)
+        buffering = (self.count_buffers() != 0) # Disable buffering status if all buffers are cleared, enable if some buffers contain packets still
+        if tally and buffering != self.buffering: tally.buffering += 1 if buffering else -1
+        self.buffering = buffering
+    # Count the timers of the transfers in the medium down by their share of the throughput served so far, before they change.
+    def settle(self):
+        if self.served and self.in_transit:
+            share = self.served / len(self.in_transit)
+            for data in self.in_transit:
+                data[2] -= share
+        self.served = 0
+    # Hand on a packet whose time in the medium is up.
+    def finish(self, packet, one_hop_sender, timestamp):
+        if packet.content == '' and self.loss_rng.random() < self.drop[timestamp]:   # PSYCHE we actually dropped this packet
+            self.drop_packet(packet, 'random loss')                           # Could be modified to be a function of the data size of the packet
+            return
+        if packet.dest == self.id: # The packet actually got to it's destination, in which case we are done. At the end of the simulation, all of the packets that were generated can be examined to see how things went.
+            packet.time_arrived = timestamp
+            if packet.content == '' and metrics.collector: metrics.collector.deliver(packet, timestamp)
+            if tracing.tracer: tracing.tracer.deliver(self, packet)
+        elif tracing.tracer: tracing.tracer.forward(self, packet)
+        self.process(packet, one_hop_sender)
+    # Apply the effects of the ticks up to and including timestamp, assuming nothing happened in any of them apart from timers counting down.
+    # Subclasses with per-tick state (clocks, counters) extend this so that an event-driven scheduler can skip their idle ticks.
+    def advance(self, timestamp):
+        if timestamp <= self.clock: return
+        if self.operational and self.in_transit:
+            self.served += self.throughput.total(self.clock+1, timestamp+1)
+        self.clock = timestamp
+    # Earliest timestamp (no earlier than the one given) at which a tick of this medium would do anything, or None if it is idle until something outside changes it.
+    # For a plain medium that is just the moment the first packet in transit finishes, found a block of noise at a time from its running totals, with the same arithmetic as tick().
+    # That is kept until a transfer finishes or a new one could finish sooner, as a tick that comes too early because of it just does nothing.
+    def next_event(self, timestamp):
+        if self.buffer:
+            full = len(self.in_transit) >= self.pathways
+            for queue in self.buffer.values(): # Queues get attended to on every tick, unless they are waiting for room elsewhere, or here (which comes with a transfer finishing)
+                if queue and not queue.stalled and not (queue.inbound and full): return timestamp
+            if self.buffering != (self.count_buffers() != 0): return timestamp # The buffering flag is only brought up to date by a tick
+        if not self.operational or not self.in_transit: return None
+        if self.finishing is not None and self.finishing >= timestamp: return self.finishing
+        self.finishing = self.finish_time(timestamp)
+        return self.finishing
+    # The first transfer finishes once the throughput served (a whole number) is enough for tick() to find its share covers what it has left, and since dividing by the number of transfers never takes a larger total to a smaller share, that is from some least total on.
+    def finish_time(self, timestamp):
+        remaining = min(data[2] for data in self.in_transit)
+        if math.isinf(remaining): return None
+        in_transit = len(self.in_transit)
+        needed = math.ceil(remaining * in_transit) # Least total served, give or take the rounding of the product, which is settled with the same arithmetic as tick()
+        while remaining - (needed - 1) / in_transit <= 0: needed -= 1
+        while remaining - needed / in_transit > 0: needed += 1
+        return self.throughput.reach(timestamp, needed - self.served)
     # Media with logic=True will almostly have this method overwritten with a new one that implements logic for a specific routing protocol.
     # The default process() method models the behavior of media that do not have any special logic and behave like a physical link, passively broadcasting to everyone listening
     def process(self, packet, one_hop_sender):
@@ -78,14 +618,22 @@ class Medium:
         for connection in self.connections:
             if connection != one_hop_sender:
                 connection.receive(packet, self)
-    # Drop packet with an output message.
+    # Drop packet, recording why in the trace.
     def drop_packet(self, packet, reason=None):
-        if packet.content == '':
-            if reason:
-                print(f'packet dropped at {self.id} due to: {reason}')
-            else:
-                print(f'packet dropped at {self.id}')
+        if packet.content == '' and metrics.collector: metrics.collector.drop(packet)
+        if tracing.tracer: tracing.tracer.drop(self, packet, reason)
         packet.time_arrived = -1
-    # Count how many packets are in some kind of queue.
+    # Queue an item, dropping whatever the queue's drop policy says has to go.
+    def enqueue(self, queue, item, reason=None):
+        dropped = queue.append(item)
+        if dropped is not None: self.drop_packet(queue.packet(dropped), reason)
+        return dropped
+    # The media that queues are stalled waiting for room in.
+    def stalled(self):
+        return set().union(*(queue.stalled for queue in self.buffer.values()))
+    # Give stalled queues another go at the next tick.
+    def unstall(self):
+        for queue in self.buffer.values(): queue.stalled = set()
+    # Count how many workload packets are in some kind of queue.
     def count_buffers(self):
-        return sum([len(self.buffer[buffer_key]) for buffer_key in self.buffer.keys()])
\ No newline at end of file
+        return sum(queue.workload for queue in self.buffer.values())
\ No newline at end of file
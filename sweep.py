@@ -0,0 +1,135 @@
+import argparse
+import contextlib
+import csv
+import itertools
+import json
+import os
+import signal
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from metrics import Metrics
+from topology import Topology, load_topology
+
+# Run a whole grid of simulations (algorithms x topologies x workloads x scenarios x queue policies x seeds) in parallel, collecting one row per run into a CSV.
+# Every run gets a fresh worker process, so no state leaks from one run into the next, and a run that fails or takes too long just gets recorded as such.
+# Each topology is loaded once and put in shared memory, which the workers attach to instead of loading it themselves.
+# The grid can be given as a JSON file like {"algorithms": ["aodv", "bgp_lite"], "topologies": "*", "scenarios": ["normal"], "queue_policies": ["tail_drop", "red"], "seeds": [0, 1]}, as command line arguments, or both (arguments win).
+# "*" picks everything available, and by default each topology is run with the workload of the same name.
+
+CONFIG_FIELDS = ['algorithm', 'topology', 'workload', 'scenario', 'queue_policy', 'seed']
+RUN_FIELDS = ['status', 'error', 'wall_time']
+REPORT_FIELDS = [field for field in Metrics({}).report(0) if field != 'algorithm']
+
+class RunTimeout(Exception):
+    pass
+
+# Work out the list of run configurations a grid specification stands for.
+def expand(spec):
+    import main # Deferred, since importing it sets up the simulation
+    available = {'algorithms': main.algorithms, 'topologies': main.topologies, 'workloads': main.workloads, 'scenarios': main.scenarios, 'queue_policies': list(main.QUEUE_POLICIES)}
+    def pick(key, default):
+        values = spec.get(key, default)
+        if values == '*': values = available[key]
+        if isinstance(values, str): values = [values]
+        for value in values:
+            if key in available and value not in available[key]:
+                raise RuntimeError(f'Sweep: {value} is not one of the available {key}, expected one of {available[key]}')
+        return list(values)
+    algorithms = pick('algorithms', [main.ALGORITHM])
+    topologies = pick('topologies', [main.TOPOLOGY])
+    scenarios = pick('scenarios', [main.SCENARIO])
+    queue_policies = pick('queue_policies', [main.QUEUE_POLICY])
+    seeds = pick('seeds', [main.SEED])
+    workloads = pick('workloads', None) if spec.get('workloads') else None
+    configs = []
+    for algorithm, topology, scenario, queue_policy, seed in itertools.product(algorithms, topologies, scenarios, queue_policies, seeds):
+        for workload in workloads or [topology]:
+            if workload not in available['workloads']:
+                raise RuntimeError(f'Sweep: topology {topology} has no workload of the same name, give workloads explicitly')
+            configs.append({'algorithm': algorithm, 'topology': topology, 'workload': workload, 'scenario': scenario, 'queue_policy': queue_policy, 'seed': seed})
+    return configs
+
+# Run a single configuration (in a worker process), returning its row of results.
+# shared is the description of the run's topology in shared memory (see Topology.share()), if there is one.
+def run(config, limit=None, timeout=None, shared=None):
+    def expire(signum, frame):
+        raise RunTimeout(f'run took longer than {timeout}s')
+    row = dict(config, status='ok', error='')
+    start = time.perf_counter()
+    if timeout:
+        signal.signal(signal.SIGALRM, expire)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    compiled = Topology.attach(shared) if shared else None
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            import main
+            report = main.main(limit=limit, compiled=compiled, **config)
+        row.update((field, report[field]) for field in REPORT_FIELDS)
+    except RunTimeout as e:
+        row.update(status='timeout', error=str(e))
+    except Exception:
+        row.update(status='error', error=traceback.format_exc(limit=-3).strip())
+    finally:
+        if timeout: signal.setitimer(signal.ITIMER_REAL, 0)
+        if compiled: compiled.close()
+    row['wall_time'] = time.perf_counter() - start
+    return row
+
+# Run every configuration on a pool of workers, writing rows to the output CSV as they finish (so a partial sweep still leaves results behind).
+def sweep(configs, output, workers=None, limit=None, timeout=None):
+    fields = CONFIG_FIELDS + RUN_FIELDS + REPORT_FIELDS
+    counts = {}
+    topologies = {topology: load_topology(topology) for topology in sorted({config['topology'] for config in configs})}
+    shared = {}
+    try:
+        for topology, compiled in topologies.items():
+            shared[topology] = compiled.share()
+        with open(output, 'w', newline='') as results, ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=1) as pool:
+            writer = csv.DictWriter(results, fieldnames=fields)
+            writer.writeheader()
+            futures = {pool.submit(run, config, limit, timeout, shared[config['topology']]): config for config in configs}
+            for future in as_completed(futures):
+                try:
+                    row = future.result()
+                except Exception as e: # The worker itself died (killed, out of memory, ...)
+                    row = dict(futures[future], status='crashed', error=repr(e))
+                writer.writerow(row)
+                results.flush()
+                counts[row['status']] = counts.get(row['status'], 0) + 1
+                print(f'[{sum(counts.values())}/{len(configs)}] {row["status"]}: {" ".join(str(futures[future][field]) for field in CONFIG_FIELDS)}')
+    finally:
+        for compiled in topologies.values(): # The shared memory outlives the workers, so it has to be given back here
+            compiled.close()
+            compiled.unlink()
+    return counts
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Run a grid of simulations in parallel and collect the results into a CSV.')
+    parser.add_argument('grid', nargs='?', help='JSON file with the grid specification')
+    parser.add_argument('--algorithms', nargs='+')
+    parser.add_argument('--topologies', nargs='+')
+    parser.add_argument('--workloads', nargs='+', help='workloads to run every topology with (default: the workload named after the topology)')
+    parser.add_argument('--scenarios', nargs='+')
+    parser.add_argument('--queue-policies', nargs='+')
+    parser.add_argument('--seeds', nargs='+', type=int)
+    parser.add_argument('--limit', type=int, help='time limit of each simulation (default: LIMIT in main.py)')
+    parser.add_argument('--workers', type=int, help='number of worker processes (default: one per core)')
+    parser.add_argument('--timeout', type=float, help='wall time in seconds after which a run is abandoned')
+    parser.add_argument('--output', default='sweep.csv')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    spec = {}
+    if args.grid:
+        with open(args.grid, 'r') as grid:
+            spec = json.load(grid)
+    for key in ('algorithms', 'topologies', 'workloads', 'scenarios', 'queue_policies', 'seeds'):
+        values = getattr(args, key)
+        if values: spec[key] = '*' if values == ['*'] else values
+    configs = expand(spec)
+    print(f'RUNNING {len(configs)} SIMULATIONS')
+    counts = sweep(configs, args.output, args.workers, args.limit, args.timeout)
+    print(f'DONE, {", ".join(f"{count} {status}" for status, count in counts.items())}, results in {args.output}')
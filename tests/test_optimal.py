@@ -0,0 +1,28 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT) # main.py finds its algorithms, topologies and workloads relative to where it runs
+
+import pytest
+
+import main
+import metrics
+
+# No packet of a real run may get to its destination faster than the lower bound on its latency says any routing algorithm could.
+@pytest.mark.parametrize('algorithm, topology, scenario, limit', [
+    ('baseline_fast', '100_hosts_procedural_5', 'normal', 3000), # Its noise takes media well above their mean byte_rate
+    ('aodv', '20_hosts_procedural_1', 'disruption', 3000),
+])
+def test_latencies_above_bounds(monkeypatch, algorithm, topology, scenario, limit):
+    latencies = []
+    deliver = metrics.Metrics.deliver
+    def record(self, packet, timestamp):
+        if not packet.delivered: latencies.append((timestamp - packet.time_sent, self.bounds.latency(packet.source, packet.dest, packet.byte_size)))
+        deliver(self, packet, timestamp)
+    monkeypatch.setattr(metrics.Metrics, 'deliver', record)
+    monkeypatch.setattr(main, 'LOWER_BOUNDS', True)
+    main.main(algorithm, topology, topology, scenario, limit=limit)
+    assert latencies
+    assert all(bound is not None and latency >= bound for latency, bound in latencies)
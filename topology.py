@@ -0,0 +1,103 @@
+import hashlib
+import os
+import shutil
+import numpy as np
+from multiprocessing import shared_memory
+
+# Compiled form of a topology CSV: one NumPy array per medium attribute (in the order of the rows), plus the connections between media as a CSR adjacency.
+# Parsing the CSV is slow for big topologies and every run used to do it again, so the arrays are built the first time a topology is loaded and kept in a cache directory, keyed by a hash of the CSV so that editing it gets them rebuilt.
+# Cached arrays are .npy files that get memory mapped, so parallel runs share the same pages, and they can also be put in shared memory for processes to attach to.
+
+FIELDS = ('ids', 'pathways', 'overhead', 'byte_rate', 'drop_rate', 'logic', 'indptr', 'indices')
+FORMAT = 'topology-v1' # bump whenever the compiled layout changes, so old caches aren't used
+
+class Topology:
+    def __init__(self, arrays, shared=None):
+        for field in FIELDS:
+            setattr(self, field, arrays[field])
+        self.shared = shared or [] # shared memory blocks the arrays live in, if any
+    def __len__(self):
+        return len(self.ids)
+    def arrays(self):
+        return {field: getattr(self, field) for field in FIELDS}
+    # Ids of the media the medium in the given row is connected to, in the order they should be in its connections list.
+    def neighbors(self, row):
+        return self.indices[self.indptr[row]:self.indptr[row+1]]
+    # Copy the arrays into shared memory, returning a description that other processes can attach() to (and that is small enough to pickle).
+    # The caller owns the shared memory, and should close() the topology and unlink() it once everyone is done with it.
+    def share(self):
+        description = {}
+        for field, array in self.arrays().items():
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+            self.shared.append(block)
+            description[field] = (block.name, array.shape, array.dtype.str)
+        return description
+    @staticmethod
+    def attach(description):
+        arrays = {}
+        shared = []
+        for field, (name, shape, dtype) in description.items():
+            block = shared_memory.SharedMemory(name=name)
+            arrays[field] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+            shared.append(block)
+        return Topology(arrays, shared)
+    def close(self):
+        for block in self.shared: block.close()
+    def unlink(self):
+        for block in self.shared: block.unlink()
+
+# Parse a topology CSV into a Topology.
+# Rows are id, pathways, overhead, byte_rate, drop_rate, logic, and optionally the connections of the medium as "[id id ...]".
+# A connection only needs to be listed on one of its ends, and the adjacency lists both directions, in the same order connections have always been added to media in.
+def compile_topology(filename):
+    rows = []
+    with open(filename, 'r') as topology_file:
+        for line in topology_file:
+            line = line.strip()
+            if len(line) == 0 or line[0] == '#': continue
+            rows.append(line.split(','))
+    ids = np.array([int(row[0]) for row in rows], dtype=np.int32)
+    connections = set()
+    for row in rows:
+        if len(row) == 7:
+            for connected_id in row[6].split('[')[1].split(']')[0].split(' '):
+                connections.add((int(row[0]), int(connected_id)))
+    adjacency = {id: [] for id in ids.tolist()}
+    for a, b in connections:
+        if a not in adjacency or b not in adjacency: raise RuntimeError(f'Topology: {filename} connects {a} and {b}, but only one of them exists')
+        adjacency[a].append(b)
+        adjacency[b].append(a)
+    arrays = {
+        'ids': ids,
+        'pathways': np.array([int(row[1]) for row in rows], dtype=np.int32),
+        'overhead': np.array([int(row[2]) for row in rows], dtype=np.int32),
+        'byte_rate': np.array([int(row[3]) for row in rows], dtype=np.int64),
+        'drop_rate': np.array([float(row[4]) for row in rows], dtype=np.float64),
+        'logic': np.array([int(row[5]) for row in rows], dtype=bool),
+        'indptr': np.zeros(len(rows) + 1, dtype=np.int64),
+        'indices': np.array([neighbor for id in ids.tolist() for neighbor in adjacency[id]], dtype=np.int32),
+    }
+    arrays['indptr'][1:] = np.cumsum([len(adjacency[id]) for id in ids.tolist()])
+    return Topology(arrays)
+
+# Load a topology by name from the topologies directory, compiling it into the cache first if it isn't there already (or the CSV has changed since).
+# With cache=None the CSV is just compiled in memory.
+def load_topology(name, directory='topologies', cache='topology_cache', mmap=True):
+    filename = os.path.join(directory, f'{name}.csv')
+    if cache is None: return compile_topology(filename)
+    with open(filename, 'rb') as topology_file:
+        key = hashlib.sha256(FORMAT.encode() + topology_file.read()).hexdigest()[:16]
+    path = os.path.join(cache, f'{name}-{key}')
+    if not os.path.exists(path):
+        topology = compile_topology(filename)
+        partial = f'{path}.{os.getpid()}.partial'
+        os.makedirs(partial, exist_ok=True)
+        for field, array in topology.arrays().items():
+            np.save(os.path.join(partial, f'{field}.npy'), array)
+        try:
+            os.rename(partial, path) # Atomic, so that parallel runs racing to compile the same topology never see half of one
+        except OSError:
+            shutil.rmtree(partial) # Somebody else got there first
+        if not mmap: return topology
+    return Topology({field: np.load(os.path.join(path, f'{field}.npy'), mmap_mode='r' if mmap else None) for field in FIELDS})
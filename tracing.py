@@ -0,0 +1,115 @@
+import json
+import os
+import random
+import numpy as np
+
+# Tracing of what happens to packets as the simulation runs, for offline analysis.
+# Events are written into a preallocated binary buffer, one row per event, and flushed to disk in bulk whenever it fills up (or kept as a ring of the most recent events, if there is no file to flush to).
+# On disk a trace is a directory with one raw file per column plus a small json description, so a column can be loaded into a NumPy array without touching the rest.
+# When tracing is off (tracer is None) the cost at each call site is a single check, and event types that aren't enabled are skipped before anything gets recorded.
+
+RECEIVE = 0 # a medium started working on a packet
+DELIVER = 1 # a packet reached its destination
+DROP = 2    # a packet was dropped
+FORWARD = 3 # a medium finished with a packet and handed it on
+EVENTS = ('receive', 'deliver', 'drop', 'forward')
+
+COLUMNS = np.dtype([
+    ('time', '<i4'),    # timestamp of the event
+    ('event', 'u1'),    # one of the event types above
+    ('medium', '<i4'),  # id of the medium the event happened at
+    ('source', '<i4'),  # source of the packet
+    ('dest', '<i4'),    # destination of the packet (-1 for broadcasts)
+    ('size', '<i4'),    # size of the packet in bytes
+    ('sent', '<i4'),    # timestamp the packet was sent at
+    ('control', 'u1'),  # 1 for routing protocol traffic, 0 for workload packets
+    ('reason', 'u1'),   # for drops, index into the trace's list of drop reasons
+])
+
+tracer = None
+
+# Start tracing, to the given directory (or into memory only, if path is None).
+# events is the names of the event types to record, and sample is the fraction of them to record (chosen at random, with a generator of its own so that tracing never changes the course of a simulation).
+def tracing_init(path=None, events=EVENTS, sample=1, capacity=1 << 16, seed=0):
+    global tracer
+    if tracer: tracer.close()
+    tracer = Tracer(path, events, sample, capacity, seed)
+    return tracer
+
+# Stop tracing, flushing whatever is still buffered.
+def tracing_close():
+    global tracer
+    if tracer: tracer.close()
+    tracer = None
+
+class Tracer:
+    def __init__(self, path, events, sample, capacity, seed):
+        for event in events:
+            if event not in EVENTS: raise RuntimeError(f'Tracer: unknown event type {event}, expected one of {EVENTS}')
+        self.path = path
+        self.enabled = [event in events for event in EVENTS]
+        self.sample = sample
+        self.rng = random.Random(seed)
+        self.buffer = np.zeros(capacity, dtype=COLUMNS)
+        self.count = 0      # rows in the buffer
+        self.recorded = 0   # events recorded overall
+        self.reasons = {}   # drop reason : index
+        self.now = 0        # current timestamp, kept up to date by whatever is running the simulation
+        if path:
+            os.makedirs(path, exist_ok=True)
+            for name in COLUMNS.names:
+                open(os.path.join(path, f'{name}.bin'), 'wb').close()
+    def record(self, event, medium, packet, reason=None):
+        if not self.enabled[event]: return
+        if self.sample < 1 and self.rng.random() >= self.sample: return
+        if self.count == len(self.buffer):
+            if self.path: self.flush()
+            else: self.count = 0 # Without a file, wrap around and keep only the most recent events
+        code = 0
+        if reason is not None:
+            code = self.reasons.get(reason)
+            if code is None: code = self.reasons[reason] = len(self.reasons)
+        self.buffer[self.count] = (self.now, event, medium.id, packet.source, packet.dest, packet.byte_size, packet.time_sent, packet.content != '', code)
+        self.count += 1
+        self.recorded += 1
+    def receive(self, medium, packet):
+        self.record(RECEIVE, medium, packet)
+    def deliver(self, medium, packet):
+        self.record(DELIVER, medium, packet)
+    def drop(self, medium, packet, reason):
+        self.record(DROP, medium, packet, reason or '')
+    def forward(self, medium, packet):
+        self.record(FORWARD, medium, packet)
+    # Append the buffered events to the columns on disk.
+    def flush(self):
+        if not self.path: return
+        for name in COLUMNS.names:
+            with open(os.path.join(self.path, f'{name}.bin'), 'ab') as column:
+                column.write(np.ascontiguousarray(self.buffer[name][:self.count]).tobytes())
+        self.count = 0
+    def close(self):
+        if not self.path: return
+        self.flush()
+        with open(os.path.join(self.path, 'trace.json'), 'w') as description:
+            json.dump({'columns': [[name, COLUMNS[name].str] for name in COLUMNS.names], 'events': EVENTS, 'reasons': sorted(self.reasons, key=self.reasons.get), 'recorded': self.recorded}, description)
+    # The events currently held in memory, oldest first, as a dict of column name : array.
+    def events(self):
+        if self.path or self.recorded <= len(self.buffer):
+            rows = self.buffer[:self.count]
+        else:
+            rows = np.concatenate((self.buffer[self.count:], self.buffer[:self.count]))
+        return {name: rows[name].copy() for name in COLUMNS.names}
+
+# Load a trace written to disk, as a dict of column name : array, plus 'events' and 'reasons' with the names the event and reason codes stand for.
+# With mmap=True the columns are memory mapped rather than read in.
+def read_trace(path, mmap=False):
+    with open(os.path.join(path, 'trace.json'), 'r') as description:
+        description = json.load(description)
+    trace = {'events': description['events'], 'reasons': description['reasons']}
+    for name, dtype in description['columns']:
+        filename = os.path.join(path, f'{name}.bin')
+        if mmap and os.path.getsize(filename):
+            trace[name] = np.memmap(filename, dtype=dtype, mode='r')
+        else:
+            trace[name] = np.fromfile(filename, dtype=dtype)
+    return trace
@@ -6,8 +6,6 @@ import numpy as np
 color_vals = plt.get_cmap('rainbow')
 color_vals = {i:color_vals(i/7) for i in range(0,7)}
 
-inverted_color_vals = {v:k for k,v in color_vals.items()}
-
 # Make a graph representation of a simulated network.
 def make_graph(media):
     G = nx.Graph()
@@ -22,28 +20,44 @@ def make_graph(media):
             #print(medium.id)
     return G, ids
 
-# Get the correct coloring for each aspect of the graph at a given moment.
-def make_colors(media):
-    node_colors = []
-    edge_colors = {}
-    for key in media:
-        medium = media[key]
-        density = len(medium.in_transit)
-        if medium.logic == True:
-            density += medium.count_buffers()
-        color = color_vals[min(density, 5)]
-        if medium.logic == False and len(medium.connections) == 2:
-            edge_colors[medium.id] = color
+# Number of density codes, a medium with this many packets (or more) in transit or queued gets the last one.
+DENSITY_CODES = 6
+
+# Records how busy every medium is over the course of a simulation, as a (frames x media) array of uint8 density codes, one frame every stride units of time.
+# The array is allocated up front for the given time limit, optionally as a memory mapped .npy file so long runs don't have to fit in memory, and codes are only turned into colors when rendering.
+class FrameRecorder:
+    def __init__(self, media, limit, stride=1, path=None):
+        self.media = list(media.values()) # column order
+        self.stride = stride
+        shape = (limit // stride + 1, len(self.media))
+        if path:
+            self.codes = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=shape)
         else:
-            node_colors.append(color)
-    return node_colors, edge_colors
+            self.codes = np.zeros(shape, dtype=np.uint8)
+        self.count = 0
+    # Record the frame for the given timestamp (which should be a multiple of the stride).
+    def record(self, timestamp):
+        frame = timestamp // self.stride
+        if frame >= len(self.codes): raise RuntimeError(f'FrameRecorder: timestamp {timestamp} is past the {len(self.codes)} frames allocated')
+        densities = np.fromiter((len(medium.in_transit) + (medium.count_buffers() if medium.logic else 0) for medium in self.media), dtype=np.int64, count=len(self.media))
+        self.codes[frame] = np.minimum(densities, DENSITY_CODES - 1)
+        self.count = max(self.count, frame + 1)
+    # The frames recorded so far.
+    def frames(self):
+        return self.codes[:self.count]
+    def close(self):
+        if isinstance(self.codes, np.memmap): self.codes.flush()
 
 # Create an animated visualization of what the network is doing
 # Visualization makes the most sense for using on smallish networks, obviously, but gives a solid intuition about what's actually going on
 # A bit of help from https://stackoverflow.com/questions/50376066/what-tool-to-draw-an-animated-network-graph
-def animate_network(media, node_colors_animated, edge_colors_animated, show_labels=False):
+def animate_network(media, frames, show_labels=False):
     G, ids = make_graph(media)
     pos = nx.spring_layout(G)
+    columns = {medium.id: i for i, medium in enumerate(media.values())} # frames have a column per medium, in the order of media
+    node_columns = [columns[ids[node]] for node in G.nodes()]
+    edge_columns = [columns[G[u][v]['id']] for u,v in G.edges()]
+    palette = np.array([color_vals[code] for code in range(DENSITY_CODES)])
 
     # draw graph
     #nodes = nx.draw_networkx_nodes(G, pos)
@@ -56,18 +70,18 @@ def animate_network(media, node_colors_animated, edge_colors_animated, show_labe
 
     def update(ii):
         fig.clear()
-        nodes = nx.draw_networkx_nodes(G, pos, node_color=node_colors_animated[ii])
-        edges = nx.draw_networkx_edges(G, pos, width=2, edge_color=[edge_colors_animated[ii][G[u][v]['id']] for u,v in G.edges()])
+        nodes = nx.draw_networkx_nodes(G, pos, node_color=palette[frames[ii, node_columns]])
+        edges = nx.draw_networkx_edges(G, pos, width=2, edge_color=palette[frames[ii, edge_columns]])
         if show_labels:
             labels = nx.draw_networkx_labels(G, pos, labels=ids)
             edge_lables = nx.draw_networkx_edge_labels(G, pos, edge_labels={(u,v):G[u][v]['id'] for u,v in G.edges()})
-        #labels = nx.draw_networkx_labels(G, pos, labels={i+1:inverted_color_vals[node_colors_animated[ii][i]] for i in range(len(G.nodes))})
+        #labels = nx.draw_networkx_labels(G, pos, labels={node:frames[ii, column] for node, column in zip(G.nodes(), node_columns)})
         plt.axis('off')
         # nodes are just markers returned by plt.scatter;
         # node color can hence be changed in the same way like marker colors
-        #nodes.set_array(node_colors_animated[ii])
-        #edges.set_array(edge_colors_animated[ii])
+        #nodes.set_array(frames[ii, node_columns])
+        #edges.set_array(frames[ii, edge_columns])
         #return nodes, edges
 
-    animation = FuncAnimation(fig, update, interval=50, frames=len(node_colors_animated)) #, blit=True)
+    animation = FuncAnimation(fig, update, interval=50, frames=len(frames)) #, blit=True)
     plt.show()
\ No newline at end of file
@@ -0,0 +1,110 @@
+import itertools
+import numpy as np
+
+import metrics
+from simulation import Packet
+
+# Traffic workloads: rows of (start_time, source, dest, byte_size), sorted by start_time.
+# A workload is either a CSV with one row per line, or a binary file of raw little-endian rows (marked by MAGIC at the start), which is much quicker to read and write for workloads of millions of packets.
+# Either way it is read a chunk of rows at a time and handed out in batches covering a window of time each, so memory depends on how busy the busiest window is rather than on how big the workload is.
+
+COLUMNS = np.dtype([('time', '<i4'), ('source', '<i4'), ('dest', '<i4'), ('size', '<i4')])
+MAGIC = b'WORKLD01'
+
+CHUNK = 65536 # rows read from the file at a time
+WINDOW = 1000 # span of time each batch of rows covers
+
+# Writes rows (arrays with the COLUMNS dtype) to a workload file, in whichever format.
+class WorkloadWriter:
+    def __init__(self, filename, binary=False):
+        self.binary = binary
+        self.file = open(filename, 'wb' if binary else 'w')
+        self.written = 0
+        if binary: self.file.write(MAGIC)
+    def write(self, rows):
+        if self.binary:
+            self.file.write(np.ascontiguousarray(rows, dtype=COLUMNS).tobytes())
+        else:
+            self.file.write(''.join(f'{time}, {source}, {dest}, {size}\n' for time, source, dest, size in zip(*(rows[name].tolist() for name in COLUMNS.names))))
+        self.written += len(rows)
+    def close(self):
+        self.file.close()
+
+# Read the rows of a workload file in chunks of up to the given size, checking that they are sorted as they go by.
+def read_chunks(filename, chunk=CHUNK):
+    with open(filename, 'rb') as workload_file:
+        binary = workload_file.read(len(MAGIC)) == MAGIC
+    last = None
+    with open(filename, 'rb' if binary else 'r') as workload_file:
+        if binary: workload_file.seek(len(MAGIC))
+        while True:
+            if binary:
+                rows = np.fromfile(workload_file, dtype=COLUMNS, count=chunk)
+                if len(rows) == 0: return
+            else:
+                lines = list(itertools.islice(workload_file, chunk))
+                if len(lines) == 0: return
+                lines = [line for line in lines if line.strip() and line.lstrip()[0] != '#']
+                if len(lines) == 0: continue
+                values = np.loadtxt(lines, delimiter=',', dtype=np.int64, ndmin=2)
+                rows = np.zeros(len(values), dtype=COLUMNS)
+                for i, name in enumerate(COLUMNS.names):
+                    rows[name] = values[:, i]
+            times = rows['time']
+            out_of_order = np.flatnonzero(np.diff(times) < 0)
+            if len(out_of_order):
+                raise RuntimeError(f'Workload: rows must be sorted by start time, {times[out_of_order[0]+1]} comes after {times[out_of_order[0]]}')
+            if last is not None and times[0] < last:
+                raise RuntimeError(f'Workload: rows must be sorted by start time, {times[0]} comes after {last}')
+            last = times[-1]
+            yield rows
+
+# Read the rows of a workload file as batches covering window units of time each, yielding (start of the window, rows starting in it) for every window that has any.
+def read_windows(filename, window=WINDOW, chunk=CHUNK):
+    pending = []
+    start = None
+    for rows in read_chunks(filename, chunk):
+        if start is None: start = rows['time'][0] // window * window
+        while rows['time'][-1] >= start + window:
+            split = np.searchsorted(rows['time'], start + window)
+            pending.append(rows[:split])
+            batch = np.concatenate(pending)
+            if len(batch): yield start, batch
+            pending = []
+            rows = rows[split:]
+            start = rows['time'][0] // window * window
+        pending.append(rows)
+    if pending:
+        yield start, np.concatenate(pending)
+
+# A workload being injected into a simulation, read a window at a time as the simulation reaches it.
+# Packets are only created when they get injected, so the cost of stepping through the workload does not depend on how big it is.
+class Workload:
+    def __init__(self, filename, window=WINDOW, chunk=CHUNK):
+        self.batches = read_windows(filename, window, chunk)
+        self.injected = 0 # number of packets injected so far
+        self.next_batch()
+    # Move on to the next batch of rows, or to an empty one once we run out.
+    def next_batch(self):
+        rows = next(self.batches, (None, np.zeros(0, dtype=COLUMNS)))[1]
+        self.times, self.sources, self.dests, self.sizes = (rows[name].tolist() for name in COLUMNS.names)
+        self.cursor = 0 # the next row that has not been injected yet
+    # Start time of the next packet to inject, or None if all of them have been injected.
+    def next_time(self):
+        return self.times[self.cursor] if self.cursor < len(self.times) else None
+    # Whether every packet in the workload has been injected.
+    def exhausted(self):
+        return self.cursor >= len(self.times)
+    # Create the packets that are due to be injected at the given time.
+    # Packets whose start time has already gone by without being injected are skipped, just like a loop checking for start_time == timestamp would.
+    def pop(self, timestamp):
+        packets = []
+        while self.cursor < len(self.times) and self.times[self.cursor] <= timestamp:
+            if self.times[self.cursor] == timestamp:
+                packet = Packet(self.sources[self.cursor], self.dests[self.cursor], size=self.sizes[self.cursor])
+                packets.append(packet)
+                self.injected += 1
+                if metrics.collector: metrics.collector.send(packet)
+            self.cursor += 1
+            if self.cursor == len(self.times): self.next_batch()
+        return packets